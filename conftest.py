@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# test_font_fix.py / test_user_fonts.py 是在 Windows 上手动运行的出片脚本，导入即调用本机 ffmpeg，不参与 pytest 收集
+collect_ignore = ["test_font_fix.py", "test_user_fonts.py"]
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森磁盘缓存
+DiskCache: 按内容键存放中间文件，总大小超限时按最近使用时间淘汰（LRU）
+MezzanineCache: 把轮换复用的 B 片段预先转成 1080x1920@30 标准中间件，后续任务直接复用
+TitleCache: 每种标题样式只光栅化一次成透明 PNG 图层，成片里用 overlay 叠加
+AudioBedCache: 解说和循环 BGM 预先解码成无损音轨，共用同一路音频的任务不再各自解码、循环
+"""
+import hashlib
+import math
+import os
+import threading
+
+from nelson_graph import WIDTH, normalize, title_band, title_image_filter
+from nelson_probe import DEFAULT_CACHE_DIR
+from nelson_runner import run_ffmpeg
+
+# B 片段标准化链路，与批处理滤镜图中 [1:v] 的处理保持一致
+NORMALIZE_CHAIN = ",".join(str(f) for f in normalize())
+# 默认中间件编码：高质量近无损，只作为滤镜图输入
+MEZZANINE_ENCODE = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '14', '-pix_fmt', 'yuv420p']
+# 底轨无损保存，成片里只有最终一次有损音频编码
+BED_ENCODE = ['-c:a', 'flac', '-ar', '48000']
+# 底轨长度按这个粒度向上取整（秒），时长相近的任务共用同一条底轨
+BED_STEP = 10
+
+
+def content_key(*parts):
+    """把任意参数拼成稳定的缓存键"""
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def source_key(file_path):
+    """源文件身份：绝对路径 + 大小 + 修改时间，源文件一变缓存自然失效"""
+    st = os.stat(file_path)
+    return content_key(os.path.abspath(file_path), st.st_size, st.st_mtime)
+
+
+class DiskCache:
+    """
+    目录式 LRU 缓存，文件名为 "<分组>_<键>.<扩展名>"
+    命中时刷新文件修改时间，淘汰时按修改时间从旧到新删除
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def key_lock(self, key):
+        """同一个键同时只允许一个线程生成，其余线程等待后直接命中"""
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def path_for(self, group, key, ext):
+        return os.path.join(self.cache_dir, f"{group}_{key}.{ext}")
+
+    def lookup(self, group, key, ext):
+        path = self.path_for(group, key, ext)
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def commit(self, tmp_path, group, key, ext):
+        """把生成好的临时文件原子改名进缓存，并清理同分组的旧版本"""
+        path = self.path_for(group, key, ext)
+        os.replace(tmp_path, path)
+        with self._lock:
+            for fn in os.listdir(self.cache_dir):
+                if fn.startswith(group + "_") and os.path.join(self.cache_dir, fn) != path:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, fn))
+                    except OSError:
+                        pass
+        self.evict()
+        return path
+
+    def evict(self):
+        """总大小超过上限时删除最久未使用的文件"""
+        with self._lock:
+            entries = []
+            for fn in os.listdir(self.cache_dir):
+                fp = os.path.join(self.cache_dir, fn)
+                if fn.endswith(".tmp") or not os.path.isfile(fp):
+                    continue
+                st = os.stat(fp)
+                entries.append((st.st_mtime, st.st_size, fp))
+            total = sum(e[1] for e in entries)
+            for _, size, fp in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(fp)
+                    total -= size
+                except OSError:
+                    pass
+
+
+class MezzanineCache(DiskCache):
+    """B 片段标准化中间件缓存，每个 B 片段只解码缩放一次"""
+
+    def __init__(self, ffmpeg_path, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "mezzanine"),
+                 max_bytes=8 * 1024 ** 3):
+        super().__init__(cache_dir, max_bytes)
+        self.ffmpeg_path = ffmpeg_path
+
+    def get(self, src_path, threads=0, encode_args=MEZZANINE_ENCODE, job_id=None):
+        """
+        返回标准化后的中间件路径，首次调用时转码生成；失败或被取消时返回 None
+        encode_args 不同的中间件（如智能渲染用的可直接拷贝版本）各自独立缓存，job_id 用于随任务一起取消
+        """
+        group = content_key(os.path.abspath(src_path), *encode_args)
+        key = content_key(source_key(src_path), NORMALIZE_CHAIN, *encode_args)
+        hit = self.lookup(group, key, "mp4")
+        if hit:
+            return hit
+        with self.key_lock(key):
+            hit = self.lookup(group, key, "mp4")
+            if hit:
+                return hit
+            tmp_path = self.path_for(group, key, "mp4") + ".tmp"
+            # B 的原声在成片里不使用，中间件直接去掉音轨
+            cmd = [self.ffmpeg_path, '-y', '-v', 'error', '-i', src_path, '-vf', NORMALIZE_CHAIN, '-an',
+                   *encode_args, '-threads', str(threads), '-f', 'mp4', tmp_path]
+            result = run_ffmpeg(cmd, job_id=job_id)
+            if result.returncode != 0:
+                print("中间件生成失败：", result.stderr)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return None
+            return self.commit(tmp_path, group, key, "mp4")
+
+
+class TitleCache(DiskCache):
+    """
+    预渲染标题图层缓存：文字/字体/颜色/字号/描边相同的任务共用同一张 RGBA 图，
+    固定颜色时整批只调用一次 drawtext
+    """
+
+    def __init__(self, ffmpeg_path, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "titles"),
+                 max_bytes=256 * 1024 ** 2):
+        super().__init__(cache_dir, max_bytes)
+        self.ffmpeg_path = ffmpeg_path
+
+    def get(self, font, text, color, size, border, border_color, fontfile=None, job_id=None):
+        """返回标题图层 PNG 路径，首次调用时生成；失败或被取消时返回 None"""
+        drawtext = str(title_image_filter(font, text, color, size, border, border_color, fontfile=fontfile))
+        height, _ = title_band(size, border)
+        # 字体文件被替换时图层随之失效
+        font_id = source_key(fontfile) if fontfile and os.path.exists(fontfile) else font
+        group = content_key(font_id, drawtext)
+        key = content_key(WIDTH, height)
+        hit = self.lookup(group, key, "png")
+        if hit:
+            return hit
+        with self.key_lock(group):
+            hit = self.lookup(group, key, "png")
+            if hit:
+                return hit
+            tmp_path = self.path_for(group, key, "png") + ".tmp"
+            cmd = [self.ffmpeg_path, '-y', '-v', 'error', '-f', 'lavfi',
+                   '-i', f"color=c=black@0.0:s={WIDTH}x{height},format=rgba", '-vf', drawtext,
+                   '-frames:v', '1', '-update', '1', '-c:v', 'png', '-f', 'image2', tmp_path]
+            result = run_ffmpeg(cmd, job_id=job_id)
+            if result.returncode != 0 or not os.path.exists(tmp_path):
+                print("标题图层生成失败：", result.stderr)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return None
+            return self.commit(tmp_path, group, key, "png")
+
+
+class AudioBedCache(DiskCache):
+    """
+    解说 / 循环 BGM 底轨缓存：每路单独解码成无损音轨，键为 (源文件, 是否循环, 时长档)
+    音量和混音仍在成片里按三路 amix 做，解说提前结束后的归一化比例与直接混音完全一致，
+    音量不进整数 FLAC，大音量也不会在混音前被削波
+    """
+
+    def __init__(self, ffmpeg_path, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "beds"),
+                 max_bytes=2 * 1024 ** 3):
+        super().__init__(cache_dir, max_bytes)
+        self.ffmpeg_path = ffmpeg_path
+
+    def get(self, voice_path, bgm_path, duration, threads=0, job_id=None):
+        """返回 (解说音轨, 循环 BGM 音轨)，都至少覆盖 duration 秒；任一路失败或被取消时返回 None"""
+        length = max(1, math.ceil(duration / BED_STEP)) * BED_STEP
+        voice = self.track(voice_path, length, threads=threads, job_id=job_id)
+        if not voice:
+            return None
+        bgm = self.track(bgm_path, length, loop=True, threads=threads, job_id=job_id)
+        return (voice, bgm) if bgm else None
+
+    def track(self, src_path, length, loop=False, threads=0, job_id=None):
+        """把 src_path 解码（loop=True 时循环）成 length 秒的无损音轨，返回缓存路径，失败时返回 None"""
+        group = content_key(source_key(src_path), loop, length)
+        key = content_key(*BED_ENCODE)
+        hit = self.lookup(group, key, "flac")
+        if hit:
+            return hit
+        with self.key_lock(group):
+            hit = self.lookup(group, key, "flac")
+            if hit:
+                return hit
+            tmp_path = self.path_for(group, key, "flac") + ".tmp"
+            cmd = [self.ffmpeg_path, '-y', '-v', 'error', *(['-stream_loop', '-1'] if loop else []), '-i', src_path,
+                   '-map', '0:a:0', '-vn', *BED_ENCODE, '-threads', str(threads),
+                   '-t', str(length), '-f', 'flac', tmp_path]
+            result = run_ffmpeg(cmd, job_id=job_id)
+            if result.returncode != 0:
+                print("音频底轨生成失败：", result.stderr)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return None
+            return self.commit(tmp_path, group, key, "flac")
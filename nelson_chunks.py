@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森分段并行编码
+单个 x264 进程的线程数超过几个之后几乎不再提速，几分钟长的 A+B 成片会成为整批最后收尾的那一路。
+长任务按关键帧网格对齐的切点把成片时间轴切成若干段，各段在独立进程里并行编码，
+再用 concat 分离器无损拼接并混音（与智能渲染的最后一步相同）
+"""
+import math
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from nelson_graph import TitleLayer, chunk_graph
+from nelson_inputs import XFADE_DUR, plan_chunk_inputs
+from nelson_runner import run_ffmpeg
+from nelson_scheduler import MAX_THREADS_PER_JOB, MIN_THREADS_PER_JOB
+from nelson_smart import FPS, SEGMENT_GOP, mux_segments
+
+# 成片短于这个时长（秒）时不分段，多出来的进程启动和拼接开销不划算
+CHUNK_MIN_TOTAL = 60.0
+# 每段至少这么长（秒）
+MIN_CHUNK_SECONDS = 15.0
+
+
+def plan_chunks(off, total, count):
+    """
+    把成片 [0, total) 切成最多 count 段，返回 [(start, end), ...]
+    切点对齐 0.5s 网格（落在帧边界上，各段帧数相加正好是整片），落在转场窗口内的切点推到转场结束之后
+    """
+    step = SEGMENT_GOP / FPS
+    length = math.ceil(total / count / step) * step
+    cuts = [0.0]
+    for k in range(1, count):
+        t = k * length
+        if off < t < off + XFADE_DUR:
+            t = math.ceil((off + XFADE_DUR) / step) * step
+        if t - cuts[-1] >= step and total - t >= step:
+            cuts.append(t)
+    cuts.append(total)
+    return list(zip(cuts, cuts[1:]))
+
+
+def chunk_thread_demand(total):
+    """分段编码最多用得上的线程数：每段不超过 MAX_THREADS_PER_JOB 线程，不值得分段时为 0"""
+    if total < CHUNK_MIN_TOTAL:
+        return 0
+    return int(total // MIN_CHUNK_SECONDS) * MAX_THREADS_PER_JOB
+
+
+def plan_chunk_workers(total, threads):
+    """
+    在线程预算内决定同时编码的段数和每段线程数，返回 (parallel, threads_per_chunk)
+    threads 为任务自己的预算加上开始时从调度器空闲路借到的线程，分段只是把这份预算拆开用，不额外占用核心
+    """
+    threads = max(1, int(threads or 1))
+    parallel = max(1, min(threads // MIN_THREADS_PER_JOB, int(total // MIN_CHUNK_SECONDS)))
+    return parallel, max(1, min(MAX_THREADS_PER_JOB, threads // parallel))
+
+
+def chunked_render(ffmpeg_path, inputs, out_p, eff, overlay, overlay_end, vols, encode_args, threads,
+                   b_normalized=False, subtitles=None, on_progress=None, sources=None, job_id=None):
+    """
+    分段并行渲染单个任务。inputs 为 nelson_inputs.plan_inputs 的结果，encode_args 为各段共用的视频编码参数，
+    threads 为该任务可用的线程预算（各段合计不超过它）
+    overlay 为标题：预渲染的 TitleLayer 图层或 drawtext 节点（只叠加到 overlay_end 之前的段）；
+    subtitles(start, end) 返回该段时间窗内的字幕滤镜或 None；sources 为滤镜图优化用的源画面信息
+    on_progress 接收成片时间轴上的进度快照，job_id 用于按任务一起取消所有分段进程
+    返回最后一次 ffmpeg 调用的结果；不值得分段时返回 None，由调用方走完整渲染
+    """
+    total = inputs.total
+    if total < CHUNK_MIN_TOTAL:
+        return None
+    parallel, threads = plan_chunk_workers(total, threads)
+    chunks = plan_chunks(inputs.off, total, parallel)
+    if parallel < 2 or len(chunks) < 2:
+        return None
+    threads = str(threads)
+    sources = sources or {}
+    title = overlay if isinstance(overlay, TitleLayer) else None
+    failed = threading.Event()
+    lock = threading.Lock()
+    encoded = [0.0] * len(chunks)
+
+    def report(i, snap):
+        # 各段进度相加，汇总成整片时间轴上的进度
+        with lock:
+            encoded[i] = chunks[i][1] - chunks[i][0] if snap["done"] else snap["out_time"]
+            out_time = sum(encoded)
+        on_progress({**snap, "out_time": out_time, "fraction": min(1.0, out_time / total), "done": False})
+
+    def encode(i, seg_p):
+        # 已有段失败时后面的段不再启动
+        if failed.is_set():
+            return None
+        start, end = chunks[i]
+        plan = plan_chunk_inputs(inputs.a.path, inputs.b.path, inputs.off, start, end)
+        with_a, with_b = plan.a is not None, plan.b is not None
+        layer = title if title and start < title.t_e and end > title.t_s else None
+        overlays = [overlay] if overlay is not None and not title and start < overlay_end else []
+        sub = subtitles(start, end) if subtitles else None
+        if sub:
+            overlays.append(sub)
+        graph = chunk_graph(eff, f"{plan.off:.3f}" if with_a else None, start, overlays, with_a, with_b,
+                            b_normalized=b_normalized, title=layer,
+                            sources=sources if with_a else {"0:v": sources.get("1:v")})
+        spans = [s for s in (plan.a, plan.b) if s]
+        cmd = [ffmpeg_path, '-y', '-hwaccel', 'auto', *[arg for s in spans for arg in s.args()],
+               *(layer.input().args() if layer else []),
+               '-filter_complex', str(graph), '-filter_complex_threads', threads,
+               '-map', '[v_out]', '-an', *encode_args, '-threads', threads, '-t', f"{end - start:.3f}", seg_p]
+        result = run_ffmpeg(cmd, None, (lambda snap: report(i, snap)) if on_progress else None, job_id=job_id)
+        if result.returncode != 0:
+            failed.set()
+        return result
+
+    work_dir = tempfile.mkdtemp(prefix="nelson_chunks_")
+    try:
+        segments = [os.path.join(work_dir, f"chunk_{i:03d}.ts") for i in range(len(chunks))]
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="nelson-chunk") as pool:
+            results = list(pool.map(encode, range(len(chunks)), segments))
+        for result in results:
+            if result is not None and result.returncode != 0:
+                return result
+        return mux_segments(ffmpeg_path, segments, os.path.join(work_dir, "concat.txt"), inputs, out_p, vols,
+                            on_progress, job_id)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
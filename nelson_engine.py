@@ -0,0 +1,925 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森渲染引擎（无界面版）
+批处理渲染逻辑从 Tk 界面中剥离出来：纯配置对象 RenderConfig + 可导入的 NelsonEngine + 命令行入口。
+Linux 渲染服务器上不需要 tkinter / psutil / PIL 也能直接跑批，界面程序只是它的薄客户端
+
+命令行示例:
+    python nelson_engine.py --a 主视频A --b B视频 --v 解说 --m 音乐 --out 输出 --no-srt
+    python nelson_engine.py --config batch.json --workers 4
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, fields, replace
+
+from nelson_cache import AudioBedCache, MezzanineCache, TitleCache
+from nelson_chunks import chunk_thread_demand, chunked_render
+from nelson_fonts import FontIndex, covers, display_name
+from nelson_graph import DRAFT_SCALE, TitleLayer, draft_graph, render_graph, title_filter
+from nelson_inputs import InputSpan, plan_draft_inputs, plan_inputs
+from nelson_journal import BatchJournal, batch_fingerprint, part_path
+from nelson_probe import DEFAULT_CACHE_DIR, ProbeCache, loudness_gain, probe_all
+from nelson_retry import CANCELLED, RetryPolicy, classify, classify_exception
+from nelson_runner import BatchProgress, format_eta, get_runner, run_ffmpeg
+from nelson_scheduler import AdmissionController, JobScheduler, max_adaptive_workers, max_processes, plan_workers
+from nelson_smart import SMART_ENCODE, smart_render
+from nelson_subs import SubtitleCache
+from nelson_tune import load_profile
+from nelson_watch import FolderWatcher
+
+MEDIA_EXTS = ('.mp4', '.mov', '.mp3', '.wav', '.m4a')
+
+DRAFT_PATH = os.path.join(DEFAULT_CACHE_DIR, "draft", "Nelson_Draft.mp4")
+
+XFADE_EFFECTS = [
+    'fade', 'dissolve', 'pixelize',
+    'wipeleft', 'wiperight', 'slideleft', 'slideright',
+    'circlecrop', 'circleopen', 'circleclose',
+    'vertopen', 'vertclose', 'horzopen', 'horzclose',
+    'diagtl', 'diagtr', 'diagbl', 'diagbr',
+    'hlslice', 'vrslice', 'hblur', 'fadegrays',
+    'smoothleft', 'smoothright', 'smoothup', 'smoothdown'
+]
+
+# 报告文本，跟随界面语言
+REPORT_TEXT = {
+    "中文": {
+        "header": ("视频序号: #{n}\n文件名: {name}\n动力模式: {hw}\n"
+                   "【标题属性】\n  - 字体: {font}\n  - 颜色: {color}\n  - 描边: {border}\n"
+                   "  - 出现时间: {ts}s - {te}s\n"
+                   "【字幕属性】\n  - 颜色: {srt_color}\n  - 描边: {srt_border}\n"
+                   "  - 垂直边距: {margin}px"),
+        "cpu": "🐢 兼容模式 (CPU)",
+        "gpu": "⚡ NVIDIA GPU 加速",
+        "tuned": "🎯 本机调优 (CPU {codec} {preset} CRF {crf})",
+        "off": "未开启",
+        "inputs": ("视频A", "视频B", "解说", "BGM"),
+        "missing": "❌ 文件不存在: {what} - {path}",
+        "no_ffmpeg": "❌ ffmpeg.exe 不存在: {path}",
+        "failed": "❌ FFmpeg 执行失败: {err}",
+        "error": "❌ 批处理异常: {err}",
+        "skipped": "⏭ 上次已完成，续跑跳过",
+        "draft": "📝 草稿预览已生成（确认后执行全自动化剪辑将沿用同样的随机样式）: {path}",
+        "no_jobs": "❌ A 目录中没有素材",
+        "cancelled": "⏹ 任务已取消",
+        "retry": "🔁 第 {n}/{total} 次尝试失败（{reason}），{delay:g}s 后重试：{action}",
+        "fallback": "↪ 沿用本批已确认的降级：{action}",
+        "category": "  - 失败原因: {reason}",
+        "reasons": {"stalled": "进度卡死", "cancelled": "已取消", "encoder": "编码器不可用",
+                    "filter": "滤镜/转场出错", "input": "素材损坏或格式不支持", "missing": "文件缺失",
+                    "disk": "磁盘空间不足", "memory": "内存不足", "unknown": "未知错误"},
+        "actions": {"same": "原样重试", "x264": "改用 libx264 编码", "cut": "转场改为硬切",
+                    "simple": "改为单进程完整渲染"},
+    },
+    "English": {
+        "header": ("Sequence: #{n}\nFilename: {name}\nHardware: {hw}\n"
+                   "【Title Settings】\n  - Font: {font}\n  - Color: {color}\n  - Border: {border}\n"
+                   "  - Display Time: {ts}s - {te}s\n"
+                   "【Subtitle Settings】\n  - Color: {srt_color}\n  - Border: {srt_border}\n"
+                   "  - Vertical Margin: {margin}px"),
+        "cpu": "🐢 CPU Compatible Mode",
+        "gpu": "⚡ NVIDIA GPU Acceleration",
+        "tuned": "🎯 Tuned CPU Profile ({codec} {preset} CRF {crf})",
+        "off": "Disabled",
+        "inputs": ("Video A", "Video B", "Voiceover", "BGM"),
+        "missing": "❌ File not found: {what} - {path}",
+        "no_ffmpeg": "❌ ffmpeg.exe not found: {path}",
+        "failed": "❌ FFmpeg Failed: {err}",
+        "error": "❌ Error: {err}",
+        "skipped": "⏭ Already done, skipped on resume",
+        "draft": "📝 Draft preview ready (the full run will reuse the same random styles): {path}",
+        "no_jobs": "❌ No footage in folder A",
+        "cancelled": "⏹ Job cancelled",
+        "retry": "🔁 Attempt {n}/{total} failed ({reason}), retrying in {delay:g}s: {action}",
+        "fallback": "↪ Reusing fallback confirmed earlier in this batch: {action}",
+        "category": "  - Failure reason: {reason}",
+        "reasons": {"stalled": "progress stalled", "cancelled": "cancelled", "encoder": "encoder unavailable",
+                    "filter": "filter/transition error", "input": "corrupt or unsupported input",
+                    "missing": "file missing", "disk": "disk full", "memory": "out of memory",
+                    "unknown": "unknown error"},
+        "actions": {"same": "retry as-is", "x264": "switch to libx264", "cut": "hard cut instead of transition",
+                    "simple": "single-process full render"},
+    },
+}
+
+
+# 资源路径定位函数
+def resource_path(relative_path):
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    # 获取当前脚本所在目录
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, relative_path)
+
+
+def find_tool(name):
+    """优先使用打包目录/脚本目录下的 name.exe，其次是系统 PATH 里的 name（Linux 渲染服务器）"""
+    for candidate in (resource_path(name + '.exe'), resource_path(name)):
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which(name) or resource_path(name + '.exe')
+
+
+def scan_media(d):
+    return sorted([f for f in os.listdir(d) if f.lower().endswith(MEDIA_EXTS)])
+
+
+def next_output_index(out_dir):
+    """导出目录里已有 Nelson_Output_N.mp4 时，从最大的 N 之后继续编号（返回 0 起的序号）"""
+    pattern = re.compile(r"^Nelson_Output_(\d+)\.mp4$")
+    numbers = [int(m.group(1)) for m in map(pattern.match, os.listdir(out_dir)) if m]
+    return max(numbers, default=0)
+
+
+@dataclass
+class RenderConfig:
+    """一次跑批的全部参数，和界面控件一一对应，可以直接从 JSON 读写"""
+    paths: dict = field(default_factory=lambda: {"a": "", "b": "", "v": "", "m": "", "t": "", "srt": "",
+                                                 "font_dir": ""})
+    gpu: bool = False
+    effect: str = "random"
+    xfade_effects: list = field(default_factory=lambda: list(XFADE_EFFECTS))
+    random_color: bool = True
+    enable_srt: bool = True
+    smart_render: bool = False
+    # 长任务切成若干段并行编码后无损拼接（仅 CPU 编码），用任务自己的线程预算加上开始时空闲路的线程
+    chunked_render: bool = False
+    # CPU 编码使用 nelson_tune 保存的本机最优预设/CRF
+    tuned_profile: bool = True
+    random_font: bool = True
+    font_name: str = "Arial Bold"
+    # 单一字体模式选中的字体文件；为空或不存在时按 font_name 使用系统字体
+    font_file: str = ""
+    title_text: str = "NelsonTest"
+    time_start: float = 2
+    time_end: float = 8
+    title_size: int = 80
+    title_border: int = 3
+    title_color: str = "#FFA500"
+    title_border_color: str = "#000000"
+    srt_color: str = "#FFFFFF"
+    srt_border_color: str = "#000000"
+    srt_size: int = 24
+    srt_border: int = 2
+    srt_margin: int = 50
+    vol_a: float = 50
+    vol_v: float = 100
+    vol_m: float = 30
+    # 各路音频先按测得的响度统一到同一基准，音量滑块在此基础上调整
+    normalize_loudness: bool = True
+    max_workers: int = 0
+    # 同时运行的 ffmpeg 进程上限（运行器统一限流，包括中间件/底轨等准备步骤），0 为按并发路数和线程预算自动计算
+    max_processes: int = 0
+    # 失败任务的最多尝试次数（含第一次），可恢复的失败按退避重试并逐级降级
+    retry_attempts: int = 3
+    # ffmpeg 输出进度超过这么久（秒）不前进就判定卡死并停止，0 表示不检测
+    stall_timeout: float = 120
+    language: str = "中文"
+    # 导出目录里有同一批未完成的计划时，沿用原参数只重跑未完成的任务
+    resume: bool = True
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {f.name for f in fields(cls)}
+        cfg = cls(**{k: v for k, v in data.items() if k in known})
+        cfg.paths = {**cls().paths, **cfg.paths}
+        return cfg
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+
+
+class NelsonEngine:
+    """批处理渲染引擎：扫描 → 并发探测 → 规划任务 → 并发渲染，全部通过回调汇报进度"""
+
+    def __init__(self, config, ffmpeg_path=None, ffprobe_path=None):
+        self.config = config
+        self.text = REPORT_TEXT.get(config.language, REPORT_TEXT["中文"])
+        self.ffmpeg_path = ffmpeg_path or find_tool('ffmpeg')
+        self.ffprobe_path = ffprobe_path or find_tool('ffprobe')
+        # 媒体探测结果持久化缓存（时长/分辨率/帧率/音轨）
+        self.probe_cache = ProbeCache(self.ffprobe_path)
+        # 轮换复用的 B 片段标准化中间件缓存
+        self.mezzanine_cache = MezzanineCache(self.ffmpeg_path)
+        self.title_cache = TitleCache(self.ffmpeg_path)
+        self.bed_cache = AudioBedCache(self.ffmpeg_path)
+        self.subtitle_cache = SubtitleCache()
+        self.scheduler = None
+        # 当前批次 / 监控模式的准入控制，分段编码从这里借用空闲线程
+        self.admission = None
+        self.journal = None
+        # 被单独取消的任务序号（job["index"]），尚未开始的直接跳过
+        self._cancelled_jobs = set()
+        self._watch_stop = threading.Event()
+        # 整批取消标记；重试前的退避等待在取消时立即结束
+        self._cancel_event = threading.Event()
+        self._cancel_cond = threading.Condition()
+        # 失败重试与降级策略，整批共用（编码器降级确认一次后对后续任务直接生效）
+        self.retry_policy = RetryPolicy(config.retry_attempts)
+        get_runner().set_stall_timeout(config.stall_timeout)
+
+    def get_duration(self, file_path):
+        try:
+            if not os.path.exists(self.ffprobe_path):
+                print(f"错误: ffprobe 不存在 - {self.ffprobe_path}")
+                return 10.0
+            # 按 路径/大小/修改时间 命中持久化缓存，重复素材不再启动 ffprobe
+            return self.probe_cache.duration(file_path)
+        except Exception as e:
+            print(f"获取时长异常: {str(e)}")
+            return 10.0
+
+    def scan(self):
+        paths = self.config.paths
+        return {k: scan_media(paths[k]) for k in ("a", "b", "v", "m")}
+
+    def probe_inputs(self, files, on_progress=None):
+        """
+        开始渲染前并发探测 a/b/v/m 全部素材，ffprobe 启动延迟不再落在每个任务的关键路径上；
+        开启响度归一时 A 原音、解说和 BGM 的响度也在这一步测完（B 的原声不进成片，不测）
+        """
+        if not os.path.exists(self.ffprobe_path):
+            return {}
+        paths = self.config.paths
+        all_media = [os.path.join(paths[k], f) for k, fs in files.items() for f in fs]
+        loudness_paths = [os.path.join(paths[k], f) for k in ("a", "v", "m") for f in files.get(k, [])]
+        return probe_all(self.probe_cache, all_media, on_progress=on_progress, **self._loudness_args(loudness_paths))
+
+    def _loudness_args(self, paths):
+        """probe_all 的响度测量参数，未开启响度归一或 ffmpeg 不存在时不测量"""
+        if not self.config.normalize_loudness or not os.path.exists(self.ffmpeg_path):
+            return {}
+        return {"ffmpeg_path": self.ffmpeg_path, "loudness_paths": paths}
+
+    def plan(self, files, probes, job_threads, start_index=0):
+        """
+        按顺序解析每个任务的随机选择（字体/颜色/转场/素材），保证结果可复现
+        start_index 用于监控模式下持续编号
+        """
+        cfg, paths, text = self.config, self.config.paths, self.text
+        files_a, files_b, v_files, m_files = files["a"], files["b"], files["v"], files["m"]
+
+        profile = load_profile() if cfg.tuned_profile and not cfg.gpu else None
+        crf = None
+        if cfg.gpu:
+            v_codec, v_preset, hw_info = "h264_nvenc", "p1", text["gpu"]
+        elif profile:
+            v_codec, v_preset, crf = profile["codec"], profile["preset"], int(profile["crf"])
+            hw_info = text["tuned"].format(codec=v_codec, preset=v_preset, crf=crf)
+        else:
+            v_codec, v_preset, hw_info = "libx264", "fast", text["cpu"]
+
+        # 字体按文件解析出真实家族名，渲染时用 fontfile 精确引用，不经过 fontconfig 模糊查找
+        font_index = FontIndex()
+        try:
+            random_fonts, fixed_face = [], None
+            if cfg.random_font and paths.get("font_dir"):
+                random_fonts = font_index.scan(paths["font_dir"])
+                # 缺字的字体会把标题渲染成方块，只在能完整显示标题的字体里随机
+                random_fonts = [f for f in random_fonts if covers(f, cfg.title_text)] or random_fonts
+            elif cfg.font_file and os.path.isfile(cfg.font_file):
+                fixed_face = font_index.face(cfg.font_file)
+        finally:
+            font_index.close()
+
+        def probed_duration(fp):
+            info = probes.get(fp)
+            return info["duration"] if info else None
+
+        settings = {
+            "v_codec": v_codec, "v_preset": v_preset, "crf": crf, "threads": job_threads,
+            "smart": cfg.smart_render,
+            "chunked": cfg.chunked_render,
+            "title_text": cfg.title_text,
+            "title_size": int(cfg.title_size),
+            "title_border": int(cfg.title_border),
+            "vol_a": float(cfg.vol_a) / 100,
+            "vol_v": float(cfg.vol_v) / 100,
+            "vol_m": float(cfg.vol_m) / 100,
+            "loudness": cfg.normalize_loudness,
+        }
+
+        jobs = []
+        for index, name_a in enumerate(files_a, start_index):
+            face = random.choice(random_fonts) if random_fonts else fixed_face
+            if face:
+                font_name, font_file = display_name(face), face["path"]
+            else:
+                font_name, font_file = cfg.font_name, None
+
+            title_c = "#{:06x}".format(random.randint(0, 0xFFFFFF)) if cfg.random_color else cfg.title_color
+            title_b_c = cfg.title_border_color
+
+            srt = None
+            final_srt_color = final_srt_border = text["off"]
+            if cfg.enable_srt:
+                if cfg.random_color:
+                    r, g, b = random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)
+                    srt_hex, srt_b_hex = f"#{r:02x}{g:02x}{b:02x}", "#000000"
+                else:
+                    srt_hex, srt_b_hex = cfg.srt_color, cfg.srt_border_color
+
+                final_srt_color, final_srt_border = srt_hex, srt_b_hex
+                # 渲染时按这组样式取预编译的 ASS
+                srt = {"path": paths["srt"], "size": int(cfg.srt_size), "color": srt_hex, "border_color": srt_b_hex,
+                       "border": int(cfg.srt_border), "margin": int(cfg.srt_margin)}
+
+            t_s, t_e = f"{cfg.time_start:g}", f"{cfg.time_end:g}"
+            header = text["header"].format(
+                n=index + 1, name=name_a, hw=hw_info, font=font_name, color=title_c, border=title_b_c,
+                ts=t_s, te=t_e, srt_color=final_srt_color, srt_border=final_srt_border, margin=int(cfg.srt_margin))
+
+            eff = random.choice(cfg.xfade_effects) if cfg.effect == "random" else cfg.effect
+
+            job = {"index": index, "header": header, "font_name": font_name, "font_file": font_file,
+                   "title_c": title_c,
+                   "title_b_c": title_b_c, "t_s": t_s, "t_e": t_e, "eff": eff,
+                   "srt": srt, "settings": settings, "error": None}
+            try:
+                job["in_a"] = os.path.join(paths["a"], name_a)
+                job["in_b"] = os.path.join(paths["b"], files_b[index % len(files_b)])
+                job["in_v"] = os.path.join(paths["v"], random.choice(v_files))
+                job["in_m"] = os.path.join(paths["m"], random.choice(m_files))
+                job["out_p"] = os.path.join(paths["t"], f"Nelson_Output_{index + 1}.mp4")
+                job["dur_a"], job["dur_b"] = probed_duration(job["in_a"]), probed_duration(job["in_b"])
+            except Exception as e:
+                job["error"] = e
+            jobs.append(job)
+        return jobs
+
+    def render_job(self, job):
+        """在工作线程中渲染单个任务，返回该任务的报告日志；可恢复的失败按重试策略退避重试并降级"""
+        logs = [job["header"]]
+        text = self.text
+        try:
+            if job["error"] is not None:
+                raise job["error"]
+            in_a, in_b, in_v, in_m, out_p = job["in_a"], job["in_b"], job["in_v"], job["in_m"], job["out_p"]
+            if job.get("done") and os.path.exists(out_p):
+                logs.append(text["skipped"])
+                return logs
+            if self._job_cancelled(job):
+                logs.append(text["cancelled"])
+                return logs
+
+            # 检查输入文件是否存在
+            for fp, fname in zip((in_a, in_b, in_v, in_m), text["inputs"]):
+                if not os.path.exists(fp):
+                    logs.append(text["missing"].format(what=fname, path=fp))
+                    raise FileNotFoundError(f"文件不存在: {fp}")
+
+            if not os.path.exists(self.ffmpeg_path):
+                logs.append(text["no_ffmpeg"].format(path=self.ffmpeg_path))
+                raise FileNotFoundError(f"ffmpeg 不存在: {self.ffmpeg_path}")
+        except Exception as e:
+            print("批处理异常：", str(e))
+            logs.append(text["error"].format(err=str(e)))
+            return logs
+
+        policy = self.retry_policy
+        for action in policy.prepare(job):
+            logs.append(text["fallback"].format(action=text["actions"][action]))
+        attempt = 1
+        while True:
+            category, error = self._render_attempt(job, logs)
+            if category is None or category == CANCELLED:
+                return logs
+            action = policy.next_step(job, category, attempt)
+            if action is not None:
+                delay = policy.backoff(attempt)
+                print(f"任务 #{job['index'] + 1} 第 {attempt} 次尝试失败（{category}），{delay:g}s 后重试: {action}")
+                logs.append(text["retry"].format(n=attempt, total=policy.attempts, reason=text["reasons"][category],
+                                                 delay=delay, action=text["actions"][action]))
+                if self._backoff(job, delay):
+                    attempt += 1
+                    continue
+                logs.append(text["cancelled"])
+                return logs
+            logs.append(error)
+            logs.append(text["category"].format(reason=text["reasons"][category]))
+            return logs
+
+    def _render_attempt(self, job, logs):
+        """
+        渲染一次，返回 (失败类别, 报告里的错误行)；成功时返回 (None, None)
+        每次尝试都重新读取 job 的设置和转场，重试策略的降级直接改写在 job 上
+        """
+        settings, text = job["settings"], self.text
+        in_a, in_b, in_v, in_m = job["in_a"], job["in_b"], job["in_v"], job["in_m"]
+        ffmpeg_path, job_id = self.ffmpeg_path, job["index"]
+        # 先写临时文件，成功后再原子改名
+        tmp_out = part_path(job["out_p"])
+
+        def cancelled():
+            # 准备步骤（中间件/底轨/标题）被取消时缓存按未命中返回，每一步之后都要确认，不能继续渲染
+            if not self._job_cancelled(job):
+                return False
+            logs.append(text["cancelled"])
+            return True
+
+        try:
+            # 优先使用跑批前探测好的时长，缺失时再单独探测
+            dur_a = job.get("dur_a") or self.get_duration(in_a)
+            dur_b = job.get("dur_b") or self.get_duration(in_b)
+            # 标题预渲染成图层只叠加在显示窗口内，生成失败时退回逐帧 drawtext
+            title = self.title_layer(job) or job_title(job)
+            if cancelled():
+                return CANCELLED, None
+
+            # 智能渲染：CPU 编码且无整段字幕时，只重编码 A 段+转场+标题区间，B 尾段直接流拷贝
+            if settings["smart"] and settings["v_codec"] == "libx264" and not job.get("srt"):
+                smart_b = self.mezzanine_cache.get(in_b, threads=settings["threads"], encode_args=SMART_ENCODE,
+                                                   job_id=job_id)
+                if cancelled():
+                    return CANCELLED, None
+                result = None
+                if smart_b:
+                    inputs = plan_inputs(in_a, smart_b, in_v, in_m, dur_a, dur_b)
+                    vols, inputs = self.job_vols(job), self.audio_bed(job, inputs)
+                    if cancelled():
+                        return CANCELLED, None
+                    result = smart_render(ffmpeg_path, inputs, tmp_out, job['eff'], title, float(job["t_e"]), vols,
+                                          threads=settings["threads"], on_progress=job.get("on_progress"),
+                                          sources={"0:v": self.graph_source(in_a)}, job_id=job_id)
+                if result is not None:
+                    return self._finish(job, result, tmp_out, logs)
+
+            # B 片段优先使用已标准化的中间件，命中后滤镜图里只需对齐帧率/时间基
+            mezz_b = self.mezzanine_cache.get(in_b, threads=settings["threads"], job_id=job_id)
+            if cancelled():
+                return CANCELLED, None
+            # 各路输入只读取成片用得到的时间段，A 开头和 B/解说/BGM 的多余部分不再解码
+            inputs = plan_inputs(in_a, mezz_b or in_b, in_v, in_m, dur_a, dur_b)
+            sources = {"0:v": self.graph_source(in_a), "1:v": None if mezz_b else self.graph_source(in_b)}
+            inputs, vols = self.audio_bed(job, inputs), self.job_vols(job)
+            if cancelled():
+                return CANCELLED, None
+
+            # 长任务分段并行编码：各段只带自己时间窗内的字幕条目；
+            # 开始时借用调度器里空闲路的线程（批次收尾时），段数和每段线程数按借到后的预算规划
+            if settings.get("chunked") and settings["v_codec"].startswith("libx"):
+                srt = job.get("srt")
+                extra = 0
+                if self.admission:
+                    extra = self.admission.borrow(chunk_thread_demand(inputs.total) - settings["threads"])
+                try:
+                    result = chunked_render(ffmpeg_path, inputs, tmp_out, job['eff'], title, float(job["t_e"]),
+                                            vols, video_encode_args(settings), settings["threads"] + extra,
+                                            b_normalized=bool(mezz_b),
+                                            subtitles=(lambda s, e: self.subtitle_cache.filter(srt, window=(s, e)))
+                                            if srt else None,
+                                            on_progress=job.get("on_progress"), sources=sources, job_id=job_id)
+                finally:
+                    if extra:
+                        self.admission.give_back(extra)
+                if result is not None:
+                    return self._finish(job, result, tmp_out, logs)
+                if cancelled():
+                    return CANCELLED, None
+
+            # 字幕只带成片时间段内的条目
+            subtitles = None
+            if job.get("srt"):
+                subtitles = self.subtitle_cache.filter(job["srt"], window=(0.0, inputs.total))
+            cmd = build_render_cmd(ffmpeg_path, job, inputs, tmp_out, b_normalized=bool(mezz_b), sources=sources,
+                                   title=title if isinstance(title, TitleLayer) else None, subtitles=subtitles,
+                                   vols=vols)
+            total = inputs.total
+            # 打印命令和错误输出，便于排查
+            print("FFmpeg 命令：", " ".join(cmd))
+            result = run_ffmpeg(cmd, total, job.get("on_progress"), job_id=job_id)
+            return self._finish(job, result, tmp_out, logs)
+        except Exception as e:
+            print("批处理异常：", str(e))
+            if os.path.exists(tmp_out):
+                os.remove(tmp_out)
+            return classify_exception(e), text["error"].format(err=str(e))
+
+    def _backoff(self, job, delay):
+        """重试前退避等待，期间整批或该任务被取消时立即返回 False"""
+        with self._cancel_cond:
+            return not self._cancel_cond.wait_for(lambda: self._job_cancelled(job), delay)
+
+    def _job_cancelled(self, job):
+        """整批或该任务已被取消"""
+        return self._cancel_event.is_set() or job["index"] in self._cancelled_jobs
+
+    def job_vols(self, job):
+        """
+        任务三路音频的最终音量 (A 原音, 解说, BGM)：滑块音量 × 响度归一增益
+        响度在探测阶段按文件测量一次存入探测缓存，这里只查缓存，渲染时只是单遍 volume；
+        没有测量结果（测量失败或没有音轨）的文件增益为 1
+        """
+        settings = job["settings"]
+        vols = [settings["vol_a"], settings["vol_v"], settings["vol_m"]]
+        if settings.get("loudness"):
+            for i, path in enumerate((job["in_a"], job["in_v"], job["in_m"])):
+                vols[i] *= loudness_gain(self.probe_cache.cached_loudness(path))
+        return tuple(vols)
+
+    def audio_bed(self, job, inputs):
+        """
+        把 inputs 的解说 / BGM 换成缓存的无损底轨（同一路音频的任务共用），混音方式不变；
+        生成失败时原样返回 inputs，直接解码原始音频
+        """
+        tracks = self.bed_cache.get(job["in_v"], job["in_m"], inputs.total, threads=job["settings"]["threads"],
+                                    job_id=job["index"])
+        if not tracks:
+            return inputs
+        return replace(inputs, v=InputSpan(tracks[0], 0.0, inputs.total), m=InputSpan(tracks[1], 0.0, inputs.total))
+
+    def title_layer(self, job):
+        """任务标题的预渲染图层（按样式共用缓存），生成失败时返回 None"""
+        settings = job["settings"]
+        path = self.title_cache.get(job["font_name"], settings["title_text"], job["title_c"],
+                                    settings["title_size"], settings["title_border"], job["title_b_c"],
+                                    fontfile=job.get("font_file"), job_id=job["index"])
+        if not path:
+            return None
+        return TitleLayer(path, float(job["t_s"]), float(job["t_e"]), settings["title_size"],
+                          settings["title_border"])
+
+    def graph_source(self, path):
+        """
+        滤镜图优化用的源画面信息（来自探测缓存）
+        旧缓存没有旋转字段或素材带旋转元数据时只给帧率，不据宽高删减缩放
+        """
+        try:
+            info = self.probe_cache.get(path)
+        except OSError:
+            return None
+        if not info:
+            return None
+        if info.get("rotation", -1) != 0:
+            return {"fps": info.get("fps")}
+        return info
+
+    def _finish(self, job, result, tmp_out, logs):
+        """
+        成功则把临时文件改名为正式输出并记入跑批日志，失败则清理半成品
+        返回 (失败类别, 报告里的错误行)，成功时为 (None, None)；是否重试由 render_job 决定
+        """
+        # 取消恰好发生在最后一次 ffmpeg 启动前后时进程可能照常跑完，结果同样作废
+        if result.returncode != 0 or self._job_cancelled(job):
+            if os.path.exists(tmp_out):
+                os.remove(tmp_out)
+            category = CANCELLED if self._job_cancelled(job) else classify(result)
+            if category == CANCELLED:
+                logs.append(self.text["cancelled"])
+                return category, None
+            print("FFmpeg 错误输出：", result.stderr)
+            return category, self.text["failed"].format(err=result.stderr)
+        os.replace(tmp_out, job["out_p"])
+        job["done"] = True
+        if self.journal:
+            self.journal.mark_done(job["index"])
+        return None, None
+
+    def run(self, on_probe=None, on_update=None, on_result=None):
+        """
+        执行整批渲染，返回按任务顺序排列的报告日志
+        on_probe(done, total) / on_update(index, snap, percent, eta) / on_result(index, job, logs)
+        """
+        report_logs = []
+        self._cancel_event.clear()
+        files = self.scan()
+        probes = self.probe_inputs(files, on_probe)
+
+        # 并发规划：按核数/内存决定同时渲染的路数，每路分到独立的线程预算
+        workers, job_threads = plan_workers(len(files["a"]), gpu=self.config.gpu,
+                                            max_workers=self.config.max_workers or None)
+        # CPU 有空闲、内存有余量时最多再放行到这个路数
+        max_workers = max_adaptive_workers(len(files["a"]), gpu=self.config.gpu,
+                                           max_workers=self.config.max_workers or None)
+        print(f"并发调度: {workers} 路 × {job_threads} 线程（负载允许时最多 {max_workers} 路）")
+        self._limit_processes(max_workers, job_threads)
+
+        # 同一批上次没跑完：沿用日志里的计划（随机选择完全一致），否则重新规划并写入日志
+        self.journal = BatchJournal(self.config.paths["t"])
+        fingerprint = batch_fingerprint(self.config, files)
+        jobs = self.journal.load(fingerprint) if self.config.resume else None
+        if jobs is None:
+            jobs = self.plan(files, probes, job_threads)
+            self.journal.start(fingerprint, jobs)
+        else:
+            print(f"续跑: {sum(1 for j in jobs if j.get('done'))}/{len(jobs)} 个任务已完成")
+            for job in jobs:
+                job["settings"]["threads"] = job_threads
+                # 草稿预览写入的计划没有探测时长，这里补上
+                job["dur_a"] = job.get("dur_a") or (probes.get(job.get("in_a")) or {}).get("duration")
+                job["dur_b"] = job.get("dur_b") or (probes.get(job.get("in_b")) or {}).get("duration")
+
+        # 实时进度：按预计成片时长加权汇总，回调已做节流
+        weights = [(j.get("dur_a") or 0) / 1.2 + (j.get("dur_b") or 0) - 2.5 for j in jobs]
+        tracker = BatchProgress(weights, on_update or (lambda *args: None))
+        for job in jobs:
+            job["on_progress"] = lambda snap, i=job["index"]: tracker.update(i, snap)
+
+        # 并发渲染，日志与进度按任务顺序回填
+        def _on_result(index, job, logs, error):
+            if not logs:
+                # 整批取消后调度器不再派发的任务记为已取消，而不是失败
+                text = self.text
+                logs = [job["header"], text["cancelled"] if self._cancel_event.is_set()
+                        else text["error"].format(err=str(error))]
+            report_logs.extend(logs)
+            tracker.finish(index)
+            if on_result:
+                on_result(index, job, logs)
+
+        self.scheduler = JobScheduler(workers, max_workers, job_threads)
+        self.admission = self.scheduler.admission
+        self.scheduler.run(jobs, self.render_job, _on_result)
+        if all(job.get("done") for job in jobs):
+            self.journal.clear()
+        return report_logs
+
+    def draft(self, index=0, on_progress=None, out_p=DRAFT_PATH):
+        """
+        草稿预览：按当前样式只渲染第 index 个任务标题前后的片段（四分之一分辨率、ultrafast、无音频），
+        用于快速核对字体/颜色/字幕边距。计划写入跑批日志，确认后的正式跑批沿用同样的随机选择
+        返回 (预览文件路径或 None, 报告日志)
+        """
+        files = self.scan()
+        self.journal = BatchJournal(self.config.paths["t"])
+        fingerprint = batch_fingerprint(self.config, files)
+        jobs = self.journal.load(fingerprint) if self.config.resume else None
+        if jobs is None:
+            jobs = self.plan(files, {}, 0)
+            if jobs:
+                self.journal.start(fingerprint, jobs)
+        if not jobs:
+            return None, [self.text["no_jobs"]]
+
+        job = jobs[index % len(jobs)]
+        logs = [job["header"]]
+        try:
+            if job["error"] is not None:
+                raise job["error"]
+            in_a, in_b = job["in_a"], job["in_b"]
+            dp = plan_draft_inputs(in_a, in_b, self.get_duration(in_a), self.get_duration(in_b),
+                                   float(job["t_s"]), float(job["t_e"]))
+            overlays = [job_title(job, scale=DRAFT_SCALE)]
+            subtitles = self.subtitle_cache.filter(job["srt"], window=(dp.start, dp.end)) if job.get("srt") else None
+            if subtitles:
+                # ASS 样式按 PlayRes 坐标随画面缩放，字号和边距不用换算
+                overlays.append(subtitles)
+            graph = draft_graph(job["eff"], f"{dp.off:.2f}", dp.start, overlays, dp.b is not None,
+                                sources={"0:v": self.graph_source(in_a)})
+            os.makedirs(os.path.dirname(out_p), exist_ok=True)
+            cmd = [self.ffmpeg_path, '-y', *dp.a.args(), *(dp.b.args() if dp.b else []),
+                   '-filter_complex', str(graph), '-map', '[v_out]', '-an',
+                   '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28',
+                   '-t', f"{dp.end - dp.start:.2f}", out_p]
+            result = run_ffmpeg(cmd, dp.end - dp.start, on_progress)
+            if result.returncode != 0:
+                logs.append(self.text["failed"].format(err=result.stderr))
+                return None, logs
+        except Exception as e:
+            logs.append(self.text["error"].format(err=str(e)))
+            return None, logs
+        logs.append(self.text["draft"].format(path=out_p))
+        return out_p, logs
+
+    def watch(self, on_update=None, on_result=None, settle=None, interval=None):
+        """
+        监控模式：A 目录里新出现的文件停止增长后立即进入渲染队列，阻塞直到 stop_watch()
+        on_result(index, job, logs) 按完成先后回调
+        """
+        paths = self.config.paths
+        self._cancel_event.clear()
+        files = self.scan()
+        files["a"] = []
+        # B/解说/BGM 只在启动时探测一次，新 A 文件到达时单独探测
+        probes = self.probe_inputs(files)
+        # 监控模式的任务数事先未知，不按任务数收紧并发
+        workers, job_threads = plan_workers(None, gpu=self.config.gpu,
+                                            max_workers=self.config.max_workers or None)
+        max_workers = max_adaptive_workers(None, gpu=self.config.gpu,
+                                           max_workers=self.config.max_workers or None)
+        print(f"监控模式: {paths['a']} | 并发 {workers} 路 × {job_threads} 线程（负载允许时最多 {max_workers} 路）")
+        self._limit_processes(max_workers, job_threads)
+        next_index = next_output_index(paths["t"])
+        admission = self.admission = AdmissionController(workers, max_workers, job_threads)
+        pool = ThreadPoolExecutor(max_workers=admission.max_workers, thread_name_prefix="nelson-job")
+
+        def render(job):
+            # 取消后仍在排队的任务直接跳过，不等到放行后再渲染
+            if not admission.acquire(self._cancel_event):
+                return [job["header"], self.text["cancelled"]]
+            try:
+                return self.render_job(job)
+            finally:
+                admission.release()
+
+        def on_ready(path):
+            nonlocal next_index
+            index, next_index = next_index, next_index + 1
+            if os.path.exists(self.ffprobe_path):
+                probes.update(probe_all(self.probe_cache, [path], **self._loudness_args([path])))
+            job = self.plan({**files, "a": [os.path.basename(path)]}, probes, job_threads, start_index=index)[0]
+            tracker = BatchProgress([1.0], lambda _i, snap, percent, eta: on_update(index, snap, percent, eta)
+                                    if on_update else None)
+            job["on_progress"] = lambda snap: tracker.update(0, snap)
+            fut = pool.submit(render, job)
+            if on_result:
+                fut.add_done_callback(lambda f: on_result(index, job, f.result()))
+
+        watch_kwargs = {k: v for k, v in (("settle", settle), ("interval", interval)) if v is not None}
+        watcher = FolderWatcher(paths["a"], on_ready, MEDIA_EXTS, **watch_kwargs)
+        self._watch_stop.clear()
+        watcher.start()
+        try:
+            self._watch_stop.wait()
+        finally:
+            watcher.stop()
+            pool.shutdown(wait=True)
+
+    def _limit_processes(self, max_workers, job_threads):
+        """按本批的并发规划设置运行器的进程上限，超出的 ffmpeg 在事件循环里排队"""
+        get_runner().set_concurrency(self.config.max_processes or max_processes(max_workers, job_threads))
+
+    def stop_watch(self):
+        """停止监控，已进入队列的任务照常完成"""
+        self._watch_stop.set()
+
+    def cancel_job(self, index):
+        """取消单个任务（job["index"]）：正在运行的 ffmpeg 全部停止，尚未开始的直接跳过"""
+        with self._cancel_cond:
+            self._cancelled_jobs.add(index)
+            self._cancel_cond.notify_all()
+        get_runner().cancel(index)
+
+    def cancel(self):
+        """停止派发新任务，并终止正在运行的 ffmpeg（只限本程序启动的进程）"""
+        if self.scheduler:
+            self.scheduler.cancel()
+        with self._cancel_cond:
+            self._cancel_event.set()
+            self._cancel_cond.notify_all()
+        self._watch_stop.set()
+        get_runner().cancel_all()
+
+
+def job_title(job, scale=1.0):
+    """任务的标题 drawtext 节点；有字体文件时用 fontfile 精确加载，否则按系统字体名"""
+    settings = job["settings"]
+    return title_filter(job["font_name"], settings["title_text"], job["title_c"], settings["title_size"],
+                        settings["title_border"], job["title_b_c"], job["t_s"], job["t_e"], scale=scale,
+                        fontfile=job.get("font_file"))
+
+
+def video_encode_args(settings):
+    """任务的视频编码参数（不含线程数），完整渲染和分段编码共用"""
+    args = ['-c:v', settings["v_codec"], '-preset', settings["v_preset"]]
+    if settings.get("crf") is not None:
+        args += ['-crf', str(settings["crf"])]
+    return args
+
+
+def build_render_cmd(ffmpeg_path, job, inputs, out_p, b_normalized=False, sources=None, title=None,
+                     subtitles=None, vols=None):
+    """
+    组装完整渲染的 ffmpeg 命令（纯函数，不启动进程）
+    title 为预渲染的标题图层，没有时标题用逐帧 drawtext；subtitles 为字幕滤镜节点；
+    vols 为三路最终音量，默认取滑块音量
+    """
+    settings = job["settings"]
+    overlays = [] if title else [job_title(job)]
+    if subtitles:
+        overlays.append(subtitles)
+    graph = render_graph(job["eff"], f"{inputs.off:.2f}", overlays,
+                         vols or (settings['vol_a'], settings['vol_v'], settings['vol_m']),
+                         b_normalized=b_normalized, sources=sources, title=title)
+
+    # 每路任务限定线程数，避免多路并发时互相抢占核心
+    threads = str(settings["threads"])
+    cmd = [ffmpeg_path, '-y', '-hwaccel', 'auto', *inputs.a.args(), *inputs.b.args(), *inputs.v.args(),
+           *inputs.m.args(), *(title.input().args() if title else []),
+           '-filter_complex', str(graph), '-filter_complex_threads', threads,
+           '-map', '[v_out]', '-map', '[a_out]', *video_encode_args(settings), '-threads', threads]
+    return cmd + ['-t', f"{inputs.total:.2f}", out_p]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="奈尔森一键剪辑 - 无界面渲染引擎")
+    parser.add_argument("--config", help="RenderConfig JSON 文件")
+    parser.add_argument("--a", help="主视频 A 目录")
+    parser.add_argument("--b", help="拼接视频 B 目录")
+    parser.add_argument("--v", help="解说音频目录")
+    parser.add_argument("--m", help="背景音乐目录")
+    parser.add_argument("--out", help="导出目录")
+    parser.add_argument("--srt", help="字幕文件")
+    parser.add_argument("--font-dir", help="随机字体目录")
+    parser.add_argument("--font-file", help="固定使用的字体文件（不使用随机字体）")
+    parser.add_argument("--no-srt", action="store_true", help="关闭字幕渲染")
+    parser.add_argument("--gpu", action="store_true", help="使用 NVIDIA NVENC 编码")
+    parser.add_argument("--smart", action="store_true", help="智能渲染：仅重编码转场窗口")
+    parser.add_argument("--chunked", action="store_true", help="长任务分段并行编码（可借用空闲路的线程）")
+    parser.add_argument("--effect", help="固定转场特效，默认随机")
+    parser.add_argument("--workers", type=int, help="最大并发路数，默认自动")
+    parser.add_argument("--max-processes", type=int, help="同时运行的 ffmpeg 进程上限，默认按并发路数自动计算")
+    parser.add_argument("--no-tune", action="store_true", help="不使用本机调优配置，CPU 固定 libx264 fast")
+    parser.add_argument("--no-loudnorm", action="store_true", help="不做响度归一，只按音量参数混音")
+    parser.add_argument("--retries", type=int, help="失败任务的最多尝试次数（含第一次），默认 3")
+    parser.add_argument("--stall-timeout", type=float, help="ffmpeg 进度多少秒不前进判定为卡死，0 为不检测，默认 120")
+    parser.add_argument("--fresh", action="store_true", help="忽略未完成的跑批日志，重新规划")
+    parser.add_argument("--draft", action="store_true", help="只渲染第一个任务标题前后的低清草稿，用于核对样式")
+    parser.add_argument("--watch", action="store_true", help="监控 A 目录，新文件稳定后立即渲染（Ctrl+C 退出）")
+    parser.add_argument("--ffmpeg", help="ffmpeg 可执行文件路径")
+    parser.add_argument("--ffprobe", help="ffprobe 可执行文件路径")
+    args = parser.parse_args(argv)
+
+    config = RenderConfig.load(args.config) if args.config else RenderConfig()
+    for key, value in (("a", args.a), ("b", args.b), ("v", args.v), ("m", args.m), ("t", args.out),
+                       ("srt", args.srt), ("font_dir", args.font_dir)):
+        if value:
+            config.paths[key] = os.path.abspath(value)
+    if args.font_file:
+        config.font_file = os.path.abspath(args.font_file)
+        config.random_font = False
+    if args.no_srt:
+        config.enable_srt = False
+    if args.gpu:
+        config.gpu = True
+    if args.smart:
+        config.smart_render = True
+    if args.chunked:
+        config.chunked_render = True
+    if args.effect:
+        config.effect = args.effect
+    if args.workers:
+        config.max_workers = args.workers
+    if args.max_processes:
+        config.max_processes = args.max_processes
+    if args.no_tune:
+        config.tuned_profile = False
+    if args.no_loudnorm:
+        config.normalize_loudness = False
+    if args.retries is not None:
+        config.retry_attempts = max(1, args.retries)
+    if args.stall_timeout is not None:
+        config.stall_timeout = args.stall_timeout
+    if args.fresh:
+        config.resume = False
+
+    missing = [k for k in ("a", "b", "v", "m", "t") if not config.paths.get(k)]
+    if config.enable_srt and not config.paths.get("srt"):
+        missing.append("srt")
+    if missing:
+        parser.error("缺少目录参数: " + ", ".join(missing))
+
+    def on_probe(done, total):
+        print(f"\r正在探测素材 {done}/{total}", end="", flush=True)
+
+    def on_update(index, snap, percent, eta):
+        print(f"\r任务 #{index + 1} | 整体 {percent:5.1f}% | 剩余 {format_eta(eta)}   ", end="", flush=True)
+
+    engine = NelsonEngine(config, ffmpeg_path=args.ffmpeg, ffprobe_path=args.ffprobe)
+    if args.draft:
+        out_p, logs = engine.draft()
+        for line in logs:
+            print(line + "\n" + "=" * 50)
+        return 0 if out_p else 1
+    if args.watch:
+        def on_result(index, job, logs):
+            print()
+            for line in logs:
+                print(line + "\n" + "=" * 50)
+
+        watch_thread = threading.Thread(target=engine.watch, kwargs={"on_update": on_update, "on_result": on_result})
+        watch_thread.start()
+        try:
+            while watch_thread.is_alive():
+                watch_thread.join(0.5)
+        except KeyboardInterrupt:
+            engine.stop_watch()
+            watch_thread.join()
+        return 0
+
+    try:
+        logs = engine.run(on_probe=on_probe, on_update=on_update)
+    except KeyboardInterrupt:
+        engine.cancel()
+        return 130
+    print()
+    for line in logs:
+        print(line + "\n" + "=" * 50)
+    return 1 if any(line.startswith("❌") for line in logs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森字体索引
+直接解析 TTF/OTF/TTC 的 name 表和 cmap 表，得到真实的字体家族名和字符覆盖范围，
+结果按 (路径, 大小, 修改时间) 持久化到 SQLite；渲染时用 fontfile 精确引用字体文件，
+不再让 fontconfig 按文件名模糊查找（找不到时会静默退回默认字体）
+"""
+import bisect
+import json
+import os
+import sqlite3
+import struct
+import threading
+
+from nelson_probe import DEFAULT_CACHE_DIR
+
+FONT_EXTS = ('.ttf', '.otf', '.ttc')
+# name 表里的名称编号：家族名 / 子族名 / 全名 / 排版家族名 / 排版子族名
+_NAME_FAMILY, _NAME_STYLE, _NAME_FULL, _NAME_TYPO_FAMILY, _NAME_TYPO_STYLE = 1, 2, 4, 16, 17
+_LANG_EN_US = 0x409
+
+
+def _table_directory(f, offset):
+    """读取一个字体面的表目录，返回 {表名: (偏移, 长度)}"""
+    f.seek(offset)
+    version, num_tables = struct.unpack(">4sH", f.read(6))
+    if version not in (b"\x00\x01\x00\x00", b"OTTO", b"true"):
+        raise ValueError(f"不是 sfnt 字体: {version!r}")
+    f.seek(offset + 12)
+    tables = {}
+    for _ in range(num_tables):
+        tag, _checksum, t_off, t_len = struct.unpack(">4sIII", f.read(16))
+        tables[tag.decode("latin-1")] = (t_off, t_len)
+    return tables
+
+
+def _decode_name(platform, raw):
+    if platform in (0, 3):
+        return raw.decode("utf-16-be", errors="ignore")
+    return raw.decode("mac_roman", errors="ignore")
+
+
+def parse_names(data):
+    """
+    解析 name 表，返回 {名称编号: 字符串}
+    同一编号有多条记录时优先 Windows 英文，其次 Windows 其他语言、Unicode、Mac
+    """
+    _fmt, count, str_off = struct.unpack_from(">HHH", data, 0)
+    best = {}
+    for i in range(count):
+        platform, _enc, lang, name_id, length, offset = struct.unpack_from(">HHHHHH", data, 6 + i * 12)
+        if name_id not in (_NAME_FAMILY, _NAME_STYLE, _NAME_FULL, _NAME_TYPO_FAMILY, _NAME_TYPO_STYLE):
+            continue
+        if platform == 3:
+            rank = 0 if lang == _LANG_EN_US else 1
+        elif platform in (0, 1):
+            rank = platform + 2
+        else:
+            continue
+        if name_id in best and best[name_id][0] <= rank:
+            continue
+        raw = data[str_off + offset:str_off + offset + length]
+        text = _decode_name(platform, raw).strip("\x00 ")
+        if text:
+            best[name_id] = (rank, text)
+    return {k: v[1] for k, v in best.items()}
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def parse_cmap(data):
+    """
+    解析 cmap 表，返回合并后的码位区间 [[起, 止], ...]
+    优先完整 Unicode 的 format 12，其次 BMP 的 format 4
+    """
+    _version, num = struct.unpack_from(">HH", data, 0)
+    subtables = {}
+    for i in range(num):
+        platform, encoding, offset = struct.unpack_from(">HHI", data, 4 + i * 8)
+        if platform in (0, 3):
+            fmt = struct.unpack_from(">H", data, offset)[0]
+            subtables.setdefault(fmt, offset)
+
+    if 12 in subtables:
+        offset = subtables[12]
+        n_groups = struct.unpack_from(">I", data, offset + 12)[0]
+        return _merge_ranges([list(struct.unpack_from(">II", data, offset + 16 + i * 12))
+                              for i in range(n_groups)])
+    if 4 in subtables:
+        offset = subtables[4]
+        seg_count = struct.unpack_from(">H", data, offset + 6)[0] // 2
+        ends = struct.unpack_from(f">{seg_count}H", data, offset + 14)
+        starts = struct.unpack_from(f">{seg_count}H", data, offset + 16 + seg_count * 2)
+        # 最后一段 0xFFFF 是结束标记
+        return _merge_ranges([[s, e] for s, e in zip(starts, ends) if s != 0xFFFF])
+    return []
+
+
+def read_faces(path):
+    """解析一个字体文件里的全部字体面（TTC 可能有多个），返回字典列表"""
+    faces = []
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if head[:4] == b"ttcf":
+            num_fonts = struct.unpack(">I", head[8:12])[0]
+            offsets = struct.unpack(f">{num_fonts}I", f.read(4 * num_fonts))
+        else:
+            offsets = (0,)
+        for index, offset in enumerate(offsets):
+            tables = _table_directory(f, offset)
+            names, ranges = {}, []
+            if "name" in tables:
+                f.seek(tables["name"][0])
+                names = parse_names(f.read(tables["name"][1]))
+            if "cmap" in tables:
+                f.seek(tables["cmap"][0])
+                ranges = parse_cmap(f.read(tables["cmap"][1]))
+            family = names.get(_NAME_TYPO_FAMILY) or names.get(_NAME_FAMILY)
+            if not family:
+                continue
+            faces.append({
+                "path": os.path.abspath(path), "index": index, "family": family,
+                "style": names.get(_NAME_TYPO_STYLE) or names.get(_NAME_STYLE) or "Regular",
+                "full_name": names.get(_NAME_FULL) or family,
+                "ranges": ranges,
+            })
+    return faces
+
+
+def covers(face, text):
+    """字体是否包含 text 里的全部字符（空白除外）；没有 cmap 信息时视为包含"""
+    ranges = face.get("ranges")
+    if not ranges:
+        return True
+    starts = [r[0] for r in ranges]
+    for ch in set(text):
+        if ch.isspace():
+            continue
+        cp = ord(ch)
+        i = bisect.bisect_right(starts, cp) - 1
+        if i < 0 or cp > ranges[i][1]:
+            return False
+    return True
+
+
+def display_name(face):
+    """界面和日志里显示的字体名，例如 "Arial Bold" """
+    style = face["style"]
+    return face["family"] if style in ("Regular", "Normal") else f"{face['family']} {style}"
+
+
+class FontIndex:
+    """线程安全的字体解析缓存，字体文件大小或修改时间变化时自动失效"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "fonts.sqlite")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fonts ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, faces TEXT)")
+        self._conn.commit()
+
+    def faces(self, file_path):
+        """命中缓存直接返回，否则解析字体文件；解析失败的文件也会缓存为空列表，下次直接跳过"""
+        st = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, faces FROM fonts WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return json.loads(row[2])
+        try:
+            faces = read_faces(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"字体解析失败 {os.path.basename(path)}: {e}")
+            faces = []
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO fonts (path, size, mtime, faces) VALUES (?, ?, ?, ?)",
+                               (path, st.st_size, st.st_mtime, json.dumps(faces, ensure_ascii=False)))
+            self._conn.commit()
+        return faces
+
+    def face(self, file_path):
+        """文件里的第一个字体面（drawtext 的 fontfile 只加载第一个），不可用时返回 None"""
+        try:
+            faces = self.faces(file_path)
+        except OSError:
+            return None
+        return faces[0] if faces else None
+
+    def scan(self, font_dir):
+        """目录下所有可用字体文件的第一个字体面，按文件名排序"""
+        result = []
+        for fn in sorted(os.listdir(font_dir)):
+            if fn.lower().endswith(FONT_EXTS):
+                face = self.face(os.path.join(font_dir, fn))
+                if face:
+                    result.append(face)
+        return result
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
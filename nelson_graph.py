@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森滤镜图构建器
+用带类型的节点（Filter / Chain / FilterGraph）拼装 filter_complex，代替手写的大段 f-string。
+序列化前可以跑优化：去掉无效节点、合并相邻 setpts、把丢帧类滤镜提到缩放之前。
+这里只生成字符串，不调用 ffmpeg
+"""
+import re
+from dataclasses import dataclass
+
+from nelson_inputs import A_AUDIO_TRIM, A_SPEED, A_VIDEO_TRIM, StillSpan
+
+WIDTH, HEIGHT, FPS = 1080, 1920, 30
+# 标题文字框上沿在成片中的位置
+TITLE_Y = 250
+# 草稿预览按四分之一分辨率渲染
+DRAFT_SCALE = 0.25
+DRAFT_SCALER = "fast_bilinear"
+# 不做转场的硬切（xfade 不可用时的降级）
+CUT_EFFECT = "cut"
+
+# 只改变画面、不改变时间轴的滤镜，可以和 fps/trim 交换顺序
+_SPATIAL = ("scale", "crop", "setsar", "pad")
+_AUDIO = ("volume", "atrim", "asetpts", "amix", "anull")
+_SETPTS_RE = re.compile(r"^PTS\s*([*/])\s*([\d.]+)$")
+_PTS_TOKEN_RE = re.compile(r"\b(STARTPTS|PTS)\b")
+# 合并 setpts 时只处理只引用 PTS/STARTPTS 和常量的表达式
+_SIMPLE_EXPR_RE = re.compile(r"^(?:[\d.+\-*/() ]|\bSTARTPTS\b|\bPTS\b)+$")
+
+
+def quote(value):
+    """滤镜参数加单引号，内部的单引号转义，防止标题文字里的 ' : , 打断滤镜图"""
+    return "'" + str(value).replace("'", r"'\''") + "'"
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f"{value:.4f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+class Filter:
+    """单个滤镜：名称 + 位置参数 + 命名参数，命名参数保持传入顺序"""
+
+    def __init__(self, name, *args, **opts):
+        self.name = name
+        self.args = [_fmt(a) for a in args]
+        self.opts = {k: _fmt(v) for k, v in opts.items() if v is not None}
+
+    def get(self, key, default=None):
+        return self.opts.get(key, default)
+
+    def __str__(self):
+        params = self.args + [f"{k}={v}" for k, v in self.opts.items()]
+        return self.name + ("=" + ":".join(params) if params else "")
+
+    def __repr__(self):
+        return f"Filter({str(self)!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Filter) and str(self) == str(other)
+
+
+class Chain:
+    """[输入标签]滤镜1,滤镜2[输出标签]"""
+
+    def __init__(self, inputs, filters, outputs):
+        self.inputs = list(inputs)
+        self.filters = list(filters)
+        self.outputs = list(outputs)
+
+    def __str__(self):
+        return ("".join(f"[{p}]" for p in self.inputs) + ",".join(str(f) for f in self.filters)
+                + "".join(f"[{p}]" for p in self.outputs))
+
+
+class FilterGraph:
+    def __init__(self):
+        self.chains = []
+
+    def chain(self, inputs, filters, outputs):
+        ch = Chain([inputs] if isinstance(inputs, str) else inputs, filters,
+                   [outputs] if isinstance(outputs, str) else outputs)
+        self.chains.append(ch)
+        return ch
+
+    def optimize(self, sources=None):
+        """
+        sources: {"0:v": {"width": .., "height": .., "fps": ..}} 形式的探测信息，
+        已知源参数时才能判断缩放/帧率是否多余；未知时只做不依赖源信息的优化
+        """
+        sources = sources or {}
+        for ch in self.chains:
+            info = sources.get(ch.inputs[0]) if len(ch.inputs) == 1 else None
+            ch.filters = merge_setpts(ch.filters)
+            ch.filters = hoist_timing(ch.filters, info)
+            kept = drop_identity(ch.filters, info)
+            if not kept:
+                # 整条链都被删掉时留一个直通滤镜，保持标签连接
+                audio = bool(ch.filters) and ch.filters[0].name in _AUDIO
+                kept = [Filter("anull" if audio else "null")]
+            ch.filters = kept
+        return self
+
+    def __str__(self):
+        return ";".join(str(ch) for ch in self.chains)
+
+
+# ---------------- 常用节点 ----------------
+
+def normalize(width=WIDTH, height=HEIGHT, fps=FPS, scaler=None):
+    """竖屏标准化：等比放大铺满 → 居中裁切 → 方形像素 → 固定帧率，A/B/中间件共用这一条"""
+    return [Filter("scale", width, height, force_original_aspect_ratio="increase", flags=scaler),
+            Filter("crop", width, height),
+            Filter("setsar", 1),
+            Filter("fps", fps)]
+
+
+def setpts(expr):
+    return Filter("setpts", expr)
+
+
+def trim(start=None, end=None, audio=False):
+    return Filter("atrim" if audio else "trim", start=start, end=end)
+
+
+def volume(level):
+    return Filter("volume", f"{level:.2f}")
+
+
+# ---------------- 优化 ----------------
+
+def _advance(state, f):
+    """根据一个滤镜更新 (宽, 高, 帧率) 状态，未知的项为 None"""
+    w, h, fps = state
+    if f.name == "scale":
+        try:
+            tw, th = int(f.args[0]), int(f.args[1])
+        except (IndexError, ValueError):
+            return None, None, fps
+        if f.get("force_original_aspect_ratio") and (w, h) != (tw, th):
+            return None, None, fps
+        return tw, th, fps
+    if f.name == "crop":
+        try:
+            return int(f.args[0]), int(f.args[1]), fps
+        except (IndexError, ValueError):
+            return None, None, fps
+    if f.name == "fps":
+        try:
+            return w, h, float(f.args[0])
+        except (IndexError, ValueError):
+            return w, h, None
+    if f.name == "setpts":
+        m = _SETPTS_RE.match(f.args[0] if f.args else "")
+        if m and fps:
+            k = float(m.group(2))
+            return w, h, fps * k if m.group(1) == "/" else fps / k
+        if f.args and f.args[0] == "PTS-STARTPTS":
+            return state
+        return w, h, None
+    return state
+
+
+def _initial_state(info):
+    if not info:
+        return None, None, None
+    return info.get("width") or None, info.get("height") or None, info.get("fps") or None
+
+
+def _is_identity(f, state):
+    w, h, _ = state
+    if f.name in ("setpts", "asetpts") and f.args == ["PTS"]:
+        return True
+    if f.name == "volume" and f.args and f.args[0] in ("1", "1.0", "1.00") and len(f.opts) == 0:
+        return True
+    if f.name in ("trim", "atrim") and set(f.opts) <= {"start"} and float(f.opts.get("start", 0)) == 0:
+        return True
+    if f.name in ("scale", "crop") and w and h and f.args[:2] == [str(w), str(h)]:
+        return True
+    return False
+
+
+def drop_identity(filters, info=None):
+    """
+    去掉不改变画面/时间轴的节点：setpts=PTS、volume=1、trim=start=0、尺寸已一致的 scale/crop
+    fps 即使帧率相同也保留，它同时把时间基统一成 1/30，xfade 要求两路输入时间基一致
+    """
+    out, state = [], _initial_state(info)
+    for f in filters:
+        if _is_identity(f, state):
+            continue
+        out.append(f)
+        state = _advance(state, f)
+    return out
+
+
+def merge_setpts(filters):
+    """相邻的两个 setpts 合并为一个：后者表达式里的 PTS/STARTPTS 用前者代入"""
+    out = []
+    for f in filters:
+        prev = out[-1] if out else None
+        if (prev is not None and f.name == prev.name and f.name in ("setpts", "asetpts")
+                and _SIMPLE_EXPR_RE.match(prev.args[0]) and _SIMPLE_EXPR_RE.match(f.args[0])):
+            first = prev.args[0]
+            start = _PTS_TOKEN_RE.sub("STARTPTS", first)
+            merged = _PTS_TOKEN_RE.sub(lambda m: f"({start})" if m.group(1) == "STARTPTS" else f"({first})",
+                                       f.args[0])
+            out[-1] = Filter(f.name, merged)
+            continue
+        out.append(f)
+    return out
+
+
+def hoist_timing(filters, info=None):
+    """
+    trim 和降帧的 fps 只丢帧不改画面，提到 scale/crop 之前，被丢掉的帧就不必再缩放裁切
+    （例如 A 变速 1.2 倍后是 36fps，先降到 30fps 再缩放能省下六分之一的缩放量）
+    """
+    filters = list(filters)
+    moved = True
+    while moved:
+        moved = False
+        state = _initial_state(info)
+        for i, f in enumerate(filters):
+            if i > 0 and filters[i - 1].name in _SPATIAL:
+                reduces = f.name == "trim" or (
+                    f.name == "fps" and state[2] and f.args and float(f.args[0]) < state[2] - 1e-6)
+                if reduces:
+                    filters[i - 1], filters[i] = f, filters[i - 1]
+                    moved = True
+                    break
+            state = _advance(state, f)
+    return filters
+
+
+# ---------------- 成片滤镜图 ----------------
+
+def a_video_filters(scaler=None):
+    """A 画面：1.2 倍速 → 标准化 → 裁掉寻址后剩余的开头 → 时间戳归零"""
+    return [setpts(f"PTS/{A_SPEED}"), *normalize(scaler=scaler), trim(start=A_VIDEO_TRIM),
+            setpts("PTS-STARTPTS")]
+
+
+def b_video_filters(normalized, scaler=None):
+    """B 中间件已经标准化过，只需对齐帧率/时间基"""
+    return [Filter("setsar", 1), Filter("fps", FPS)] if normalized else normalize(scaler=scaler)
+
+
+def xfade(effect, offset, duration=0.5):
+    return Filter("xfade", transition=effect, duration=duration, offset=offset)
+
+
+def add_transition(graph, effect, offset, out, post=()):
+    """
+    [v0] 与 [v1] 之间的转场，后接 post 滤镜输出到 out
+    effect 为 CUT_EFFECT 时不用 xfade：A 在转场点截断后直接接上 B，B 在成片里的位置和总时长都不变
+    """
+    if effect == CUT_EFFECT:
+        graph.chain("v0", [trim(end=offset)], "v0c")
+        graph.chain(["v0c", "v1"], [Filter("concat", n=2, v=1, a=0), *post], out)
+    else:
+        graph.chain(["v0", "v1"], [xfade(effect, offset), *post], out)
+    return graph
+
+
+def _drawtext(font, fontfile, text, color, size, border, border_color, y, **extra):
+    """给出 fontfile 时直接加载该字体文件，否则按系统字体名 font 交给 fontconfig 查找"""
+    face = {"fontfile": quote(escape_path(fontfile))} if fontfile else {"font": font}
+    return Filter("drawtext", **face, text=quote(text), fontcolor=color, fontsize=size, borderw=border,
+                  bordercolor=border_color, x="(w-text_w)/2", y=y, **extra)
+
+
+def title_filter(font, text, color, size, border, border_color, t_s, t_e, scale=1.0, fontfile=None):
+    """标题 drawtext，在 t_s 后 1 秒内淡入、t_e 前 1 秒内淡出；scale 用于缩小分辨率的草稿"""
+    alpha = f"if(lt(t,{t_s}),0,if(lt(t,{t_s}+1),t-{t_s},if(lt(t,{t_e}-1),1,if(lt(t,{t_e}),{t_e}-t,0))))"
+    if scale != 1.0:
+        size, border = max(1, round(int(size) * scale)), max(1, round(int(border) * scale))
+    return _drawtext(font, fontfile, text, color, size, border, border_color, round(TITLE_Y * scale),
+                     alpha=quote(alpha))
+
+
+def title_band(size, border):
+    """预渲染标题图层的 (高度, 文字上边距)：上下留出描边和下伸部的空间，高度取偶数"""
+    size, border = int(size), int(border)
+    height = size * 2 + border * 2
+    return height + height % 2, size // 2 + border
+
+
+def title_image_filter(font, text, color, size, border, border_color, fontfile=None):
+    """把标题画到透明图层上，不透明度恒为 1，淡入淡出在叠加时处理"""
+    _, pad = title_band(size, border)
+    return _drawtext(font, fontfile, text, color, size, border, border_color, pad)
+
+
+@dataclass
+class TitleLayer:
+    """预渲染好的标题图层（RGBA PNG）及其在成片中的显示窗口"""
+    path: str
+    t_s: float
+    t_e: float
+    size: int
+    border: int
+
+    def input(self):
+        return StillSpan(self.path, self.t_s, self.t_e - self.t_s)
+
+
+def add_title_overlay(graph, main, image, title, out):
+    """
+    把标题图层叠加到 main 上：t_s 后 1 秒内淡入、t_e 前 1 秒内淡出；
+    图层输入只在窗口内有帧，enable 让窗口外的帧直接跳过叠加
+    """
+    _, pad = title_band(title.size, title.border)
+    graph.chain(image, [Filter("fade", t="in", st=title.t_s, d=1, alpha=1),
+                        Filter("fade", t="out", st=max(0.0, title.t_e - 1), d=1, alpha=1)], "title")
+    graph.chain([main, "title"],
+                [Filter("overlay", x=0, y=TITLE_Y - pad, eof_action="pass",
+                        enable=quote(f"between(t,{_fmt(title.t_s)},{_fmt(title.t_e)})"))], out)
+    return graph
+
+
+def escape_path(path):
+    """滤镜参数里的文件路径：反斜杠换正斜杠，盘符冒号转义"""
+    return path.replace("\\", "/").replace(":", "\\:")
+
+
+def ass_color(hex_color):
+    """#RRGGBB → ASS 的 &HBBGGRR&"""
+    h = hex_color.lstrip('#')
+    return f"&H{h[4:6]}{h[2:4]}{h[0:2]}&"
+
+
+def subtitle_style(size, color, border_color, border, margin):
+    """subtitles 的 force_style：底部居中、描边无阴影"""
+    return (f"Fontsize={int(size)},PrimaryColour={ass_color(color)},OutlineColour={ass_color(border_color)},"
+            f"BorderStyle=1,Outline={int(border)},Shadow=0,Alignment=2,MarginV={int(margin)}")
+
+
+def subtitles_filter(path, style):
+    """path 需已按滤镜语法转义（反斜杠换正斜杠、冒号转义）"""
+    return Filter("subtitles", quote(path), force_style=quote(style))
+
+
+def _a_audio(graph, a_in, vol_a):
+    """A 原音：裁掉寻址后剩余的开头，时间戳归零后调音量，输出 [a0]"""
+    graph.chain(a_in, [trim(start=A_AUDIO_TRIM, audio=True), Filter("asetpts", "PTS-STARTPTS"), volume(vol_a)],
+                "a0")
+
+
+def add_audio_mix(graph, a_in, v_in, m_in, vols):
+    """A 原音（裁掉寻址后剩余的开头）+ 解说 + BGM 按音量混合到 [a_out]"""
+    vol_a, vol_v, vol_m = vols
+    _a_audio(graph, a_in, vol_a)
+    graph.chain(v_in, [volume(vol_v)], "av")
+    graph.chain(m_in, [volume(vol_m)], "am")
+    graph.chain(["a0", "av", "am"], [Filter("amix", inputs=3, dropout_transition=0)], "a_out")
+    return graph
+
+
+def render_graph(effect, offset, overlays, vols, b_normalized=False, scaler=None, sources=None, title=None):
+    """
+    完整渲染的 filter_complex：输入 0=A 1=B 2=解说 3=BGM（4=标题图层），输出 [v_out] [a_out]
+    overlays 为叠加在转场之后的滤镜（标题、字幕），title 为预渲染的标题图层
+    """
+    title_in = "4:v"
+    graph = FilterGraph()
+    graph.chain("0:v", a_video_filters(scaler), "v0")
+    graph.chain("1:v", b_video_filters(b_normalized, scaler), "v1")
+    add_transition(graph, effect, offset, "vm", [Filter("format", "yuv420p")])
+    if not title:
+        graph.chain("vm", list(overlays), "v_out")
+    elif overlays:
+        add_title_overlay(graph, "vm", title_in, title, "vt")
+        graph.chain("vt", list(overlays), "v_out")
+    else:
+        add_title_overlay(graph, "vm", title_in, title, "v_out")
+    add_audio_mix(graph, "0:a", "2:a", "3:a", vols)
+    return graph.optimize(sources)
+
+
+def smart_head_graph(effect, offset, overlays, scaler=None, sources=None, title=None):
+    """智能渲染头段：输入 0=A 1=B 中间件（2=标题图层），只输出画面 [v_out]"""
+    graph = FilterGraph()
+    graph.chain("0:v", a_video_filters(scaler), "v0")
+    graph.chain("1:v", b_video_filters(True), "v1")
+    if title:
+        # 智能渲染头段不叠字幕，标题图层直接输出
+        add_transition(graph, effect, offset, "vm", [Filter("format", "yuv420p")])
+        add_title_overlay(graph, "vm", "2:v", title, "v_out")
+    else:
+        add_transition(graph, effect, offset, "v_out", [Filter("format", "yuv420p"), *overlays])
+    return graph.optimize(sources)
+
+
+def chunk_graph(effect, offset, start, overlays, with_a, with_b, b_normalized=False, sources=None, title=None):
+    """
+    分段并行编码的一段：输入依次为 A、B（段内没有的省略）和标题图层，只输出画面 [v_out]
+    与草稿相同，叠加标题/字幕前把时间戳平移回成片时间，输出前归零，各段编码后直接拼接
+    """
+    a_filters = [setpts(f"PTS/{A_SPEED}"), *normalize(), setpts("PTS-STARTPTS")]
+    base = "vm" if title or overlays else "v_out"
+    graph = FilterGraph()
+    if with_a and with_b:
+        graph.chain("0:v", a_filters, "v0")
+        graph.chain("1:v", b_video_filters(b_normalized), "v1")
+        add_transition(graph, effect, offset, base, [Filter("format", "yuv420p")])
+    elif with_a:
+        graph.chain("0:v", [*a_filters, Filter("format", "yuv420p")], base)
+    else:
+        graph.chain("0:v", [*b_video_filters(b_normalized), setpts("PTS-STARTPTS"), Filter("format", "yuv420p")],
+                    base)
+    if title:
+        graph.chain("vm", [setpts(f"PTS+{start:.3f}/TB")], "vs")
+        add_title_overlay(graph, "vs", f"{int(with_a) + int(with_b)}:v", title, "vt")
+        graph.chain("vt", [*overlays, setpts("PTS-STARTPTS")], "v_out")
+    elif overlays:
+        graph.chain("vm", [setpts(f"PTS+{start:.3f}/TB"), *overlays, setpts("PTS-STARTPTS")], "v_out")
+    return graph.optimize(sources)
+
+
+def draft_graph(effect, offset, start, overlays, with_b, sources=None):
+    """
+    草稿预览：四分之一分辨率 + 快速双线性缩放，只输出画面 [v_out]
+    xfade 要求两路输入都从 0 开始，所以叠加标题/字幕前把时间戳平移回成片时间，
+    alpha 表达式和字幕时间轴都不必改写，输出前再归零
+    """
+    w, h = int(WIDTH * DRAFT_SCALE), int(HEIGHT * DRAFT_SCALE)
+    graph = FilterGraph()
+    a_filters = [setpts(f"PTS/{A_SPEED}"), *normalize(w, h, scaler=DRAFT_SCALER), setpts("PTS-STARTPTS")]
+    if with_b:
+        graph.chain("0:v", a_filters, "v0")
+        graph.chain("1:v", normalize(w, h, scaler=DRAFT_SCALER), "v1")
+        add_transition(graph, effect, offset, "vm", [Filter("format", "yuv420p")])
+    else:
+        graph.chain("0:v", [*a_filters, Filter("format", "yuv420p")], "vm")
+    graph.chain("vm", [setpts(f"PTS+{start:.3f}/TB"), *overlays, setpts("PTS-STARTPTS")], "v_out")
+    return graph.optimize(sources)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森输入区间规划
+根据探测到的时长算出每路输入真正用到的时间段，生成输入端 -ss / -t，
+让 ffmpeg 只解码需要的帧和采样，而不是解码整段再在滤镜里 trim 掉
+"""
+from dataclasses import dataclass
+
+# 主视频 A 的变速倍率
+A_SPEED = 1.2
+# 成片从 A 变速后的第 1 秒开始；原音 atrim=start=1 按原速计
+A_HEAD_SKIP = 1.0
+XFADE_DUR = 0.5
+# 输入端统一从原音起点寻址，画面起点更靠后，剩下的部分在滤镜里补裁
+A_SEEK = min(A_HEAD_SKIP, A_HEAD_SKIP * A_SPEED)
+A_VIDEO_TRIM = (A_HEAD_SKIP * A_SPEED - A_SEEK) / A_SPEED
+A_AUDIO_TRIM = A_HEAD_SKIP - A_SEEK
+# 区间末尾多留一帧，避免浮点误差让最后一帧被截掉
+FRAME_MARGIN = 1 / 30
+
+
+@dataclass
+class InputSpan:
+    """一路输入及其需要读取的时间段（秒，按原始时间轴）"""
+    path: str
+    start: float = 0.0
+    duration: float = None
+    loop: bool = False
+
+    def args(self):
+        """-stream_loop / -ss / -t 都是输入选项，必须写在 -i 之前"""
+        args = ['-stream_loop', '-1'] if self.loop else []
+        if self.start > 0:
+            args += ['-ss', f"{self.start:.3f}"]
+        if self.duration is not None:
+            args += ['-t', f"{self.duration + FRAME_MARGIN:.3f}"]
+        return args + ['-i', self.path]
+
+
+@dataclass
+class StillSpan:
+    """静态图片输入（预渲染的标题图层）：按帧率循环，时间戳从 start 开始，只持续 duration 秒"""
+    path: str
+    start: float
+    duration: float
+    fps: int = 30
+
+    def args(self):
+        return ['-loop', '1', '-framerate', str(self.fps), '-itsoffset', f"{self.start:.3f}",
+                '-t', f"{self.duration + FRAME_MARGIN:.3f}", '-i', self.path]
+
+
+@dataclass
+class InputPlan:
+    off: float
+    total: float
+    a: InputSpan
+    b: InputSpan
+    v: InputSpan
+    m: InputSpan
+
+
+def a_video_end(off):
+    """A 画面最后被用到的原始时间：转场结束时刻换算回 A 的原速时间轴"""
+    return (off + XFADE_DUR + A_HEAD_SKIP) * A_SPEED
+
+
+def plan_inputs(in_a, in_b, in_v, in_m, dur_a, dur_b):
+    """
+    成片 = A(1.2 倍速，去掉开头 1 秒) + 0.5s 转场 + B，总长 d_a + d_b - 2.5
+    A 的原音一直铺到成片结束，所以 A 读到 画面/原音 两者较晚的终点；
+    B 只需要转场起点之后的部分，解说和循环 BGM 只读到成片结束
+    """
+    d_a = dur_a / A_SPEED
+    off = max(0.1, d_a - 1.5)
+    total = d_a + dur_b - 2.5
+    a_end = max(a_video_end(off), A_HEAD_SKIP + total)
+    return InputPlan(
+        off=off, total=total,
+        a=InputSpan(in_a, A_SEEK, a_end - A_SEEK),
+        b=InputSpan(in_b, 0.0, total - off),
+        v=InputSpan(in_v, 0.0, total),
+        m=InputSpan(in_m, 0.0, total, loop=True),
+    )
+
+
+@dataclass
+class DraftPlan:
+    """草稿预览：只渲染标题出现前后的一小段画面"""
+    start: float
+    end: float
+    off: float
+    a: InputSpan
+    b: InputSpan = None
+
+
+def plan_draft_inputs(in_a, in_b, dur_a, dur_b, t_s, t_e, margin=0.5):
+    """
+    截取成片时间轴上 [t_s - margin, t_e + margin] 的窗口，A 直接寻址到窗口起点对应的原始时间，
+    窗口越过转场点时才读取 B 的开头部分
+    """
+    d_a = dur_a / A_SPEED
+    off = max(0.1, d_a - 1.5)
+    total = d_a + dur_b - 2.5
+    end = min(total, t_e + margin)
+    # 转场要求 A 从窗口起点开始、偏移非负，窗口起点不能晚于转场点
+    start = max(0.0, min(t_s - margin, off - 0.1, end - 0.1))
+    a_end = min(end, off + XFADE_DUR)
+    a = InputSpan(in_a, (start + A_HEAD_SKIP) * A_SPEED, (a_end - start) * A_SPEED)
+    b = InputSpan(in_b, 0.0, end - off) if end > off else None
+    return DraftPlan(start=start, end=end, off=off - start, a=a, b=b)
+
+
+def plan_chunk_inputs(in_a, in_b, off, start, end):
+    """
+    分段并行编码中成片时间轴上 [start, end) 这一段的输入，复用草稿的窗口结构（off 为段内转场偏移）
+    切点不会落在转场窗口内：转场之前的段读 A（跨过转场点时再读 B 的开头），之后的段只读 B 的对应区间
+    """
+    if start >= off + XFADE_DUR:
+        return DraftPlan(start=start, end=end, off=None, a=None, b=InputSpan(in_b, start - off, end - start))
+    a_end = min(end, off + XFADE_DUR)
+    a = InputSpan(in_a, (start + A_HEAD_SKIP) * A_SPEED, (a_end - start) * A_SPEED)
+    b = InputSpan(in_b, 0.0, end - off) if end > off else None
+    return DraftPlan(start=start, end=end, off=off - start, a=a, b=b)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森跑批日志（可续跑）
+导出目录下的 .nelson_journal.jsonl：第一行是整批计划（每个任务已解析好的随机选择），
+之后每完成一个任务追加一行 {"done": 序号}。程序崩溃或中途关闭后，
+下一次同样的跑批会沿用原计划，只重跑未完成的任务
+"""
+import json
+import os
+import threading
+from dataclasses import asdict
+
+from nelson_cache import content_key
+
+JOURNAL_NAME = ".nelson_journal.jsonl"
+# 任务字段格式变化时递增，旧格式的计划不再续跑
+JOURNAL_VERSION = 3
+# 不影响成片内容的配置项，不参与指纹
+_VOLATILE_FIELDS = ("max_workers", "max_processes", "retry_attempts", "stall_timeout", "language", "resume")
+# 运行期字段，不写入日志
+_RUNTIME_FIELDS = ("on_progress", "error")
+
+
+def batch_fingerprint(config, files):
+    """配置 + 各目录文件清单 决定一批任务的身份"""
+    data = {k: v for k, v in asdict(config).items() if k not in _VOLATILE_FIELDS}
+    return content_key(JOURNAL_VERSION, json.dumps(data, sort_keys=True, ensure_ascii=False),
+                       json.dumps(files, sort_keys=True, ensure_ascii=False))
+
+
+def part_path(out_p):
+    """渲染中的临时文件名，成功后原子改名为正式文件，半成品不会被当成已完成"""
+    root, ext = os.path.splitext(out_p)
+    return f"{root}.part{ext}"
+
+
+class BatchJournal:
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, JOURNAL_NAME)
+        self._lock = threading.Lock()
+
+    def load(self, fingerprint):
+        """读取与指纹匹配的计划，返回已标记完成状态的任务列表；没有可续跑的计划时返回 None"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            plan = json.loads(lines[0])
+        except (OSError, ValueError, IndexError):
+            return None
+        if plan.get("fingerprint") != fingerprint:
+            return None
+
+        done = set()
+        for line in lines[1:]:
+            try:
+                done.add(json.loads(line)["done"])
+            except (ValueError, KeyError, TypeError):
+                # 崩溃时写了一半的最后一行直接忽略
+                continue
+        jobs = plan["jobs"]
+        for job in jobs:
+            job["done"] = job["index"] in done
+            error = job.pop("error_text", None)
+            job["error"] = RuntimeError(error) if error else None
+        return jobs
+
+    def start(self, fingerprint, jobs):
+        """写入新的整批计划（先写临时文件再原子替换）"""
+        serial = []
+        for job in jobs:
+            item = {k: v for k, v in job.items() if k not in _RUNTIME_FIELDS}
+            if job.get("error") is not None:
+                item["error_text"] = str(job["error"])
+            serial.append(item)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"fingerprint": fingerprint, "jobs": serial}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def mark_done(self, index):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"done": index}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear(self):
+        """整批全部成功后删除日志，下次跑批重新随机"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
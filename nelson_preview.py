@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森样式预览
+在界面里即时显示标题/字幕效果：从第一个 A 素材截一帧标准化底图（按素材缓存），
+再用与成片完全相同的 drawtext 和预编译 ASS 字幕渲染单帧 PNG（按样式参数哈希缓存），
+调整滑块时只在样式真正变化时启动一次单帧 ffmpeg
+"""
+import json
+import os
+
+from nelson_cache import DiskCache, content_key, source_key
+from nelson_graph import DRAFT_SCALE, DRAFT_SCALER, HEIGHT, WIDTH, Filter, normalize, title_filter
+from nelson_inputs import A_HEAD_SKIP, A_SPEED
+from nelson_probe import DEFAULT_CACHE_DIR
+from nelson_runner import run_ffmpeg
+from nelson_subs import SubtitleCache, parse_srt, read_text
+
+PREVIEW_W, PREVIEW_H = int(WIDTH * DRAFT_SCALE), int(HEIGHT * DRAFT_SCALE)
+# 拖动滑块时停顿多久才渲染（毫秒）
+PREVIEW_DEBOUNCE_MS = 250
+VIDEO_EXTS = ('.mp4', '.mov')
+# 没有 A 素材时的纯色底图
+BLANK_COLOR = "#333333"
+# 临时文件以 .tmp 结尾（淘汰时跳过），扩展名推断不出格式，显式指定单帧 PNG 输出
+PNG_OUTPUT = ['-frames:v', '1', '-update', '1', '-c:v', 'png', '-f', 'image2']
+
+
+def first_cue_time(srt_path):
+    """字幕文件第一条的中点时间（秒），读不到时返回 None"""
+    try:
+        cues = parse_srt(read_text(srt_path))
+    except OSError:
+        return None
+    return (cues[0][0] + cues[0][1]) / 2 if cues else None
+
+
+def preview_source(a_dir):
+    """A 目录里第一个视频作为预览底图素材"""
+    try:
+        names = sorted(f for f in os.listdir(a_dir) if f.lower().endswith(VIDEO_EXTS))
+    except OSError:
+        return None
+    return os.path.join(a_dir, names[0]) if names else None
+
+
+def preview_style(config):
+    """
+    从 RenderConfig 取出影响画面的样式参数
+    随机颜色/字体模式下预览用面板上当前选中的颜色和字体
+    """
+    style = {
+        "font": config.font_name,
+        "fontfile": config.font_file if config.font_file and os.path.isfile(config.font_file) else None,
+        "text": config.title_text, "color": config.title_color,
+        "size": int(config.title_size), "border": int(config.title_border),
+        "border_color": config.title_border_color,
+        "t_s": float(config.time_start), "t_e": float(config.time_end),
+        "srt": None,
+    }
+    srt_path = config.paths.get("srt")
+    if config.enable_srt and srt_path and os.path.exists(srt_path):
+        # 与引擎任务里的字幕设置同一格式，共用预编译的 ASS
+        style["srt"] = {"path": srt_path, "size": int(config.srt_size), "color": config.srt_color,
+                        "border_color": config.srt_border_color, "border": int(config.srt_border),
+                        "margin": int(config.srt_margin)}
+    return style
+
+
+class StylePreview(DiskCache):
+    """底图和单帧效果图都放在磁盘 LRU 缓存里，相同素材+样式再次预览不启动 ffmpeg"""
+
+    def __init__(self, ffmpeg_path, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "preview"),
+                 max_bytes=64 * 1024 ** 2):
+        super().__init__(cache_dir, max_bytes)
+        self.ffmpeg_path = ffmpeg_path
+        self.subtitle_cache = SubtitleCache()
+
+    def background(self, src_path, at):
+        """A 素材在成片时间 at 处的标准化底图；没有素材时生成纯色底图"""
+        if src_path and os.path.exists(src_path):
+            group, key = content_key(os.path.abspath(src_path), PREVIEW_W, PREVIEW_H), content_key(
+                source_key(src_path), f"{at:.2f}")
+        else:
+            group, key = "blank", content_key(BLANK_COLOR, PREVIEW_W, PREVIEW_H)
+        with self.key_lock(group):
+            hit = self.lookup(group, key, "png")
+            if hit:
+                return hit
+            tmp = self.path_for(group, key, "png") + ".tmp"
+            vf = ",".join(str(f) for f in normalize(PREVIEW_W, PREVIEW_H, scaler=DRAFT_SCALER)[:3])
+            if group == "blank":
+                cmd = [self.ffmpeg_path, '-y', '-v', 'error', '-f', 'lavfi',
+                       '-i', f"color=c={BLANK_COLOR}:s={PREVIEW_W}x{PREVIEW_H}", *PNG_OUTPUT, tmp]
+                result = run_ffmpeg(cmd)
+            else:
+                # 成片时间换算回 A 的原始时间；素材太短截不到时退回第一帧
+                result = None
+                for seek in ((at + A_HEAD_SKIP) * A_SPEED, 0.0):
+                    cmd = [self.ffmpeg_path, '-y', '-v', 'error', '-ss', f"{seek:.3f}", '-i', src_path,
+                           '-vf', vf, *PNG_OUTPUT, tmp]
+                    result = run_ffmpeg(cmd)
+                    if result.returncode == 0 and os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+                        break
+            if result.returncode != 0 or not os.path.exists(tmp):
+                print("预览底图生成失败：", result.stderr)
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return None
+            return self.commit(tmp, group, key, "png")
+
+    def render(self, src_path, style):
+        """返回按 style 渲染好的单帧 PNG 路径，失败时返回 None"""
+        # 标题固定显示在时间窗中点，字幕取第一条的时间
+        at = (style["t_s"] + style["t_e"]) / 2
+        cue = first_cue_time(style["srt"]["path"]) if style.get("srt") else None
+        bg = self.background(src_path, at)
+        if bg is None:
+            return None
+
+        t = cue if cue is not None else at
+        srt_key = None
+        if style.get("srt"):
+            st = os.stat(style["srt"]["path"])
+            srt_key = (st.st_size, st.st_mtime, json.dumps(style["srt"], sort_keys=True, ensure_ascii=False))
+        group = content_key(json.dumps({k: v for k, v in style.items() if k != "srt"}, sort_keys=True,
+                                       ensure_ascii=False), srt_key)
+        key = os.path.splitext(os.path.basename(bg))[0].split("_")[-1]
+        with self.key_lock(group):
+            hit = self.lookup(group, key, "png")
+            if hit:
+                return hit
+            # 单帧图片时间戳为 0，平移到 t 后标题淡入表达式和字幕时间轴都按成片时间计算
+            filters = [Filter("setpts", f"PTS+{t:.3f}/TB"),
+                       title_filter(style["font"], style["text"], style["color"], style["size"], style["border"],
+                                    style["border_color"], f"{t - 2:g}", f"{t + 2:g}", scale=DRAFT_SCALE,
+                                    fontfile=style.get("fontfile"))]
+            subtitles = self.subtitle_cache.filter(style["srt"], window=(t, t)) if style.get("srt") else None
+            if subtitles:
+                filters.append(subtitles)
+            tmp = self.path_for(group, key, "png") + ".tmp"
+            cmd = [self.ffmpeg_path, '-y', '-v', 'error', '-i', bg, '-vf', ",".join(str(f) for f in filters),
+                   *PNG_OUTPUT, tmp]
+            result = run_ffmpeg(cmd)
+            if result.returncode != 0 or not os.path.exists(tmp):
+                print("预览渲染失败：", result.stderr)
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return None
+            return self.commit(tmp, group, key, "png")
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森媒体探测缓存
+ffprobe 结果按 (路径, 大小, 修改时间) 持久化到 SQLite，
+同一素材库重复跑批时不再启动 ffprobe 进程；响度测量结果也存在同一条记录里
+"""
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from nelson_runner import RC_CANCELLED, run_ffmpeg
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".nelson_cache")
+# 各路音频先统一到这个响度（LUFS），界面上的音量滑块再在此基础上调整
+LOUDNESS_TARGET = -16.0
+# 提升音量后真峰值不超过这个上限（dBTP）
+TRUE_PEAK_CEILING = -1.5
+# 增益上下限（dB），几乎无声的素材不会被放大成噪音
+MAX_GAIN_DB = 12.0
+MIN_GAIN_DB = -24.0
+_LUFS_RE = re.compile(r"\bI:\s*(-?[\d.]+|-inf) LUFS")
+_PEAK_RE = re.compile(r"\bPeak:\s*(-?[\d.]+|-inf) dBFS")
+
+
+def _parse_rate(rate):
+    """把 ffprobe 的 "30000/1001" 形式帧率转成浮点数"""
+    try:
+        num, _, den = (rate or "0/1").partition("/")
+        den = float(den or 1)
+        return float(num) / den if den else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _rotation(video):
+    """手机素材常带旋转元数据，ffmpeg 会自动转正，实际画面宽高和探测到的相反"""
+    try:
+        if "rotate" in video.get("tags", {}):
+            return int(video["tags"]["rotate"]) % 360
+        for side in video.get("side_data_list", []):
+            if "rotation" in side:
+                return int(side["rotation"]) % 360
+    except (TypeError, ValueError):
+        pass
+    return 0
+
+
+def measure_loudness(ffmpeg_path, file_path, job_id=None):
+    """
+    单次解码测量第一条音轨的综合响度和真峰值，返回 {"i": LUFS, "tp": dBTP}，失败时返回 None
+    ebur128 的汇总在输出末尾，逐帧日志之后出现的最后一组数值就是整段结果；
+    被取消时抛出 RuntimeError，避免把“无结果”写进缓存
+    """
+    cmd = [ffmpeg_path, '-hide_banner', '-i', file_path, '-vn', '-map', '0:a:0',
+           '-af', 'ebur128=peak=true', '-f', 'null', '-']
+    result = run_ffmpeg(cmd, job_id=job_id)
+    if result.returncode == RC_CANCELLED:
+        raise RuntimeError("任务已取消")
+    lufs = _LUFS_RE.findall(result.stderr or "")
+    peak = _PEAK_RE.findall(result.stderr or "")
+    if result.returncode != 0 or not lufs:
+        return None
+    return {"i": float(lufs[-1]), "tp": float(peak[-1]) if peak else 0.0}
+
+
+def loudness_gain(loudness, target=LOUDNESS_TARGET, ceiling=TRUE_PEAK_CEILING):
+    """把测得的响度拉到 target 所需的线性增益，受真峰值上限和增益上下限约束"""
+    if not loudness or loudness["i"] == float("-inf"):
+        return 1.0
+    gain_db = min(target - loudness["i"], ceiling - loudness["tp"], MAX_GAIN_DB)
+    return 10 ** (max(MIN_GAIN_DB, gain_db) / 20)
+
+
+def run_ffprobe(ffprobe_path, file_path):
+    """调用一次 ffprobe，返回整理后的媒体信息字典"""
+    cmd = [ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path]
+    res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    data = json.loads(res.stdout)
+
+    streams = [{"index": s.get("index"), "type": s.get("codec_type"), "codec": s.get("codec_name")}
+               for s in data.get("streams", [])]
+    video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), {})
+    return {
+        "duration": float(data["format"]["duration"]),
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "fps": _parse_rate(video.get("avg_frame_rate") or video.get("r_frame_rate")),
+        "rotation": _rotation(video),
+        "has_audio": any(s["type"] == "audio" for s in streams),
+        "streams": streams,
+    }
+
+
+class ProbeCache:
+    """线程安全的 ffprobe 结果缓存，源文件大小或修改时间变化时自动失效"""
+
+    def __init__(self, ffprobe_path, cache_dir=DEFAULT_CACHE_DIR):
+        self.ffprobe_path = ffprobe_path
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "probe.sqlite")
+        self._lock = threading.Lock()
+        self._measure_locks = {}
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probe ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, info TEXT)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(file_path):
+        st = os.stat(file_path)
+        return os.path.abspath(file_path), st.st_size, st.st_mtime
+
+    def get(self, file_path):
+        """只查缓存，未命中或已失效时返回 None"""
+        path, size, mtime = self._key(file_path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, info FROM probe WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == size and row[1] == mtime:
+            return json.loads(row[2])
+        return None
+
+    def put(self, file_path, info):
+        path, size, mtime = self._key(file_path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO probe (path, size, mtime, info) VALUES (?, ?, ?, ?)",
+                               (path, size, mtime, json.dumps(info)))
+            self._conn.commit()
+
+    def probe(self, file_path):
+        """命中缓存直接返回，否则调用 ffprobe 并写入缓存"""
+        info = self.get(file_path)
+        if info is None:
+            info = run_ffprobe(self.ffprobe_path, file_path)
+            self.put(file_path, info)
+        return info
+
+    def duration(self, file_path):
+        return self.probe(file_path)["duration"]
+
+    def loudness(self, file_path, ffmpeg_path, job_id=None):
+        """
+        命中缓存直接返回响度，否则测量一次并写回探测记录；没有音轨或测量失败时返回 None
+        只缓存成功的结果（和没有音轨），测量失败的文件下次还会重测
+        同一文件同时只测量一次，其余线程等待后直接命中
+        """
+        with self._lock:
+            lock = self._measure_locks.setdefault(os.path.abspath(file_path), threading.Lock())
+        with lock:
+            info = self.probe(file_path)
+            if "loudness" in info:
+                return info["loudness"]
+            loudness = measure_loudness(ffmpeg_path, file_path, job_id) if info.get("has_audio") else None
+            if loudness is not None or not info.get("has_audio"):
+                self.put(file_path, {**info, "loudness": loudness})
+            return loudness
+
+    def cached_loudness(self, file_path):
+        """只查缓存里的响度，未测量、没有音轨或文件不存在时返回 None"""
+        try:
+            info = self.get(file_path)
+        except OSError:
+            return None
+        return info.get("loudness") if info else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def probe_all(cache, file_paths, workers=None, on_progress=None, ffmpeg_path=None, loudness_paths=()):
+    """
+    用有界线程池并发探测全部文件，返回 {路径: 信息或 None}
+    loudness_paths 中带音轨的文件同时用 ffmpeg_path 测量响度（已缓存的直接命中），渲染时只需查缓存
+    on_progress(done, total) 在调用方线程中按完成顺序回调
+    """
+    file_paths = list(dict.fromkeys(file_paths))
+    total = len(file_paths)
+    results = {}
+    if not total:
+        return results
+    # ffprobe 主要耗在进程启动和 IO 上，线程数可以比核数多
+    workers = workers or min(16, (os.cpu_count() or 1) * 2)
+    # 响度测量要完整解码音轨，同时进行的测量不超过核数
+    measure = set(loudness_paths) if ffmpeg_path else set()
+    measure_slots = threading.Semaphore(os.cpu_count() or 1)
+
+    def _one(fp):
+        try:
+            info = cache.probe(fp)
+        except Exception as e:
+            print(f"探测失败: {fp} - {str(e)}")
+            return fp, None
+        if fp in measure and info.get("has_audio"):
+            try:
+                with measure_slots:
+                    info = {**info, "loudness": cache.loudness(fp, ffmpeg_path)}
+            except Exception as e:
+                print(f"响度测量异常: {os.path.basename(fp)} - {str(e)}")
+        return fp, info
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nelson-probe") as pool:
+        futures = [pool.submit(_one, fp) for fp in file_paths]
+        for done, fut in enumerate(as_completed(futures), 1):
+            fp, info = fut.result()
+            results[fp] = info
+            if on_progress:
+                on_progress(done, total)
+    # 返回的字典仍按传入顺序排列
+    return {fp: results[fp] for fp in file_paths}
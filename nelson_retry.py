@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森失败分类与重试策略
+按 ffmpeg 的退出码和 stderr 尾部把失败归类，报告里写明失败原因；
+可恢复的失败按指数退避有限次重试，并沿降级链调整任务参数：
+NVENC 不可用时改用 libx264，转场滤镜出错时改为硬切，卡死或内存不足时退回单进程完整渲染
+"""
+import errno
+import re
+import threading
+
+from nelson_graph import CUT_EFFECT
+from nelson_runner import RC_CANCELLED, RC_STALLED
+
+# 失败类别
+STALLED = "stalled"
+CANCELLED = "cancelled"
+ENCODER = "encoder"
+FILTER = "filter"
+INPUT = "input"
+MISSING = "missing"
+DISK = "disk"
+MEMORY = "memory"
+UNKNOWN = "unknown"
+# 重试也不会好转的失败
+NO_RETRY = (CANCELLED, INPUT, MISSING, DISK)
+
+# 降级动作
+RETRY_SAME = "same"
+TO_X264 = "x264"
+TO_CUT = "cut"
+TO_SIMPLE = "simple"
+
+# 按顺序匹配 stderr 尾部，先匹配到的类别优先；只匹配具体的错误信息，
+# 不能只写编码器或滤镜名，尾部的流映射信息里本来就有它们
+_PATTERNS = [
+    (DISK, re.compile(r"No space left on device", re.IGNORECASE)),
+    # NVENC 会话数用尽时报的是 out of memory，要先于内存不足匹配
+    (ENCODER, re.compile(r"Unknown encoder|OpenEncodeSessionEx failed|No NVENC capable devices"
+                         r"|No capable devices found|Cannot load (?:nvcuda|libcuda|libnvidia-encode)"
+                         r"|InitializeEncoder failed|Error while opening encoder", re.IGNORECASE)),
+    (MEMORY, re.compile(r"Cannot allocate memory|Out of memory|bad_alloc", re.IGNORECASE)),
+    (FILTER, re.compile(r"No such filter|Error (?:re)?initializing (?:complex )?filters?"
+                        r"|Failed to configure (?:input|output) pad|\[Parsed_xfade", re.IGNORECASE)),
+    (MISSING, re.compile(r"No such file or directory", re.IGNORECASE)),
+    (INPUT, re.compile(r"Invalid data found when processing input|moov atom not found|corrupt"
+                       r"|Error while decoding|Invalid NAL unit", re.IGNORECASE)),
+]
+
+DEFAULT_ATTEMPTS = 3
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 30.0
+
+
+def classify(result):
+    """ffmpeg 结果（CompletedProcess）的失败类别"""
+    if result.returncode == RC_CANCELLED:
+        return CANCELLED
+    if result.returncode == RC_STALLED:
+        return STALLED
+    stderr = result.stderr or ""
+    for category, pattern in _PATTERNS:
+        if pattern.search(stderr):
+            return category
+    return UNKNOWN
+
+
+def classify_exception(e):
+    """渲染过程中抛出的异常的失败类别"""
+    if isinstance(e, FileNotFoundError):
+        return MISSING
+    if isinstance(e, MemoryError):
+        return MEMORY
+    if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+        return DISK
+    return UNKNOWN
+
+
+class RetryPolicy:
+    """
+    有限次重试 + 指数退避 + 降级链，同一个策略对象在一批任务之间共享：
+    编码器不可用属于整机问题，确认一次后之后的任务开始前直接降级，不再各自失败一遍
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, backoff=BACKOFF_BASE, max_backoff=BACKOFF_MAX):
+        self.attempts = max(1, int(attempts))
+        self.backoff_base = backoff
+        self.max_backoff = max_backoff
+        self._sticky = set()
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """第 attempt 次失败后等待的秒数"""
+        return min(self.max_backoff, self.backoff_base * 2 ** (attempt - 1))
+
+    def prepare(self, job):
+        """任务开始前应用已确认的整机降级，返回实际应用的降级动作列表"""
+        with self._lock:
+            sticky = set(self._sticky)
+        return [action for action in sticky if _apply(job, action)]
+
+    def next_step(self, job, category, attempt):
+        """
+        第 attempt 次尝试以 category 失败后的下一步：返回降级动作（RETRY_SAME 表示原样重试），
+        不再重试时返回 None。降级直接改写任务参数
+        """
+        if category in NO_RETRY or attempt >= self.attempts:
+            return None
+        if category == ENCODER:
+            if not _apply(job, TO_X264):
+                return None
+            with self._lock:
+                self._sticky.add(TO_X264)
+            return TO_X264
+        if category == FILTER:
+            for action in (TO_CUT, TO_SIMPLE):
+                if _apply(job, action):
+                    return action
+            return None
+        # 卡死 / 内存不足 / 未知错误：先退回单进程完整渲染，已经是最简路径时原样重试
+        return TO_SIMPLE if _apply(job, TO_SIMPLE) else RETRY_SAME
+
+
+def _apply(job, action):
+    """把降级动作应用到任务上，任务已经是降级后的状态时返回 False；settings 先复制，不影响同批其他任务"""
+    settings = job["settings"]
+    if action == TO_X264:
+        if settings["v_codec"] == "libx264":
+            return False
+        job["settings"] = {**settings, "v_codec": "libx264", "v_preset": "fast", "crf": None}
+        return True
+    if action == TO_CUT:
+        if job.get("eff") == CUT_EFFECT:
+            return False
+        job["eff"] = CUT_EFFECT
+        return True
+    if action == TO_SIMPLE:
+        if not settings.get("smart") and not settings.get("chunked"):
+            return False
+        job["settings"] = {**settings, "smart": False, "chunked": False}
+        return True
+    return False
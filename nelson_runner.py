@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森 ffmpeg 运行器
+基于 asyncio 子进程的统一运行器：通过 -progress 管道实时解析 out_time / fps / speed / bitrate，
+stderr 只保留有限尾部，并汇总成单任务与整批的百分比和剩余时间；输出进度长时间不前进时由看门狗停止进程。
+启动的 ffmpeg 登记在按本进程 PID 命名的文件里，取消时只停止自己启动的进程，
+程序崩溃留下的孤儿进程在下次启动时按登记清理
+"""
+import asyncio
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+# 界面刷新节流间隔（秒）
+UI_THROTTLE = 0.25
+# 失败报告只保留 stderr 最后若干行，单行截断，避免长日志撑爆内存
+STDERR_TAIL_LINES = 60
+MAX_LINE_CHARS = 2000
+# 子进程登记文件目录（与 nelson_probe.DEFAULT_CACHE_DIR 相同的缓存根目录）
+PID_DIR = os.path.join(os.path.expanduser("~"), ".nelson_cache", "pids")
+# 取消时先发 q 让 ffmpeg 自行收尾，超时再 terminate，仍不退出才 kill（秒）
+QUIT_TIMEOUT = 3
+TERMINATE_TIMEOUT = 5
+# 退出程序时等待全部进程走完停止流程的上限（秒）
+SHUTDOWN_TIMEOUT = QUIT_TIMEOUT + TERMINATE_TIMEOUT + 1
+# 输出进度超过这么久（秒）不前进就视为卡死并停止进程，0 表示不检测
+STALL_TIMEOUT = 120
+# 被取消 / 被看门狗停止的进程在结果里使用的退出码
+RC_CANCELLED = -1
+RC_STALLED = -2
+
+
+def _parse_out_time(value):
+    """解析 "00:01:23.456000" 形式的时间"""
+    try:
+        h, m, s = value.split(":")
+        return int(h) * 3600 + int(m) * 60 + float(s)
+    except ValueError:
+        return None
+
+
+def parse_progress_block(fields, duration=None):
+    """把一组 -progress 键值整理成进度快照"""
+    out_time = None
+    if fields.get("out_time_us", "N/A") != "N/A":
+        out_time = int(fields["out_time_us"]) / 1_000_000
+    elif "out_time" in fields:
+        out_time = _parse_out_time(fields["out_time"])
+    speed = fields.get("speed", "").rstrip("x").strip()
+    snap = {
+        "out_time": out_time or 0.0,
+        "fps": float(fields["fps"]) if fields.get("fps", "").replace(".", "", 1).isdigit() else 0.0,
+        "speed": float(speed) if speed.replace(".", "", 1).isdigit() else 0.0,
+        "bitrate": fields.get("bitrate", "N/A").strip(),
+        "done": fields.get("progress") == "end",
+    }
+    if duration:
+        snap["fraction"] = 1.0 if snap["done"] else min(1.0, snap["out_time"] / duration)
+    else:
+        snap["fraction"] = 1.0 if snap["done"] else 0.0
+    return snap
+
+
+def _create_time(pid):
+    """进程启动时间，用来确认 PID 没有被系统复用；没有 psutil 或进程不存在时返回 None"""
+    if not HAS_PSUTIL:
+        return None
+    try:
+        return psutil.Process(pid).create_time()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+class ProcessRegistry:
+    """
+    本进程启动的 ffmpeg 子进程登记表，持久化到 PID_DIR/<本进程 PID>.json
+    只记录自己启动的进程，取消和清理都不会碰到其他程序或其他用户的 ffmpeg
+    """
+
+    def __init__(self, pid_dir=PID_DIR):
+        self.pid_dir = pid_dir
+        self.path = os.path.join(pid_dir, f"{os.getpid()}.json")
+        self._children = {}
+        self._owner_created = _create_time(os.getpid())
+        self._cond = threading.Condition()
+
+    def _save(self):
+        try:
+            if not self._children:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            os.makedirs(self.pid_dir, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"owner": os.getpid(), "owner_created": self._owner_created,
+                           "children": {str(pid): created for pid, created in self._children.items()}}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"进程登记写入失败: {e}")
+
+    def add(self, pid):
+        with self._cond:
+            self._children[pid] = _create_time(pid)
+            self._save()
+
+    def remove(self, pid):
+        with self._cond:
+            self._children.pop(pid, None)
+            self._save()
+            self._cond.notify_all()
+
+    def pids(self):
+        with self._cond:
+            return list(self._children)
+
+    def wait_empty(self, timeout=None):
+        """等待所有登记的子进程退出，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._children, timeout)
+
+    def cleanup_orphans(self):
+        """
+        启动时清理上次崩溃留下的 ffmpeg：只处理登记者已经不在运行的登记文件，
+        并且 PID 的启动时间与登记时一致（没有被复用）才结束进程。没有 psutil 时无法核实，不做任何处理
+        返回结束的进程数
+        """
+        if not HAS_PSUTIL:
+            return 0
+        orphans = []
+        for path in glob.glob(os.path.join(self.pid_dir, "*.json")):
+            if path == self.path:
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            owner_created = _create_time(entry.get("owner", -1))
+            if owner_created is not None and owner_created == entry.get("owner_created"):
+                continue
+            for pid, created in entry.get("children", {}).items():
+                try:
+                    proc = psutil.Process(int(pid))
+                    if created is not None and proc.create_time() == created and "ffmpeg" in proc.name().lower():
+                        proc.terminate()
+                        orphans.append(proc)
+                except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+                    continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if orphans:
+            _, alive = psutil.wait_procs(orphans, timeout=TERMINATE_TIMEOUT)
+            for proc in alive:
+                try:
+                    proc.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            print(f"已清理上次残留的 ffmpeg 进程: {len(orphans)} 个")
+        return len(orphans)
+
+
+class AsyncRunner:
+    """
+    在后台线程上跑一个 asyncio 事件循环，统一调度所有 ffmpeg 子进程：
+    逐行读取 stdout/stderr，只保留有限的 stderr 尾部，支持并发上限和按任务取消；
+    同一个 job_id 可以对应多个进程（分段、智能渲染的多个步骤），取消时一起停止
+    """
+
+    def __init__(self, max_concurrency=None, tail_lines=STDERR_TAIL_LINES, registry=None, stall_timeout=STALL_TIMEOUT):
+        self.tail_lines = tail_lines
+        self.stall_timeout = stall_timeout
+        self.registry = registry or ProcessRegistry()
+        self._max_concurrency = max_concurrency
+        self._sem = None
+        self._futures = {}
+        # 事件循环里的任务（只在循环线程中读写）和已经发出停止的序号，避免重复取消打断 q → terminate → kill
+        self._tasks = {}
+        self._stopping = set()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="nelson-ffmpeg-loop", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def set_concurrency(self, max_concurrency):
+        """调整同时运行的进程上限，None 表示不限制（由调用方自行控制）"""
+        def _apply():
+            self._max_concurrency = max_concurrency
+            self._sem = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.loop.call_soon_threadsafe(_apply)
+
+    def set_stall_timeout(self, seconds):
+        """之后启动的进程使用的卡死判定时长（秒），0 或 None 表示不检测"""
+        self.stall_timeout = seconds
+
+    async def _read_progress(self, stream, duration, on_progress, watch):
+        fields = {}
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            key, sep, value = line.decode("utf-8", errors="ignore").strip().partition("=")
+            if not sep:
+                continue
+            fields[key] = value
+            # 每个进度块以 progress=continue/end 结尾
+            if key == "progress":
+                snap = parse_progress_block(fields, duration)
+                # 只有输出时间前进才算有进展，卡住的解码器仍会周期性输出相同的进度块
+                if snap["out_time"] > watch["out_time"]:
+                    watch["out_time"], watch["at"] = snap["out_time"], time.monotonic()
+                if on_progress:
+                    on_progress(snap)
+                fields = {}
+
+    async def _watchdog(self, proc, watch, timeout):
+        """输出进度 timeout 秒没有前进时标记为卡死并停止进程"""
+        while proc.returncode is None:
+            await asyncio.sleep(min(1.0, timeout))
+            if proc.returncode is None and time.monotonic() - watch["at"] > timeout:
+                watch["stalled"] = True
+                await self._stop(proc)
+                return
+
+    async def _read_tail(self, stream, tail):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            tail.append(line.decode("utf-8", errors="ignore")[:MAX_LINE_CHARS])
+
+    async def _stop(self, proc):
+        """先发 q 让 ffmpeg 正常收尾退出，超时再 terminate，仍不退出才 kill，避免留下孤儿 ffmpeg"""
+        try:
+            proc.stdin.write(b"q")
+            await asyncio.wait_for(proc.stdin.drain(), 1)
+            await asyncio.wait_for(proc.wait(), QUIT_TIMEOUT)
+            return
+        except (OSError, asyncio.TimeoutError):
+            pass
+        if proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), TERMINATE_TIMEOUT)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+
+    async def _run(self, cmd, duration, on_progress, stall_timeout):
+        if self._sem is None and self._max_concurrency:
+            self._sem = asyncio.Semaphore(self._max_concurrency)
+        sem = self._sem
+        if sem is not None:
+            await sem.acquire()
+        try:
+            # stdin 接管道：取消时写入 q，ffmpeg 会像在终端里按 q 一样停止
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            self.registry.add(proc.pid)
+            tail = collections.deque(maxlen=self.tail_lines)
+            watch = {"out_time": -1.0, "at": time.monotonic()}
+            watchdog = asyncio.ensure_future(self._watchdog(proc, watch, stall_timeout)) if stall_timeout else None
+            try:
+                await asyncio.gather(self._read_progress(proc.stdout, duration, on_progress, watch),
+                                     self._read_tail(proc.stderr, tail))
+                returncode = await proc.wait()
+            except asyncio.CancelledError:
+                if proc.returncode is None:
+                    await self._stop(proc)
+                raise
+            finally:
+                # 进程已经退出，看门狗即使正在停止流程中也可以直接取消
+                if watchdog:
+                    watchdog.cancel()
+                self.registry.remove(proc.pid)
+            if watch.get("stalled"):
+                tail.append(f"[watchdog] 输出进度 {stall_timeout:g}s 未推进，已停止进程\n")
+                returncode = RC_STALLED
+            return subprocess.CompletedProcess(cmd, returncode, None, "".join(tail))
+        finally:
+            if sem is not None:
+                sem.release()
+
+    def submit(self, cmd, duration=None, on_progress=None, job_id=None, stall_timeout=None):
+        """
+        提交一个 ffmpeg 命令，返回 (job_id, concurrent.futures.Future)
+        不指定 job_id 时分配 ("auto", 序号)，和调用方的任务序号互不冲突；
+        同一 job_id 的所有进程可以通过 cancel(job_id) 一起取消。stall_timeout 不指定时使用运行器的默认值
+        取消后 Future 要等进程真正退出（停止流程走完）才结束
+        """
+        if stall_timeout is None:
+            stall_timeout = self.stall_timeout
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+        fut = concurrent.futures.Future()
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            key = job_id if job_id is not None else ("auto", seq)
+            self._futures[seq] = fut
+            self._jobs.setdefault(key, set()).add(seq)
+            # 在锁内排入事件循环，保证任务先于针对它的取消请求创建
+            self.loop.call_soon_threadsafe(self._start, seq, fut, self._run(cmd, duration, on_progress, stall_timeout))
+        fut.add_done_callback(lambda _f: self._forget(seq, key))
+        return key, fut
+
+    def _start(self, seq, fut, coro):
+        task = self.loop.create_task(coro)
+        self._tasks[seq] = task
+
+        def _settle(t):
+            self._tasks.pop(seq, None)
+            self._stopping.discard(seq)
+            if t.cancelled():
+                fut.cancel()
+            elif t.exception() is not None:
+                fut.set_exception(t.exception())
+            else:
+                fut.set_result(t.result())
+        task.add_done_callback(_settle)
+
+    def _cancel_seq(self, seq):
+        task = self._tasks.get(seq)
+        if task is not None and seq not in self._stopping:
+            self._stopping.add(seq)
+            task.cancel()
+
+    def _forget(self, seq, key):
+        with self._lock:
+            self._futures.pop(seq, None)
+            seqs = self._jobs.get(key, set())
+            seqs.discard(seq)
+            if not seqs:
+                self._jobs.pop(key, None)
+
+    def run(self, cmd, duration=None, on_progress=None, job_id=None, stall_timeout=None):
+        """阻塞等待命令结束；被取消时返回 returncode=RC_CANCELLED，卡死被停止时返回 RC_STALLED"""
+        _, fut = self.submit(cmd, duration, on_progress, job_id, stall_timeout)
+        try:
+            return fut.result()
+        except concurrent.futures.CancelledError:
+            return subprocess.CompletedProcess(cmd, RC_CANCELLED, None, "任务已取消")
+
+    def cancel(self, job_id):
+        """取消 job_id 下正在运行或排队的全部进程，没有时返回 False"""
+        with self._lock:
+            seqs = list(self._jobs.get(job_id, ()))
+        for seq in seqs:
+            self.loop.call_soon_threadsafe(self._cancel_seq, seq)
+        return bool(seqs)
+
+    def cancel_all(self):
+        with self._lock:
+            seqs = list(self._futures)
+        for seq in seqs:
+            self.loop.call_soon_threadsafe(self._cancel_seq, seq)
+
+    def idle(self):
+        """没有仍在运行的已登记进程（取消后的进程都已退出）"""
+        return self.registry.wait_empty(0)
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """程序退出前调用：取消全部进程并等待它们按 q → terminate → kill 的顺序退出，超时返回 False"""
+        self.cancel_all()
+        return self.registry.wait_empty(timeout)
+
+
+_default_runner = None
+_default_lock = threading.Lock()
+
+
+def get_runner():
+    """进程内共享的运行器，首次使用时启动事件循环线程"""
+    global _default_runner
+    with _default_lock:
+        if _default_runner is None:
+            _default_runner = AsyncRunner()
+            # 首次启动运行器时清理上次崩溃留下的 ffmpeg
+            _default_runner.registry.cleanup_orphans()
+        return _default_runner
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None, job_id=None, stall_timeout=None):
+    """
+    运行 ffmpeg 并逐块回调进度 on_progress(snapshot)
+    返回 subprocess.CompletedProcess（stderr 只含尾部），与 subprocess.run 的用法保持一致
+    """
+    return get_runner().run(cmd, duration, on_progress, job_id, stall_timeout)
+
+
+class BatchProgress:
+    """按任务时长加权的整批进度，线程安全，并对界面回调做节流"""
+
+    def __init__(self, weights, on_update, throttle=UI_THROTTLE):
+        self.weights = [max(0.1, w or 1.0) for w in weights]
+        self.total_weight = sum(self.weights) or 1.0
+        self.fractions = [0.0] * len(self.weights)
+        self.on_update = on_update
+        self.throttle = throttle
+        self.started = time.monotonic()
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def percent(self):
+        done = sum(f * w for f, w in zip(self.fractions, self.weights))
+        return 100.0 * done / self.total_weight
+
+    def eta(self):
+        """按已完成比例线性外推剩余秒数，尚无进度时返回 None"""
+        p = self.percent() / 100
+        if p <= 0:
+            return None
+        return (time.monotonic() - self.started) * (1 - p) / p
+
+    def update(self, index, snap, force=False):
+        with self._lock:
+            self.fractions[index] = max(self.fractions[index], snap.get("fraction", 0.0))
+            now = time.monotonic()
+            if not force and now - self._last_emit < self.throttle:
+                return
+            self._last_emit = now
+            percent, eta = self.percent(), self.eta()
+        self.on_update(index, snap, percent, eta)
+
+    def finish(self, index):
+        self.update(index, {"fraction": 1.0, "done": True}, force=True)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
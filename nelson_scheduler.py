@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森并发任务调度器
+根据 CPU 核数和可用内存决定同时运行的 ffmpeg 任务数，并给每个任务分配线程预算；
+有 psutil 时按实时 CPU 利用率、可用内存和 ffmpeg 实际占用的内存动态放行或暂缓新任务。
+任务结果严格按提交顺序回调，保证报告日志和进度条顺序与串行版本一致
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+# 单个 1080x1920 xfade + 字幕任务的大致峰值内存（MB）
+JOB_MEMORY_MB = 1200
+# 单个 x264 进程超过 8 线程后收益很小，不如多开一路任务
+MAX_THREADS_PER_JOB = 8
+# 每路任务至少保留的线程数（滤镜 + 编码）
+MIN_THREADS_PER_JOB = 2
+# 消费级显卡 NVENC 同时会话数有限
+MAX_GPU_WORKERS = 3
+# 自适应准入：整机 CPU 利用率低于目标才多放行任务，放行后可用内存至少保留这么多（MB），避免换页
+TARGET_CPU_PERCENT = 85.0
+MEMORY_RESERVE_MB = 1024
+# 负载采样间隔（秒）；新任务放行后等 ffmpeg 跑起来再看 CPU
+SAMPLE_INTERVAL = 1.0
+ADMIT_SETTLE = 3.0
+
+
+def available_memory_mb():
+    """返回可用内存（MB），没有 psutil 时返回 None"""
+    if not HAS_PSUTIL:
+        return None
+    try:
+        return psutil.virtual_memory().available // (1024 * 1024)
+    except Exception:
+        return None
+
+
+def ffmpeg_rss_mb():
+    """本进程启动的 ffmpeg 子进程常驻内存合计（MB），没有 psutil 时返回 None"""
+    if not HAS_PSUTIL:
+        return None
+    total = 0
+    try:
+        for proc in psutil.Process().children(recursive=True):
+            try:
+                if "ffmpeg" in proc.name().lower():
+                    total += proc.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+    except Exception:
+        return None
+    return total // (1024 * 1024)
+
+
+def max_adaptive_workers(total_jobs, gpu=False, max_workers=None):
+    """
+    自适应准入的并发上限：GPU 受会话数限制，指定了最大路数时以它为准，否则按每路最少线程数计
+    total_jobs 为 None 时任务数未知（监控模式），不按任务数收紧
+    """
+    if gpu:
+        return plan_workers(total_jobs, gpu=True, max_workers=max_workers)[0]
+    cores = os.cpu_count() or 1
+    limit = max_workers or max(1, cores // MIN_THREADS_PER_JOB)
+    if total_jobs is not None:
+        limit = min(limit, total_jobs or 1)
+    return max(1, limit)
+
+
+def max_processes(workers, threads):
+    """整批同时运行的 ffmpeg 进程上限：每路任务最多把线程预算拆成 threads // MIN_THREADS_PER_JOB 个分段进程"""
+    return max(1, workers) * max(1, threads // MIN_THREADS_PER_JOB)
+
+
+def plan_workers(total_jobs, gpu=False, max_workers=None, job_memory_mb=JOB_MEMORY_MB):
+    """
+    计算并发路数和每路线程数，返回 (workers, threads_per_job)
+    total_jobs 为 None 时任务数未知（监控模式），只按核数、内存和 max_workers 规划
+    """
+    cores = os.cpu_count() or 1
+    workers = max(1, cores // (MIN_THREADS_PER_JOB * 2))
+
+    mem_mb = available_memory_mb()
+    if mem_mb is not None:
+        workers = min(workers, max(1, int(mem_mb // job_memory_mb)))
+    if gpu:
+        workers = min(workers, MAX_GPU_WORKERS)
+    if max_workers:
+        workers = min(workers, max_workers)
+    if total_jobs is not None:
+        workers = min(workers, total_jobs or 1)
+    workers = max(1, workers)
+
+    threads = max(1, min(MAX_THREADS_PER_JOB, cores // workers))
+    return workers, threads
+
+
+class AdmissionController:
+    """
+    新任务的准入控制：前 workers 路（plan_workers 的规划值）只检查内存，
+    超出部分还要求整机 CPU 利用率低于目标、且上一次放行后负载已经稳定，最多 max_workers 路；
+    内存按 ffmpeg 子进程实测的单路峰值估算，放行后可用内存仍需高于保留量，至少保证 1 路运行。
+    没有 psutil 时退化为固定 workers 路并发
+    threads 为每路任务的线程预算：分段编码的长任务可以借用空闲路的线程，借出的线程按路数计入占用
+    """
+
+    def __init__(self, workers, max_workers=None, threads=MIN_THREADS_PER_JOB, target_cpu=TARGET_CPU_PERCENT,
+                 reserve_mb=MEMORY_RESERVE_MB, job_memory_mb=JOB_MEMORY_MB, interval=SAMPLE_INTERVAL):
+        self.workers = max(1, int(workers))
+        self.max_workers = max(self.workers, int(max_workers or 0)) if HAS_PSUTIL else self.workers
+        self.threads = max(1, int(threads or 1))
+        self.borrowed = 0
+        self.target_cpu = target_cpu
+        self.reserve_mb = reserve_mb
+        self.job_memory_mb = job_memory_mb
+        self.interval = interval
+        self.active = 0
+        # 实测的单路 ffmpeg 内存峰值（MB），尚无样本时用 job_memory_mb 估算
+        self.job_peak_mb = None
+        self._last_admit = 0.0
+        self._cond = threading.Condition()
+        if HAS_PSUTIL:
+            # cpu_percent 统计的是两次调用之间的利用率，先取一次作为基准
+            psutil.cpu_percent(interval=None)
+
+    def _sample_job_memory(self):
+        rss = ffmpeg_rss_mb()
+        if rss and self.active:
+            self.job_peak_mb = max(self.job_peak_mb or 0, rss / self.active)
+        return self.job_peak_mb or self.job_memory_mb
+
+    def _busy(self):
+        """占用的路数：运行中的任务 + 被借出的线程折算的路数"""
+        return self.active + (self.borrowed + self.threads - 1) // self.threads
+
+    def _allowed(self):
+        if self.active < 1:
+            return True
+        if self._busy() >= self.max_workers:
+            return False
+        if not HAS_PSUTIL:
+            return True
+        mem_mb = available_memory_mb()
+        if mem_mb is not None and mem_mb - self._sample_job_memory() < self.reserve_mb:
+            return False
+        if self._busy() < self.workers:
+            return True
+        if time.monotonic() - self._last_admit < ADMIT_SETTLE:
+            return False
+        return psutil.cpu_percent(interval=None) < self.target_cpu
+
+    def acquire(self, stop=None):
+        """阻塞直到允许再启动一路任务；stop 事件被设置时返回 False"""
+        with self._cond:
+            while not self._allowed():
+                if stop is not None and stop.is_set():
+                    return False
+                self._cond.wait(self.interval)
+            self.active += 1
+            self._last_admit = time.monotonic()
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def borrow(self, want):
+        """
+        从规划路数里当前空闲的线程预算中借出至多 want 个线程，返回实际借到的数量；
+        批次收尾、空出的路没有新任务时，长任务的分段编码可以把这些核心用上。用完后调用 give_back
+        """
+        with self._cond:
+            free = (self.workers - self.active) * self.threads - self.borrowed
+            granted = max(0, min(int(want), free))
+            self.borrowed += granted
+            return granted
+
+    def give_back(self, threads):
+        with self._cond:
+            self.borrowed -= threads
+            self._cond.notify_all()
+
+
+class JobScheduler:
+    """
+    工作线程池，每个工作线程驱动一个 ffmpeg 任务；线程数取并发上限，
+    实际同时运行的任务数由 AdmissionController 按实时负载决定
+    """
+
+    def __init__(self, workers, max_workers=None, threads=MIN_THREADS_PER_JOB):
+        self.admission = AdmissionController(workers, max_workers, threads)
+        self.workers = self.admission.max_workers
+        self._stop = threading.Event()
+
+    def cancel(self):
+        """停止派发尚未开始的任务，已在运行的任务照常结束"""
+        self._stop.set()
+
+    @property
+    def cancelled(self):
+        return self._stop.is_set()
+
+    def _guarded(self, worker_fn, job):
+        if self._stop.is_set() or not self.admission.acquire(self._stop):
+            return None, RuntimeError("任务已取消")
+        try:
+            return worker_fn(job), None
+        except Exception as e:
+            return None, e
+        finally:
+            self.admission.release()
+
+    def run(self, jobs, worker_fn, on_result=None):
+        """
+        并发执行 worker_fn(job)，按 jobs 顺序调用 on_result(index, job, result, error)
+        返回按顺序排列的 (result, error) 列表
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nelson-job") as pool:
+            futures = [pool.submit(self._guarded, worker_fn, job) for job in jobs]
+            # 按提交顺序等待：后面的任务先完成时结果会暂存，直到前面的任务交付
+            for index, (job, fut) in enumerate(zip(jobs, futures)):
+                result, error = fut.result()
+                results.append((result, error))
+                if on_result:
+                    on_result(index, job, result, error)
+        return results
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森智能渲染
+成片 = A(1.2 倍速) + 0.5s 转场 + B。只有 A 段、转场窗口和标题覆盖区间需要重新编码，
+转场之后的 B 尾段直接从关键帧对齐的 B 中间件流拷贝，再用 concat 分离器拼接并混音
+"""
+import math
+import os
+import shutil
+import tempfile
+
+from nelson_graph import FilterGraph, TitleLayer, add_audio_mix, smart_head_graph
+from nelson_inputs import A_SEEK, InputSpan, a_video_end
+from nelson_runner import run_ffmpeg
+
+FPS = 30
+# 30fps 下每 0.5s 一个关键帧，尾段可以在任意 0.5s 边界直接切开
+SEGMENT_GOP = 15
+# 头段和中间件必须使用完全相同的编码参数，拼接后的 SPS/PPS 才一致
+SMART_ENCODE = ['-c:v', 'libx264', '-preset', 'fast', '-crf', '20', '-pix_fmt', 'yuv420p',
+                '-g', str(SEGMENT_GOP), '-keyint_min', str(SEGMENT_GOP), '-sc_threshold', '0']
+# 尾段太短时拆分得不偿失
+MIN_TAIL_SECONDS = 1.0
+
+
+def plan_smart_cut(off, total, overlay_end=0.0, xfade_dur=0.5):
+    """
+    计算重编码头段的终点，返回 (head_end, b_cut)；不值得拆分时返回 None
+    head_end 为成片时间，b_cut 为 B 片段时间轴上对应的关键帧位置
+    """
+    step = SEGMENT_GOP / FPS
+    need = max(xfade_dur, overlay_end - off)
+    b_cut = math.ceil(need / step - 1e-6) * step
+    head_end = off + b_cut
+    if total - head_end < MIN_TAIL_SECONDS:
+        return None
+    return head_end, b_cut
+
+
+def smart_render(ffmpeg_path, inputs, out_p, eff, overlay, overlay_end, vols, threads=0,
+                 on_progress=None, sources=None, job_id=None):
+    """
+    分段渲染单个任务。inputs 为 nelson_inputs.plan_inputs 的结果，其中 B 必须是用 SMART_ENCODE 生成的中间件
+    overlay 为标题：预渲染的 TitleLayer 图层或叠加在转场之后的 drawtext 节点，sources 为滤镜图优化用的源画面信息
+    on_progress 接收成片时间轴上的进度快照（头段编码与最终拼接两步），job_id 用于按任务取消全部步骤
+    返回最后一次 ffmpeg 调用的结果；不适用智能渲染时返回 None，由调用方走完整渲染
+    """
+    # 转场偏移对齐到帧网格，拼接处时间戳才能连续
+    off = round(inputs.off * FPS) / FPS
+    total = inputs.total
+    mezz_b = inputs.b.path
+    cut = plan_smart_cut(off, total, overlay_end)
+    if cut is None:
+        return None
+    head_end, b_cut = cut
+    threads = str(threads)
+    work_dir = tempfile.mkdtemp(prefix="nelson_smart_")
+    try:
+        head_p = os.path.join(work_dir, "head.ts")
+        tail_p = os.path.join(work_dir, "tail.ts")
+        list_p = os.path.join(work_dir, "concat.txt")
+
+        # 1. 头段：A + 转场 + 标题，只编码到 B 的第一个可拷贝关键帧
+        #    A 只读到转场结束，B 只读到切点，其余部分不解码
+        title = overlay if isinstance(overlay, TitleLayer) else None
+        overlays = [overlay] if overlay and not title else []
+        head_graph = smart_head_graph(eff, f"{off:.3f}", overlays, sources=sources, title=title)
+        head_a = InputSpan(inputs.a.path, A_SEEK, a_video_end(off) - A_SEEK)
+        head_b = InputSpan(mezz_b, 0.0, b_cut)
+        cmd = [ffmpeg_path, '-y', '-hwaccel', 'auto', *head_a.args(), *head_b.args(),
+               *(title.input().args() if title else []),
+               '-filter_complex', str(head_graph), '-filter_complex_threads', threads,
+               '-map', '[v_out]', '-an', *SMART_ENCODE, '-threads', threads,
+               '-t', f"{head_end:.3f}", head_p]
+        result = run_ffmpeg(cmd, total, on_progress, job_id=job_id)
+        if result.returncode != 0:
+            return result
+
+        # 2. 尾段：从 B 中间件的关键帧处直接流拷贝
+        cmd = [ffmpeg_path, '-y', '-ss', f"{b_cut:.3f}", '-i', mezz_b, '-t', f"{total - head_end:.3f}",
+               '-map', '0:v', '-c', 'copy', tail_p]
+        result = run_ffmpeg(cmd, job_id=job_id)
+        if result.returncode != 0:
+            return result
+
+        # 3. concat 拼接视频，同时混合原音/解说/BGM
+        return mux_segments(ffmpeg_path, [head_p, tail_p], list_p, inputs, out_p, vols, on_progress, job_id)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def mux_segments(ffmpeg_path, segments, list_p, inputs, out_p, vols, on_progress=None, job_id=None):
+    """
+    用 concat 分离器把编码好的视频段无损拼接，同时混合原音/解说/BGM（音频编码开销很小）
+    各段必须使用完全相同的编码参数；list_p 为写入拼接清单的路径
+    """
+    with open(list_p, "w", encoding="utf-8") as f:
+        for seg in segments:
+            f.write("file '" + seg.replace("\\", "/") + "'\n")
+    audio_graph = add_audio_mix(FilterGraph(), "1:a", "2:a", "3:a", vols).optimize()
+    cmd = [ffmpeg_path, '-y', '-f', 'concat', '-safe', '0', '-i', list_p,
+           *inputs.a.args(), *inputs.v.args(), *inputs.m.args(),
+           '-filter_complex', str(audio_graph), '-map', '0:v', '-map', '[a_out]',
+           '-c:v', 'copy', '-t', f"{inputs.total:.2f}", out_p]
+    return run_ffmpeg(cmd, inputs.total, on_progress, job_id=job_id)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森字幕预编译
+SRT 按样式一次性转换成带 [V4+ Styles] 的 ASS 文件，按 字幕内容 + 样式 哈希缓存；
+渲染时 ass 滤镜直接加载编译好的文件，不再每个任务都让 libass 重新解析 SRT、套用 force_style。
+每个任务只拿到与成片时间段重叠的条目，长解说字幕不会让每路渲染都索引全部条目
+"""
+import hashlib
+import math
+import os
+import re
+
+from nelson_cache import DiskCache, content_key, source_key
+from nelson_graph import Filter, escape_path, quote, subtitle_style, subtitles_filter
+from nelson_probe import DEFAULT_CACHE_DIR
+
+# 生成格式变化时递增，旧的编译结果自然失效
+ASS_VERSION = 1
+# 字幕窗口的终点向上取整到这个粒度（秒），时长相近的任务共用同一份切片
+WINDOW_STEP = 5
+_SRT_TIME_RE = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)")
+_TAG_RE = re.compile(r"<\s*(/?)\s*([bius])\s*>", re.IGNORECASE)
+_FONT_COLOR_RE = re.compile(r"<\s*font[^>]*color\s*=\s*[\"']?#?([0-9a-fA-F]{6})[\"']?[^>]*>", re.IGNORECASE)
+_OTHER_TAG_RE = re.compile(r"<[^>]*>")
+
+# 与 ffmpeg 把 SRT 交给 libass 时生成的默认头一致（PlayRes 384x288），
+# force_style 里的字号、描边、边距都是这个坐标系下的值，换成 ASS 后画面完全相同
+_ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 384
+PlayResY: 288
+ScaledBorderAndShadow: yes
+YCbCr Matrix: None
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, \
+Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, \
+MarginV, Encoding
+Style: Default,Arial,{size},{color},{color},{border_color},&H00000000,0,0,0,0,100,100,0,0,1,{border},0,2,10,10,\
+{margin},0
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def decode_text(raw):
+    """字幕文本：优先 UTF-8（带或不带 BOM），失败时按国标编码读取"""
+    try:
+        return raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return raw.decode("gb18030", errors="replace")
+
+
+def read_text(path):
+    with open(path, "rb") as f:
+        return decode_text(f.read())
+
+
+def parse_srt(text):
+    """解析 SRT 文本，返回按开始时间排序的 [(开始秒, 结束秒, 文本), ...]"""
+    cues = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").replace("\r", "\n")):
+        lines = block.strip("\n").split("\n")
+        for i, line in enumerate(lines):
+            m = _SRT_TIME_RE.search(line)
+            if m:
+                v = [int(x) for x in m.groups()]
+                start = v[0] * 3600 + v[1] * 60 + v[2] + v[3] / 1000
+                end = v[4] * 3600 + v[5] * 60 + v[6] + v[7] / 1000
+                body = "\n".join(lines[i + 1:]).strip()
+                if body and end > start:
+                    cues.append((start, end, body))
+                break
+    cues.sort(key=lambda c: c[0])
+    return cues
+
+
+def ass_time(t):
+    """秒 → H:MM:SS.cc"""
+    cs = int(round(max(0.0, t) * 100))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+
+def _ass_style_color(hex_color):
+    """#RRGGBB → 样式行里的 &HAABBGGRR（不透明）"""
+    h = hex_color.lstrip('#')
+    return f"&H00{h[4:6]}{h[2:4]}{h[0:2]}".upper()
+
+
+def ass_text(text):
+    """SRT 文本 → ASS 对白：常用 HTML 标签转成覆盖标签，换行转 \\N"""
+    text = text.replace("{", "\\{").replace("}", "\\}")
+    text = _FONT_COLOR_RE.sub(lambda m: "{\\c&H" + m.group(1)[4:6] + m.group(1)[2:4] + m.group(1)[0:2] + "&}",
+                              text)
+    text = re.sub(r"<\s*/\s*font\s*>", "{\\\\c}", text, flags=re.IGNORECASE)
+    text = _TAG_RE.sub(lambda m: "{\\" + m.group(2).lower() + ("0" if m.group(1) else "1") + "}", text)
+    text = _OTHER_TAG_RE.sub("", text)
+    return text.replace("\n", "\\N")
+
+
+def build_ass(cues, size, color, border_color, border, margin):
+    """按样式生成完整的 ASS 文本"""
+    lines = [_ASS_HEADER.format(size=int(size), color=_ass_style_color(color),
+                                border_color=_ass_style_color(border_color), border=int(border),
+                                margin=int(margin))]
+    for start, end, body in cues:
+        lines.append(f"Dialogue: 0,{ass_time(start)},{ass_time(end)},Default,,0,0,0,,{ass_text(body)}\n")
+    return "".join(lines)
+
+
+def window_cues(cues, start, end):
+    """与 [start, end) 重叠的条目；时间轴不变，成片和草稿都按成片时间叠加字幕"""
+    return [c for c in cues if c[1] > start and c[0] < end]
+
+
+def ass_filter(path):
+    """加载编译好的 ASS；ass 滤镜只接受 ASS，不经过格式转换"""
+    return Filter("ass", quote(escape_path(path)))
+
+
+class SubtitleCache(DiskCache):
+    """预编译 ASS 缓存：同一份字幕 + 同一组样式 + 同一时间窗只转换一次，之后所有任务共用"""
+
+    def __init__(self, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "subs"), max_bytes=128 * 1024 ** 2):
+        super().__init__(cache_dir, max_bytes)
+        # 源文件身份 → (内容哈希, 字幕条目)，同一进程里同一文件只读取解析一次
+        self._parsed = {}
+
+    def _load(self, srt_path):
+        sk = source_key(srt_path)
+        if sk not in self._parsed:
+            with open(srt_path, "rb") as f:
+                raw = f.read()
+            self._parsed[sk] = (hashlib.sha1(raw).hexdigest(), parse_srt(decode_text(raw)))
+        return self._parsed[sk]
+
+    def get(self, srt, window=None):
+        """
+        srt 为任务里的字幕设置 {"path", "size", "color", "border_color", "border", "margin"}
+        window=(开始, 结束) 时只保留与该时间段重叠的条目
+        返回编译好的 ASS 路径；读取失败或整个文件没有可识别的条目时返回 None，窗口内没有条目时返回 ""
+        """
+        style = (int(srt["size"]), srt["color"], srt["border_color"], int(srt["border"]), int(srt["margin"]))
+        try:
+            digest, cues = self._load(srt["path"])
+        except OSError as e:
+            print(f"字幕读取失败: {e}")
+            return None
+        if not cues:
+            return None
+        if window:
+            window = (math.floor(window[0]), math.ceil(window[1] / WINDOW_STEP) * WINDOW_STEP)
+            cues = window_cues(cues, *window)
+            if not cues:
+                return ""
+        # 时间窗放在分组里：不同窗口的切片同时被不同任务使用，不能互相顶替
+        group = content_key(ASS_VERSION, digest, *style, window)
+        key = content_key(ASS_VERSION)
+        hit = self.lookup(group, key, "ass")
+        if hit:
+            return hit
+        with self.key_lock(group):
+            hit = self.lookup(group, key, "ass")
+            if hit:
+                return hit
+            tmp_path = self.path_for(group, key, "ass") + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(build_ass(cues, *style))
+            return self.commit(tmp_path, group, key, "ass")
+
+    def filter(self, srt, window=None):
+        """
+        任务的字幕滤镜：优先预编译 ASS，转换失败时退回 SRT + force_style；
+        窗口内没有字幕时返回 None，不加字幕滤镜
+        """
+        path = self.get(srt, window)
+        if path:
+            return ass_filter(path)
+        if path == "":
+            return None
+        return subtitles_filter(escape_path(srt["path"]),
+                                subtitle_style(srt["size"], srt["color"], srt["border_color"], srt["border"],
+                                               srt["margin"]))
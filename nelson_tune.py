@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森编码参数自动调优
+用真实素材按成片滤镜图（1.2 倍速 A + 转场 + 标题）渲染一段样片，
+在 x264/x265 预设 × CRF 矩阵上测量编码帧率、输出体积和相对无损参考的 SSIM/PSNR，
+把满足画质门槛且最快的组合保存为本机配置，CPU 跑批时自动使用
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from nelson_graph import Filter, FilterGraph, a_video_filters, normalize, title_filter, xfade
+from nelson_inputs import A_SEEK, A_SPEED, InputSpan
+from nelson_probe import DEFAULT_CACHE_DIR, run_ffprobe
+from nelson_runner import run_ffmpeg
+from nelson_scheduler import plan_workers
+
+PROFILE_PATH = os.path.join(DEFAULT_CACHE_DIR, "encoder_profile.json")
+# 样片长度（秒），需要覆盖转场和标题
+SAMPLE_SECONDS = 6.0
+# 相对无损参考的最低 SSIM，低于此值的组合不参与择优
+MIN_SSIM = 0.975
+# (编码器, 预设, CRF) 候选矩阵
+ENCODER_MATRIX = [
+    ("libx264", preset, crf)
+    for preset in ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium")
+    for crf in (18, 20, 23)
+] + [
+    ("libx265", preset, crf)
+    for preset in ("ultrafast", "veryfast", "fast")
+    for crf in (22, 26)
+]
+
+_SSIM_RE = re.compile(r"SSIM .*All:([\d.]+)")
+_PSNR_RE = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+
+def machine_id():
+    """配置按机器区分，拷贝到别的电脑上不会误用"""
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count()}"
+
+
+def sample_graph(off, seconds):
+    """与成片一致的视频滤镜链：A 变速标准化 + B 标准化 + 转场 + 标题"""
+    graph = FilterGraph()
+    graph.chain("0:v", a_video_filters(), "v0")
+    graph.chain("1:v", normalize(), "v1")
+    graph.chain(["v0", "v1"], [xfade("fade", f"{off:.2f}"), Filter("format", "yuv420p"),
+                               title_filter("Arial", "NelsonTest", "#FFA500", 80, 3, "#000000", 0, f"{seconds:g}")],
+                "v_out")
+    return str(graph.optimize())
+
+
+def encode_args(codec, preset, crf):
+    args = ['-c:v', codec, '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p']
+    if codec == "libx265":
+        # x265 默认每帧都打印统计，关掉免得刷屏
+        args += ['-x265-params', 'log-level=error']
+    return args
+
+
+def measure_quality(ffmpeg_path, encoded, reference):
+    """返回 (ssim, psnr)，解析失败的项为 None"""
+    graph = "[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]ssim;[a1][b1]psnr"
+    result = run_ffmpeg([ffmpeg_path, '-i', encoded, '-i', reference, '-lavfi', graph, '-f', 'null', '-'])
+    ssim = _SSIM_RE.search(result.stderr or "")
+    psnr = _PSNR_RE.search(result.stderr or "")
+    return (float(ssim.group(1)) if ssim else None,
+            float(psnr.group(1)) if psnr else None)
+
+
+def pick_best(results, min_ssim=MIN_SSIM):
+    """满足画质门槛的组合里取最快的；都不达标时取画质最高的"""
+    valid = [r for r in results if r.get("fps")]
+    passed = [r for r in valid if (r.get("ssim") or 0) >= min_ssim]
+    if passed:
+        return max(passed, key=lambda r: (r["fps"], -r["size"]))
+    return max(valid, key=lambda r: r.get("ssim") or 0, default=None)
+
+
+def autotune(ffmpeg_path, ffprobe_path, in_a, in_b, seconds=SAMPLE_SECONDS, matrix=None,
+             min_ssim=MIN_SSIM, threads=None, on_result=None):
+    """
+    跑完整个矩阵，返回配置字典（含全部测量结果）
+    threads 默认取跑批时每路任务分到的线程数，测出的帧率才能代表实际并发下的单路速度
+    on_result(done, total, result) 每测完一个组合回调一次
+    """
+    matrix = matrix or ENCODER_MATRIX
+    workers, job_threads = plan_workers(total_jobs=None)
+    threads = str(threads or job_threads)
+    d_a = run_ffprobe(ffprobe_path, in_a)["duration"] / A_SPEED
+    off = max(0.1, min(seconds / 2, d_a - 1.5))
+    frames = seconds * 30
+
+    def render(out_p, args):
+        cmd = [ffmpeg_path, '-y', *InputSpan(in_a, A_SEEK).args(), '-i', in_b,
+               '-filter_complex', sample_graph(off, seconds), '-filter_complex_threads', threads,
+               '-map', '[v_out]', '-an', *args, '-threads', threads, '-t', f"{seconds:.2f}", out_p]
+        started = time.monotonic()
+        result = run_ffmpeg(cmd)
+        return result, time.monotonic() - started
+
+    work_dir = tempfile.mkdtemp(prefix="nelson_tune_")
+    try:
+        # 无损参考：同一滤镜图，qp 0 编码
+        reference = os.path.join(work_dir, "reference.mkv")
+        result, _ = render(reference, ['-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0'])
+        if result.returncode != 0:
+            raise RuntimeError(f"参考样片渲染失败: {result.stderr}")
+
+        results = []
+        for n, (codec, preset, crf) in enumerate(matrix, 1):
+            out_p = os.path.join(work_dir, f"{codec}_{preset}_{crf}.mp4")
+            item = {"codec": codec, "preset": preset, "crf": crf}
+            result, elapsed = render(out_p, encode_args(codec, preset, crf))
+            if result.returncode == 0:
+                item["fps"] = round(frames / elapsed, 2)
+                item["size"] = os.path.getsize(out_p)
+                item["ssim"], item["psnr"] = measure_quality(ffmpeg_path, out_p, reference)
+                os.remove(out_p)
+            else:
+                # 例如 ffmpeg 没有编译 libx265
+                item["error"] = (result.stderr or "").strip().splitlines()[-1:]
+            results.append(item)
+            if on_result:
+                on_result(n, len(matrix), item)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    best = pick_best(results, min_ssim)
+    if best is None:
+        raise RuntimeError("没有可用的编码组合")
+    return {
+        "machine": machine_id(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "codec": best["codec"], "preset": best["preset"], "crf": best["crf"],
+        "min_ssim": min_ssim, "threads": int(threads), "workers": workers,
+        "results": results,
+    }
+
+
+def save_profile(profile, path=PROFILE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_profile(path=PROFILE_PATH):
+    """读取本机的调优结果；文件不存在、损坏或来自其他机器时返回 None"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get("machine") != machine_id():
+        return None
+    if not all(k in profile for k in ("codec", "preset", "crf")):
+        return None
+    return profile
+
+
+def main(argv=None):
+    from nelson_engine import MEDIA_EXTS, find_tool, scan_media
+
+    parser = argparse.ArgumentParser(description="奈尔森一键剪辑 - 编码参数自动调优")
+    parser.add_argument("--a", required=True, help="主视频 A 目录或文件")
+    parser.add_argument("--b", required=True, help="拼接视频 B 目录或文件")
+    parser.add_argument("--seconds", type=float, default=SAMPLE_SECONDS, help="样片长度（秒）")
+    parser.add_argument("--min-ssim", type=float, default=MIN_SSIM, help="最低 SSIM 画质门槛")
+    parser.add_argument("--threads", type=int, help="单路编码线程数，默认与跑批一致")
+    parser.add_argument("--x264-only", action="store_true", help="只测试 libx264")
+    parser.add_argument("--dry-run", action="store_true", help="只打印结果，不保存配置")
+    parser.add_argument("--ffmpeg", help="ffmpeg 可执行文件路径")
+    parser.add_argument("--ffprobe", help="ffprobe 可执行文件路径")
+    args = parser.parse_args(argv)
+
+    def first_media(p):
+        if os.path.isdir(p):
+            files = [f for f in scan_media(p) if f.lower().endswith(MEDIA_EXTS[:2])]
+            if not files:
+                parser.error(f"目录中没有视频: {p}")
+            return os.path.join(p, files[0])
+        return p
+
+    matrix = [m for m in ENCODER_MATRIX if m[0] == "libx264"] if args.x264_only else ENCODER_MATRIX
+
+    def on_result(done, total, r):
+        if "fps" in r:
+            ssim = f"{r['ssim']:.4f}" if r["ssim"] is not None else "N/A"
+            print(f"[{done:2d}/{total}] {r['codec']:8s} {r['preset']:10s} crf {r['crf']:2d} | "
+                  f"{r['fps']:7.2f} fps | {r['size'] / 1024:8.0f} KB | SSIM {ssim} | PSNR {r['psnr']}")
+        else:
+            print(f"[{done:2d}/{total}] {r['codec']:8s} {r['preset']:10s} crf {r['crf']:2d} | 失败 {r['error']}")
+
+    try:
+        profile = autotune(args.ffmpeg or find_tool('ffmpeg'), args.ffprobe or find_tool('ffprobe'),
+                           first_media(args.a), first_media(args.b), seconds=args.seconds, matrix=matrix,
+                           min_ssim=args.min_ssim, threads=args.threads, on_result=on_result)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"\n推荐: {profile['codec']} -preset {profile['preset']} -crf {profile['crf']}")
+    if not args.dry_run:
+        save_profile(profile)
+        print(f"已保存到 {PROFILE_PATH}，CPU 跑批将自动使用")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+奈尔森文件夹监控
+监控主视频 A 目录，新文件停止增长后立即回调，供引擎持续投递渲染任务。
+装了 watchdog 时用系统文件事件（inotify / ReadDirectoryChangesW）唤醒，否则退回定时轮询
+"""
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+# 文件大小和修改时间保持不变多少秒才算拷贝完成
+SETTLE_SECONDS = 2.0
+# 有待确认文件时的检查间隔（秒）
+POLL_INTERVAL = 1.0
+# 有文件事件时，空闲状态下的兜底全量扫描间隔（秒）
+IDLE_RESCAN = 30.0
+
+
+def _is_readable(path):
+    """Windows 上仍在拷贝的文件通常被独占锁定，打不开就继续等"""
+    try:
+        with open(path, "rb"):
+            return True
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    """后台线程监控目录，文件稳定后调用 on_ready(path)，每个文件只回调一次"""
+
+    def __init__(self, folder, on_ready, exts, settle=SETTLE_SECONDS, interval=POLL_INTERVAL,
+                 include_existing=False):
+        self.folder = folder
+        self.on_ready = on_ready
+        self.exts = tuple(exts)
+        self.settle = settle
+        self.interval = interval
+        self._seen = set() if include_existing else set(self._list())
+        self._pending = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def _list(self):
+        try:
+            return [os.path.join(self.folder, f) for f in os.listdir(self.folder) if f.lower().endswith(self.exts)]
+        except OSError:
+            return []
+
+    def start(self):
+        if HAS_WATCHDOG:
+            watcher = self
+
+            class _Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    watcher._wake.set()
+
+            self._observer = Observer()
+            self._observer.schedule(_Handler(), self.folder, recursive=False)
+            self._observer.start()
+        self._thread = threading.Thread(target=self._loop, name="nelson-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._scan()
+            # 有待确认的文件时按间隔复查；否则有文件事件就等事件，没有就轮询
+            timeout = self.interval if (self._pending or not HAS_WATCHDOG) else IDLE_RESCAN
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _scan(self):
+        now = time.monotonic()
+        for path in self._list():
+            if path in self._seen:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sig = (st.st_size, st.st_mtime)
+            prev = self._pending.get(path)
+            if prev is None or prev[0] != sig:
+                self._pending[path] = (sig, now)
+            elif st.st_size > 0 and now - prev[1] >= self.settle and _is_readable(path):
+                del self._pending[path]
+                self._seen.add(path)
+                try:
+                    self.on_ready(path)
+                except Exception as e:
+                    print(f"监控回调异常: {path} - {str(e)}")
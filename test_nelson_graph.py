@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+滤镜图构建器与完整渲染命令的单元测试
+只比较生成的字符串和参数列表，不需要 ffmpeg
+"""
+import re
+from dataclasses import replace
+
+from nelson_engine import build_render_cmd
+from nelson_graph import (FilterGraph, Filter, TitleLayer, a_video_filters, drop_identity, hoist_timing,
+                          merge_setpts, normalize, setpts, subtitles_filter)
+from nelson_inputs import InputSpan, plan_inputs
+
+# 1080x1920 / 30fps 的 A 变速 1.2 倍后是 36fps
+PORTRAIT_30 = {"width": 1080, "height": 1920, "fps": 30}
+PORTRAIT_20 = {"width": 1080, "height": 1920, "fps": 20}
+LANDSCAPE_30 = {"width": 1920, "height": 1080, "fps": 30}
+
+
+def names(filters):
+    return [f.name for f in filters]
+
+
+def make_job():
+    settings = {"title_text": "Hi", "title_size": 80, "title_border": 3, "vol_a": 50, "vol_v": 100, "vol_m": 30,
+                "v_codec": "libx264", "v_preset": "fast", "crf": 20, "threads": 4}
+    return {"settings": settings, "font_name": "Arial", "title_c": "#FFA500", "title_b_c": "#000000",
+            "t_s": 2, "t_e": 8, "eff": "fade"}
+
+
+def make_inputs():
+    return plan_inputs("a.mp4", "b.mp4", "v.mp3", "m.mp3", 12.0, 10.0)
+
+
+def filter_complex(cmd):
+    return cmd[cmd.index('-filter_complex') + 1]
+
+
+def mix_gains(graph, active):
+    """
+    按 amix 的归一化规则算各路输入在成片里的增益：音量 × 权重 / 仍在播放的输入的权重和
+    active 为仍在播放的源输入（如 "2:a"），返回 {源输入: 增益}
+    """
+    chains = [re.fullmatch(r"((?:\[[^]]+\])+)(.*)\[([^]]+)\]", c).groups() for c in graph.split(";")]
+    ins, mix, _ = next(c for c in chains if c[1].startswith("amix"))
+    labels = re.findall(r"\[([^]]+)\]", ins)
+    weights = re.search(r"weights='([^']*)'", mix)
+    weights = [float(w) for w in weights.group(1).split()] if weights else [1.0] * len(labels)
+    # 每路混音输入追溯到源输入和它链上的音量
+    producers = {out: (re.findall(r"\[([^]]+)\]", src)[0], body) for src, body, out in chains}
+    gains = {}
+    for label, weight in zip(labels, weights):
+        src, body = producers.get(label, (label, ""))
+        vol = re.search(r"volume=([\d.]+)", body)
+        gains[src] = (float(vol.group(1)) if vol else 1.0, weight)
+    total = sum(w for src, (_, w) in gains.items() if src in active)
+    return {src: vol * w / total for src, (vol, w) in gains.items() if src in active}
+
+
+# ---------------- merge_setpts ----------------
+
+def test_merge_speedup_then_reset():
+    """PTS/1.2 之后的 PTS-STARTPTS 合成一个 setpts，STARTPTS 同样按 1.2 倍缩放"""
+    merged = merge_setpts([setpts("PTS/1.2"), setpts("PTS-STARTPTS")])
+    assert [str(f) for f in merged] == ["setpts=(PTS/1.2)-(STARTPTS/1.2)"]
+
+
+def test_merge_keeps_non_adjacent_setpts():
+    filters = [setpts("PTS/1.2"), Filter("fps", 30), setpts("PTS-STARTPTS")]
+    assert merge_setpts(filters) == filters
+
+
+def test_merge_skips_complex_expressions():
+    filters = [setpts("PTS/1.2"), setpts("N/(30*TB)")]
+    assert merge_setpts(filters) == filters
+
+
+# ---------------- hoist_timing ----------------
+
+def test_hoist_fps_when_it_lowers_rate():
+    """36fps 降到 30fps 是丢帧，提到缩放之前；已知尺寸一致时缩放/裁切随后被删掉"""
+    hoisted = hoist_timing(a_video_filters(), PORTRAIT_30)
+    assert names(hoisted) == ["setpts", "fps", "trim", "scale", "crop", "setsar", "setpts"]
+
+
+def test_hoist_keeps_fps_when_it_raises_rate():
+    """20fps 变速后 24fps，fps=30 是补帧，不能提前"""
+    filters = a_video_filters()
+    assert hoist_timing(filters, PORTRAIT_20) == filters
+
+
+def test_hoist_needs_source_fps():
+    filters = a_video_filters()
+    assert hoist_timing(filters, None) == filters
+
+
+# ---------------- drop_identity ----------------
+
+def test_drop_identity_scale_crop_for_portrait_source():
+    kept = drop_identity(normalize(), PORTRAIT_30)
+    assert [str(f) for f in kept] == ["setsar=1", "fps=30"]
+
+
+def test_drop_identity_keeps_scale_for_other_sizes():
+    assert drop_identity(normalize(), LANDSCAPE_30) == normalize()
+    assert drop_identity(normalize(), None) == normalize()
+
+
+def test_drop_identity_trivial_nodes():
+    filters = [setpts("PTS"), Filter("volume", "1.00"), Filter("trim", start=0), Filter("fps", 30)]
+    assert [str(f) for f in drop_identity(filters)] == ["fps=30"]
+
+
+def test_optimize_a_chain_for_portrait_source():
+    graph = FilterGraph()
+    graph.chain("0:v", a_video_filters(), "v0")
+    assert str(graph.optimize({"0:v": PORTRAIT_30})) == (
+        "[0:v]setpts=PTS/1.2,fps=30,trim=start=0.1667,setsar=1,setpts=PTS-STARTPTS[v0]")
+
+
+def test_optimize_keeps_label_when_chain_empties():
+    graph = FilterGraph()
+    graph.chain("2:a", [Filter("volume", "1.00")], "av")
+    assert str(graph.optimize()) == "[2:a]anull[av]"
+
+
+# ---------------- build_render_cmd ----------------
+
+def bed_inputs():
+    """解说 / BGM 换成缓存的底轨音轨，和引擎的 audio_bed 一致"""
+    inputs = make_inputs()
+    return replace(inputs, v=InputSpan("v.flac", 0.0, inputs.total), m=InputSpan("m.flac", 0.0, inputs.total))
+
+
+def test_render_cmd_title_layer_with_bed():
+    """预渲染标题 + 底轨音轨：输入顺序 A/B/解说/BGM/标题图层，底轨已循环好，不再带 -stream_loop"""
+    inputs = bed_inputs()
+    title = TitleLayer("t.png", 2.0, 8.0, 80, 3)
+    cmd = build_render_cmd("ffmpeg", make_job(), inputs, "out.mp4", sources={"0:v": PORTRAIT_30, "1:v": None},
+                           title=title)
+    assert cmd[:4] == ["ffmpeg", "-y", "-hwaccel", "auto"]
+    assert [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i"] == [
+        "a.mp4", "b.mp4", "v.flac", "m.flac", "t.png"]
+    assert "-stream_loop" not in cmd
+    assert cmd[cmd.index("t.png") - 9:cmd.index("t.png")] == [
+        "-loop", "1", "-framerate", "30", "-itsoffset", "2.000", "-t", "6.033", "-i"]
+    assert filter_complex(cmd) == (
+        "[0:v]setpts=PTS/1.2,fps=30,trim=start=0.1667,setsar=1,setpts=PTS-STARTPTS[v0];"
+        "[1:v]scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,setsar=1,fps=30[v1];"
+        "[v0][v1]xfade=transition=fade:duration=0.5:offset=8.50,format=yuv420p[vm];"
+        "[4:v]fade=t=in:st=2:d=1:alpha=1,fade=t=out:st=7:d=1:alpha=1[title];"
+        "[vm][title]overlay=x=0:y=207:eof_action=pass:enable='between(t,2,8)'[v_out];"
+        "[0:a]asetpts=PTS-STARTPTS,volume=50.00[a0];[2:a]volume=100.00[av];"
+        "[3:a]volume=30.00[am];[a0][av][am]amix=inputs=3:dropout_transition=0[a_out]")
+    assert cmd[cmd.index("-filter_complex") + 2:] == [
+        "-filter_complex_threads", "4", "-map", "[v_out]", "-map", "[a_out]",
+        "-c:v", "libx264", "-preset", "fast", "-crf", "20", "-threads", "4", "-t", "17.50", "out.mp4"]
+
+
+def test_render_cmd_drawtext_three_way_mix():
+    """没有标题图层和底轨：逐帧 drawtext，解说和循环 BGM 作为 2/3 路输入在成片里三路混音"""
+    cmd = build_render_cmd("ffmpeg", make_job(), make_inputs(), "out.mp4")
+    assert [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i"] == ["a.mp4", "b.mp4", "v.mp3", "m.mp3"]
+    assert cmd[cmd.index("m.mp3") - 5:cmd.index("m.mp3")] == ["-stream_loop", "-1", "-t", "17.533", "-i"]
+    graph = filter_complex(cmd)
+    assert ("[vm]drawtext=font=Arial:text='Hi':fontcolor=#FFA500:fontsize=80:borderw=3:bordercolor=#000000:"
+            "x=(w-text_w)/2:y=250:alpha='if(lt(t,2),0,if(lt(t,2+1),t-2,if(lt(t,8-1),1,if(lt(t,8),8-t,0))))'"
+            "[v_out];") in graph
+    assert graph.endswith("[0:a]asetpts=PTS-STARTPTS,volume=50.00[a0];[2:a]volume=100.00[av];"
+                          "[3:a]volume=30.00[am];[a0][av][am]amix=inputs=3:dropout_transition=0[a_out]")
+
+
+def test_render_cmd_title_layer_with_subtitles():
+    """标题图层在底轨之外时是 4:v，字幕叠在标题之后；B 中间件只对齐帧率/时间基"""
+    title = TitleLayer("t.png", 2.0, 8.0, 80, 3)
+    cmd = build_render_cmd("ffmpeg", make_job(), make_inputs(), "out.mp4", b_normalized=True, title=title,
+                           subtitles=subtitles_filter("s.srt", "Fontsize=24"))
+    assert [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i"] == [
+        "a.mp4", "b.mp4", "v.mp3", "m.mp3", "t.png"]
+    graph = filter_complex(cmd)
+    assert "[1:v]setsar=1,fps=30[v1];" in graph
+    assert ("[4:v]fade=t=in:st=2:d=1:alpha=1,fade=t=out:st=7:d=1:alpha=1[title];"
+            "[vm][title]overlay=x=0:y=207:eof_action=pass:enable='between(t,2,8)'[vt];"
+            "[vt]subtitles='s.srt':force_style='Fontsize=24'[v_out];") in graph
+    assert "drawtext" not in graph
+
+
+def test_render_cmd_custom_volumes_without_crf():
+    """vols 覆盖滑块音量；NVENC 等没有 CRF 的编码器不输出 -crf"""
+    job = make_job()
+    job["settings"] = {**job["settings"], "v_codec": "h264_nvenc", "v_preset": "p1", "crf": None}
+    cmd = build_render_cmd("ffmpeg", job, make_inputs(), "out.mp4", vols=(10, 20, 30))
+    assert "[0:a]asetpts=PTS-STARTPTS,volume=10.00[a0];[2:a]volume=20.00[av];[3:a]volume=30.00[am]" in (
+        filter_complex(cmd))
+    assert cmd[-11:-3] == ["-map", "[a_out]", "-c:v", "h264_nvenc", "-preset", "p1", "-threads", "4"]
+
+
+def test_bed_mix_gains_match_three_way_mix():
+    """底轨路径与直接三路混音在解说 / A 原音先后结束的各个阶段，每路输入的增益都相同"""
+    direct = filter_complex(build_render_cmd("ffmpeg", make_job(), make_inputs(), "out.mp4"))
+    bed = filter_complex(build_render_cmd("ffmpeg", make_job(), bed_inputs(), "out.mp4"))
+    for active in (("0:a", "2:a", "3:a"), ("0:a", "3:a"), ("2:a", "3:a"), ("3:a",)):
+        assert mix_gains(bed, active) == mix_gains(direct, active)
+    # 解说结束后 A 原音和 BGM 各占一半
+    assert mix_gains(bed, ("0:a", "3:a")) == {"0:a": 25.0, "3:a": 15.0}
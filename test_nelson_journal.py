@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+跑批日志指纹与续跑的单元测试
+只读写临时目录里的日志文件，不需要 ffmpeg
+"""
+from dataclasses import replace
+
+from nelson_engine import RenderConfig
+from nelson_journal import BatchJournal, batch_fingerprint
+
+FILES = {"a": ["1.mp4", "2.mp4"], "b": ["b.mp4"], "v": ["v.mp3"], "m": ["m.mp3"]}
+
+
+def make_jobs():
+    return [{"index": i, "header": f"任务 {i}", "settings": {"threads": 4}, "error": None} for i in (1, 2)]
+
+
+def test_resume_after_changing_runtime_limits(tmp_path):
+    """进程上限、重试次数、卡死判定只影响怎么跑，改了之后同一批仍然续跑，已完成的任务不重做"""
+    config = RenderConfig(max_processes=0, retry_attempts=3, stall_timeout=120)
+    journal = BatchJournal(str(tmp_path))
+    journal.start(batch_fingerprint(config, FILES), make_jobs())
+    journal.mark_done(1)
+
+    changed = replace(config, max_processes=2, retry_attempts=1, stall_timeout=0, max_workers=1)
+    jobs = BatchJournal(str(tmp_path)).load(batch_fingerprint(changed, FILES))
+    assert [(job["index"], job["done"]) for job in jobs] == [(1, True), (2, False)]
+
+
+def test_content_change_starts_new_batch(tmp_path):
+    """影响成片内容的配置变了就是新的一批，不沿用旧计划"""
+    config = RenderConfig()
+    journal = BatchJournal(str(tmp_path))
+    journal.start(batch_fingerprint(config, FILES), make_jobs())
+    assert journal.load(batch_fingerprint(replace(config, vol_a=80), FILES)) is None
+    assert journal.load(batch_fingerprint(config, {**FILES, "a": ["1.mp4"]})) is None
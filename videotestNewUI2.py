@@ -1,26 +1,18 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, colorchooser, scrolledtext
 import threading
-import subprocess
+import time
 import os
-import psutil
-import json
-import random
-import sys
 import ctypes
 try:
-    from PIL import Image, ImageDraw
+    from PIL import Image, ImageDraw, ImageTk
     HAS_PIL = True
 except ImportError:
     HAS_PIL = False
 
-# 资源路径定位函数
-def resource_path(relative_path):
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    # 获取当前脚本所在目录
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    return os.path.join(script_dir, relative_path)
+from nelson_engine import NelsonEngine, RenderConfig, find_tool
+from nelson_preview import PREVIEW_DEBOUNCE_MS, PREVIEW_H, PREVIEW_W, StylePreview, preview_source, preview_style
+from nelson_runner import SHUTDOWN_TIMEOUT, format_eta, get_runner
 
 
 class ModernButton(tk.Button):
@@ -322,6 +314,38 @@ class NelsonBatchStitcher:
                 "English": "🎵 BGM",
                 "中文": "🎵 BGM"
             },
+            "smart_render": {
+                "English": "⚡ Smart Render",
+                "中文": "⚡ 智能渲染(仅重编码转场)"
+            },
+            "chunked_render": {
+                "English": "🧩 Chunked Encode (long videos)",
+                "中文": "🧩 长视频分段并行"
+            },
+            "watch_mode": {
+                "English": "👁 Watch Folder A",
+                "中文": "👁 监控A目录"
+            },
+            "stop_watch": {
+                "English": "■ STOP WATCHING",
+                "中文": "■ 停止监控 A 目录"
+            },
+            "cancel_job": {
+                "English": "Cancel Selected Job",
+                "中文": "取消所选任务"
+            },
+            "stop_batch": {
+                "English": "■ Stop Batch",
+                "中文": "■ 停止整批"
+            },
+            "draft_btn": {
+                "English": "👁 Draft Preview (quick low-res style check)",
+                "中文": "👁 草稿预览（低清快速核对标题/字幕样式）"
+            },
+            "draft_busy": {
+                "English": "Rendering draft...",
+                "中文": "正在渲染草稿..."
+            },
             "start_btn": {
                 "English": "▶ START PROCESSING",
                 "中文": "▶ 一键执行全自动化剪辑"
@@ -378,8 +402,22 @@ class NelsonBatchStitcher:
                            foreground=self.text_primary, borderwidth=1, relief="solid", 
                            padding=3, font=("Segoe UI", 9))
 
+        # 渲染引擎（无界面），每次跑批新建一个
+        self.engine = None
+        self.watching = False
+        # 样式预览：防抖定时器、请求序号、已加载的图片（按文件路径缓存）
+        self.previewer = None
+        self._preview_after = None
+        self._preview_seq = 0
+        self._preview_images = {}
+
+        # 正在渲染、可以单独取消的任务序号
+        self.running_jobs = set()
+
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.setup_ui()
+        # 启动运行器时按登记文件清理上次崩溃留下的 ffmpeg，不阻塞界面
+        threading.Thread(target=get_runner, daemon=True).start()
 
     def setup_ui(self):
         # 优化头部 - 现代设计
@@ -487,6 +525,21 @@ class NelsonBatchStitcher:
                       bg=self.bg_primary, fg=self.text_primary, selectcolor=self.bg_primary, 
                       activebackground=self.bg_primary, font=("Segoe UI", 9)).pack(side="left", padx=10)
 
+        self.smart_render_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(switch_f, text=self.translations["smart_render"][self.current_language], variable=self.smart_render_var, 
+                      bg=self.bg_primary, fg=self.text_primary, selectcolor=self.bg_primary, 
+                      activebackground=self.bg_primary, font=("Segoe UI", 9)).pack(side="left", padx=10)
+
+        self.chunked_render_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(switch_f, text=self.translations["chunked_render"][self.current_language], variable=self.chunked_render_var, 
+                      bg=self.bg_primary, fg=self.text_primary, selectcolor=self.bg_primary, 
+                      activebackground=self.bg_primary, font=("Segoe UI", 9)).pack(side="left", padx=10)
+
+        self.watch_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(switch_f, text=self.translations["watch_mode"][self.current_language], variable=self.watch_var, 
+                      bg=self.bg_primary, fg=self.text_primary, selectcolor=self.bg_primary, 
+                      activebackground=self.bg_primary, font=("Segoe UI", 9)).pack(side="left", padx=10)
+
         # 03 样式控制中心
         self._add_section_title(main_container, self.translations["section_03"][self.current_language])
         style_f = tk.Frame(main_container, bg=self.bg_card, padx=18, pady=15)
@@ -565,6 +618,15 @@ class NelsonBatchStitcher:
         self.srt_border_scale = self._add_dark_scale(style_f, self.translations["subtitle_border_width"][self.current_language], 2, 0, 10, 8)
         self.srt_margin_scale = self._add_dark_scale(style_f, self.translations["subtitle_position"][self.current_language], 50, 0, 800, 9)
 
+        # 单帧样式预览（四分之一分辨率再缩小一半显示）
+        self._preview_blank = tk.PhotoImage(width=PREVIEW_W // 2, height=PREVIEW_H // 2)
+        self.preview_lbl = tk.Label(style_f, image=self._preview_blank, bg=self.bg_card, bd=1, relief="solid")
+        self.preview_lbl.grid(row=0, column=4, rowspan=10, padx=(12, 0), sticky="n")
+        for w in (self.sub_entry, self.time_start, self.time_end):
+            w.bind("<KeyRelease>", self.schedule_preview, add="+")
+        self.enable_srt_var.trace_add("write", self.schedule_preview)
+        self.schedule_preview()
+
         # 04 混音矩阵
         self._add_section_title(main_container, self.translations["section_04"][self.current_language])
         mix_f = tk.Frame(main_container, bg=self.bg_primary)
@@ -578,10 +640,34 @@ class NelsonBatchStitcher:
         bottom_frame = tk.Frame(self.root, bg=self.bg_primary, height=60)
         bottom_frame.pack(fill="x", side="bottom")
         
+        self.status_lbl = tk.Label(bottom_frame, text="", fg=self.text_secondary, bg=self.bg_primary,
+                                   font=("Consolas", 8), anchor="w")
+        self.status_lbl.pack(fill="x", padx=5)
+
         self.progress = ttk.Progressbar(bottom_frame, style="TProgressbar", 
                                        orient="horizontal", mode='determinate')
         self.progress.pack(fill="x")
 
+        # 任务控制：单独取消某个正在渲染的任务，或停止整批
+        ctrl_f = tk.Frame(bottom_frame, bg=self.bg_primary)
+        ctrl_f.pack(fill="x")
+        self.job_combo = ttk.Combobox(ctrl_f, values=[], state="readonly", width=10)
+        self.job_combo.pack(side="left", padx=5, pady=4)
+        ModernButton(ctrl_f, text=self.translations["cancel_job"][self.current_language],
+                     command=self.cancel_selected_job, button_type="secondary",
+                     font=("Segoe UI", 9), padx=12, pady=4).pack(side="left", padx=5, pady=4)
+        self.stop_btn = ModernButton(ctrl_f, text=self.translations["stop_batch"][self.current_language],
+                                     command=self.cancel_batch, button_type="danger",
+                                     font=("Segoe UI", 9), padx=12, pady=4)
+        self.stop_btn.pack(side="right", padx=5, pady=4)
+        self.stop_btn.set_disabled(True)
+
+        self.draft_btn = ModernButton(bottom_frame, text=self.translations["draft_btn"][self.current_language],
+                                     command=self.start_draft, button_type="secondary",
+                                     font=("Segoe UI", 9), padx=20, pady=6)
+        self.draft_btn.pack(fill="x", padx=0, pady=0)
+        self.draft_btn.set_disabled(True)
+
         self.run_btn = ModernButton(bottom_frame, text=self.translations["start_btn"][self.current_language], 
                                    command=self.start_thread, button_type="primary",
                                    font=("Segoe UI", 12, "bold"), padx=20, pady=15)
@@ -643,6 +729,7 @@ class NelsonBatchStitcher:
                     troughcolor=self.secondary_color, font=("Segoe UI", 8), 
                     activebackground=self.accent_color)
         s.set(val)
+        s.config(command=self.schedule_preview)
         s.grid(row=row, column=1, columnspan=3, sticky="ew", pady=8)
         return s
 
@@ -670,8 +757,12 @@ class NelsonBatchStitcher:
             srt_ready = (not self.enable_srt_var.get()) or (self.paths["srt"] != "")
             if base_ready and srt_ready: 
                 self.run_btn.set_disabled(False)
+                self.draft_btn.set_disabled(False)
             else:
                 self.run_btn.set_disabled(True)
+                self.draft_btn.set_disabled(True)
+            if key in ("a", "srt"):
+                self.schedule_preview()
 
     def handle_font_selection(self):
         font_mode = self.font_mode.get()
@@ -682,6 +773,7 @@ class NelsonBatchStitcher:
                 self.selected_font_path = f.replace("\\", "/")
                 self.selected_font_name = os.path.basename(f)
                 self.font_status_lbl.config(text="Single: " + self.selected_font_name)
+                self.schedule_preview()
         else:
             d = filedialog.askdirectory()
             if d: 
@@ -696,37 +788,144 @@ class NelsonBatchStitcher:
                 except:
                     self.font_status_lbl.config(text="Folder: " + os.path.basename(d))
 
+    def schedule_preview(self, *_):
+        """样式变化后停顿一小段时间才渲染，拖动滑块时不会连续启动 ffmpeg"""
+        if self._preview_after:
+            self.root.after_cancel(self._preview_after)
+        self._preview_after = self.root.after(PREVIEW_DEBOUNCE_MS, self.refresh_preview)
+
+    def refresh_preview(self):
+        self._preview_after = None
+        try:
+            config = self.build_config()
+        except (ValueError, tk.TclError):
+            return
+        self._preview_seq += 1
+        threading.Thread(target=self._render_preview, args=(config, self._preview_seq), daemon=True).start()
+
+    def _render_preview(self, config, seq):
+        if self.previewer is None:
+            self.previewer = StylePreview(find_tool('ffmpeg'))
+        try:
+            path = self.previewer.render(preview_source(config.paths.get("a", "")), preview_style(config))
+        except Exception as e:
+            print(f"Preview error: {str(e)}")
+            return
+        if path:
+            self.root.after(0, lambda: self._show_preview(path, seq))
+
+    def _show_preview(self, path, seq):
+        # 只显示最新一次请求的结果，旧请求晚到时直接丢弃
+        if seq != self._preview_seq:
+            return
+        img = self._preview_images.get(path)
+        if img is None:
+            img = (ImageTk.PhotoImage(Image.open(path).resize((PREVIEW_W // 2, PREVIEW_H // 2), Image.LANCZOS))
+                   if HAS_PIL else tk.PhotoImage(file=path).subsample(2))
+            if len(self._preview_images) >= 32:
+                self._preview_images.pop(next(iter(self._preview_images)))
+            self._preview_images[path] = img
+        try:
+            self.preview_lbl.config(image=img)
+        except tk.TclError:
+            pass
+
     def pick_color(self):
         c = colorchooser.askcolor(initialcolor=self.selected_color)[1]
-        if c: self.selected_color = c
+        if c: self.selected_color = c; self.schedule_preview()
 
     def pick_border_color(self):
         c = colorchooser.askcolor(initialcolor=self.selected_border_color)[1]
-        if c: self.selected_border_color = c
+        if c: self.selected_border_color = c; self.schedule_preview()
 
     def pick_srt_color(self):
         c = colorchooser.askcolor(initialcolor=self.srt_color)[1]
-        if c: self.srt_color = c
+        if c: self.srt_color = c; self.schedule_preview()
 
     def pick_srt_border_color(self):
         c = colorchooser.askcolor(initialcolor=self.srt_border_color)[1]
-        if c: self.srt_border_color = c
+        if c: self.srt_border_color = c; self.schedule_preview()
 
-    def get_duration(self, file_path):
-        try:
-            ffprobe_path = resource_path('ffprobe.exe')
-            if not os.path.exists(ffprobe_path):
-                print(f"Error: ffprobe.exe not found - {ffprobe_path}")
-                return 10.0
-            cmd = [ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', file_path]
-            res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            return float(json.loads(res.stdout)['format']['duration'])
-        except Exception as e:
-            print(f"Duration error: {str(e)}")
-            return 10.0
+    def build_config(self):
+        """把界面控件的当前值整理成引擎配置（在 Tk 主线程中调用）"""
+        effect_mode = self.effect_combo.get()
+        font_mode = self.font_mode.get()
+        return RenderConfig(
+            paths=dict(self.paths),
+            gpu="NVIDIA" in self.hw_mode.get(),
+            # 随机转场/随机字体同时支持英文和中文选项
+            effect="random" if ("Random" in effect_mode or "随机" in effect_mode) else effect_mode,
+            xfade_effects=list(self.xfade_effects),
+            random_color=self.random_color_var.get(),
+            enable_srt=self.enable_srt_var.get(),
+            smart_render=self.smart_render_var.get(),
+            chunked_render=self.chunked_render_var.get(),
+            random_font="Random" in font_mode or "随机" in font_mode,
+            font_name=self.selected_font_name,
+            font_file=self.selected_font_path,
+            title_text=self.sub_entry.get(),
+            time_start=float(self.time_start.get()),
+            time_end=float(self.time_end.get()),
+            title_size=self.size_scale.get(),
+            title_border=self.border_scale.get(),
+            title_color=self.selected_color,
+            title_border_color=self.selected_border_color,
+            srt_color=self.srt_color,
+            srt_border_color=self.srt_border_color,
+            srt_size=self.srt_size_scale.get(),
+            srt_border=self.srt_border_scale.get(),
+            srt_margin=self.srt_margin_scale.get(),
+            vol_a=self.vol_a.get(),
+            vol_v=self.vol_v.get(),
+            vol_m=self.vol_m.get(),
+            language=self.current_language,
+        )
 
     def start_thread(self):
-        threading.Thread(target=self.batch_process, daemon=True).start()
+        # 监控模式下按钮变为“停止监控”，已进入队列的任务会继续完成
+        if self.watching:
+            self.engine.stop_watch()
+            self.run_btn.set_disabled(True)
+            return
+        try:
+            config = self.build_config()
+        except ValueError:
+            messagebox.showerror("Invalid Input", "Please check the display time values")
+            return
+        threading.Thread(target=self.batch_process, args=(config,), daemon=True).start()
+
+    def start_draft(self):
+        try:
+            config = self.build_config()
+        except ValueError:
+            messagebox.showerror("Invalid Input", "Please check the display time values")
+            return
+        threading.Thread(target=self.draft_process, args=(config,), daemon=True).start()
+
+    def draft_process(self, config):
+        """只渲染标题前后的低清片段，确认样式后再执行正式跑批（沿用同样的随机样式）"""
+        try:
+            self.draft_btn.set_disabled(True)
+            self.draft_btn.config(text=self.translations["draft_busy"][self.current_language])
+            self.engine = NelsonEngine(config)
+            out_p, logs = self.engine.draft(
+                on_progress=lambda snap: self.root.after(0, lambda: self.progress.config(
+                    value=snap.get("fraction", 0) * 100)))
+            if out_p:
+                self.root.after(0, lambda: self.open_preview(out_p))
+            else:
+                self.show_final_report(logs)
+        finally:
+            self.draft_btn.set_disabled(False)
+            self.draft_btn.config(text=self.translations["draft_btn"][self.current_language])
+            self.progress['value'] = 0
+
+    def open_preview(self, path):
+        self.status_lbl.config(text=f"Draft: {path}")
+        try:
+            os.startfile(path)
+        except (AttributeError, OSError):
+            messagebox.showinfo("Draft Preview", f"Draft ready:\n{path}")
 
     def show_final_report(self, logs):
         report_win = tk.Toplevel(self.root)
@@ -750,158 +949,96 @@ class NelsonBatchStitcher:
             area.insert(tk.END, line + "\n" + "=" * 50 + "\n")
         area.configure(state='disabled')
 
-    def batch_process(self):
-        report_logs = []
+    def batch_process(self, config):
         try:
-            hw_mode = self.hw_mode.get()
-            if "NVIDIA" in hw_mode:
-                v_codec = "h264_nvenc"
-                v_preset = "p1"
-                hw_info = "⚡ NVIDIA GPU Acceleration"
-            else:
-                v_codec = "libx264"
-                v_preset = "fast"
-                hw_info = "🐢 CPU Compatible Mode"
-
-            def scan(d):
-                return sorted([f for f in os.listdir(d) if f.lower().endswith(('.mp4', '.mov', '.mp3', '.wav', '.m4a'))])
-
-            def scan_fonts(d):
-                return [os.path.join(d, f) for f in os.listdir(d) if f.lower().endswith(('.ttf', '.otf', '.ttc'))]
-
-            files_a, files_b = scan(self.paths["a"]), scan(self.paths["b"])
-            v_files, m_files = scan(self.paths["v"]), scan(self.paths["m"])
-
-            random_fonts = []
-            font_mode = self.font_mode.get()
-            # 检查是否启用随机字体模式（支持英文和中文）
-            if ("Random" in font_mode or "随机" in font_mode) and self.paths["font_dir"]:
-                random_fonts = scan_fonts(self.paths["font_dir"])
-
             self.run_btn.set_disabled(True)
-            self.run_btn.config(text="Processing... Please wait")
-            self.progress['maximum'] = len(files_a)
-
-            srt_file_path = self.paths["srt"].replace("\\", "/").replace(":", "\\:") if self.enable_srt_var.get() else ""
-
-            for index, name_a in enumerate(files_a):
-                if random_fonts:
-                    font_path = random.choice(random_fonts)
-                    font_basename = os.path.splitext(os.path.basename(font_path))[0]
-                    font_name = font_basename
-                else:
-                    font_name = self.selected_font_name
-                
-                title_c = "#{:06x}".format(random.randint(0, 0xFFFFFF)) if self.random_color_var.get() else self.selected_color
-                title_b_c = self.selected_border_color
-
-                srt_final_filter = ""
-                final_srt_color = "Disabled"
-                final_srt_border = "Disabled"
-
-                if self.enable_srt_var.get():
-                    if self.random_color_var.get():
-                        r, g, b = random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)
-                        srt_hex = f"#{r:02x}{g:02x}{b:02x}"
-                        srt_b_hex = "#000000"
-                    else:
-                        srt_hex, srt_b_hex = self.srt_color, self.srt_border_color
-
-                    final_srt_color = srt_hex
-                    final_srt_border = srt_b_hex
-                    s_h, s_b_h = srt_hex.lstrip('#'), srt_b_hex.lstrip('#')
-                    srt_color_ff = f"&H{s_h[4:6]}{s_h[2:4]}{s_h[0:2]}&"
-                    srt_border_ff = f"&H{s_b_h[4:6]}{s_b_h[2:4]}{s_b_h[0:2]}&"
-
-                    srt_final_filter = (
-                        f",subtitles='{srt_file_path}':force_style='Fontsize={self.srt_size_scale.get()},"
-                        f"PrimaryColour={srt_color_ff},OutlineColour={srt_border_ff},"
-                        f"BorderStyle=1,Outline={self.srt_border_scale.get()},Shadow=0,Alignment=2,"
-                        f"MarginV={self.srt_margin_scale.get()}'")
-
-                t_s, t_e = self.time_start.get(), self.time_end.get()
-
-                report_logs.append(
-                    f"Sequence: #{index + 1}\nFilename: {name_a}\nHardware: {hw_info}\n"
-                    f"【Title Settings】\n  - Font: {font_name}\n  - Color: {title_c}\n  - Border: {title_b_c}\n"
-                    f"  - Display Time: {t_s}s - {t_e}s\n"
-                    f"【Subtitle Settings】\n  - Color: {final_srt_color}\n  - Border: {final_srt_border}\n"
-                    f"  - Vertical Margin: {self.srt_margin_scale.get()}px"
-                )
-
-                effect_mode = self.effect_combo.get()
-                # 检查是否启用随机转场特效（支持英文和中文）
-                eff = random.choice(self.xfade_effects) if ("Random" in effect_mode or "随机" in effect_mode) else effect_mode
-
-                try:
-                    in_a = os.path.join(self.paths["a"], name_a)
-                    in_b = os.path.join(self.paths["b"], files_b[index % len(files_b)])
-                    in_v = os.path.join(self.paths["v"], random.choice(v_files))
-                    in_m = os.path.join(self.paths["m"], random.choice(m_files))
-                    out_p = os.path.join(self.paths["t"], f"Nelson_Output_{index + 1}.mp4")
-
-                    for fp, fname in [(in_a, "Video A"), (in_b, "Video B"), (in_v, "Voiceover"), (in_m, "BGM")]:
-                        if not os.path.exists(fp):
-                            report_logs.append(f"❌ File not found: {fname} - {fp}")
-                            raise FileNotFoundError(f"File not found: {fp}")
-
-                    d_a = self.get_duration(in_a) / 1.2
-                    off = max(0.1, (d_a - 1.5))
-
-                    alpha_exp = f"if(lt(t,{t_s}),0,if(lt(t,{t_s}+1),t-{t_s},if(lt(t,{t_e}-1),1,if(lt(t,{t_e}),{t_e}-t,0))))"
-
-                    drawtext_str = (f'drawtext=font={font_name}:text=\'{self.sub_entry.get()}\':'
-                                    f'fontcolor={title_c}:fontsize={self.size_scale.get()}:'
-                                    f'borderw={self.border_scale.get()}:bordercolor={title_b_c}:'
-                                    f'x=(w-text_w)/2:y=250:alpha=\'{alpha_exp}\'')
-
-                    f_str = (
-                        f"[0:v]setpts=PTS/1.2,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,setsar=1,fps=30,trim=start=1,setpts=PTS-STARTPTS[v0];"
-                        f"[1:v]scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,setsar=1,fps=30[v1];"
-                        f"[v0][v1]xfade=transition={eff}:duration=0.5:offset={off:.2f},format=yuv420p[vm];"
-                        f"[vm]{drawtext_str}{srt_final_filter}[v_out];"
-                        f"[0:a]atrim=start=1,asetpts=PTS-STARTPTS,volume={self.vol_a.get() / 100:.2f}[a0];"
-                        f"[2:a]volume={self.vol_v.get() / 100:.2f}[av];"
-                        f"[3:a]volume={self.vol_m.get() / 100:.2f}[am];"
-                        f"[a0][av][am]amix=inputs=3:dropout_transition=0[a_out]")
-
-                    ffmpeg_path = resource_path('ffmpeg.exe')
-                    if not os.path.exists(ffmpeg_path):
-                        report_logs.append(f"❌ ffmpeg.exe not found: {ffmpeg_path}")
-                        raise FileNotFoundError(f"ffmpeg.exe not found: {ffmpeg_path}")
-
-                    cmd = [ffmpeg_path, '-y', '-hwaccel', 'auto', '-i', in_a, '-i', in_b, '-i', in_v,
-                           '-stream_loop', '-1', '-i', in_m,
-                           '-filter_complex', f_str, '-map', '[v_out]', '-map', '[a_out]', '-c:v', v_codec,
-                           '-preset', v_preset, '-t', f"{(d_a + self.get_duration(in_b) - 2.5):.2f}", out_p]
-                    
-                    print("FFmpeg Command:", " ".join(cmd))
-                    result = subprocess.run(cmd, capture_output=True, text=True, errors='ignore')
-                    if result.returncode != 0:
-                        print("FFmpeg Error:", result.stderr)
-                        report_logs.append(f"❌ FFmpeg Failed: {result.stderr}")
-                        
-                except Exception as e:
-                    print("Batch Process Error:", str(e))
-                    report_logs.append(f"❌ Error: {str(e)}")
-                
-                self.progress['value'] = index + 1
-                self.root.update_idletasks()
-            
+            self.run_btn.config(text=self.translations["processing"][self.current_language])
+            self.progress['maximum'] = 100
+
+            # 探测进度在工作线程回调，同样投递到 Tk 主线程
+            def on_probe(done, total):
+                self.root.after(0, lambda: (self.progress.config(value=100 * done / total),
+                                            self.status_lbl.config(text=f"Probing media {done}/{total}...")))
+
+            # 实时进度：按预计成片时长加权汇总，节流后投递到 Tk 主线程
+            def on_update(index, snap, percent, eta):
+                text = f"Job #{index + 1} {snap.get('fraction', 0) * 100:.0f}%"
+                if snap.get("fps"):
+                    text += f" | {snap['fps']:.0f} fps | {snap['speed']:.2f}x | {snap['bitrate']}"
+                text += f" | Total {percent:.1f}% | ETA {format_eta(eta)}"
+                self.root.after(0, lambda: (self.progress.config(value=percent), self.status_lbl.config(text=text),
+                                            self._track_job(index, snap)))
+
+            self.engine = NelsonEngine(config)
+            self.stop_btn.set_disabled(False)
+            if self.watch_var.get():
+                report_logs = []
+
+                def on_result(index, job, logs):
+                    report_logs.extend(logs)
+                    name = os.path.basename(job.get("in_a", ""))
+                    self.root.after(0, lambda: self.status_lbl.config(text=f"Output #{index + 1}: {name}"))
+
+                self.watching = True
+                self.run_btn.set_disabled(False)
+                self.run_btn.config(text=self.translations["stop_watch"][self.current_language])
+                self.status_lbl.config(text="Watching folder A for new footage...")
+                self.engine.watch(on_update=on_update, on_result=on_result)
+            else:
+                report_logs = self.engine.run(on_probe=on_probe, on_update=on_update)
             self.show_final_report(report_logs)
         finally:
+            self.watching = False
             self.run_btn.set_disabled(False)
             self.run_btn.config(text="▶ START PROCESSING")
+            self.stop_btn.set_disabled(True)
+            self.running_jobs.clear()
+            self.job_combo.set("")
+            self.job_combo.config(values=[])
             self.progress['value'] = 0
+            self.status_lbl.config(text="")
+
+    def _track_job(self, index, snap):
+        """进度回调里出现的任务加入可取消列表，完成后移出（在 Tk 主线程中调用）"""
+        if snap.get("done") or snap.get("fraction", 0) >= 1:
+            self.running_jobs.discard(index)
+        else:
+            self.running_jobs.add(index)
+        self.job_combo.config(values=[f"#{i + 1}" for i in sorted(self.running_jobs)])
+
+    def cancel_selected_job(self):
+        """只停止所选任务自己的 ffmpeg 进程，其他任务继续渲染"""
+        sel = self.job_combo.get()
+        if not self.engine or not sel.startswith("#"):
+            return
+        index = int(sel[1:]) - 1
+        self.engine.cancel_job(index)
+        self.running_jobs.discard(index)
+        self.job_combo.set("")
+        self.job_combo.config(values=[f"#{i + 1}" for i in sorted(self.running_jobs)])
+
+    def cancel_batch(self):
+        """停止派发新任务并停止本程序启动的全部 ffmpeg，监控模式同时退出监控"""
+        if self.engine:
+            self.engine.cancel()
+        self.stop_btn.set_disabled(True)
 
     def on_closing(self):
-        for proc in psutil.process_iter(['name']):
-            try:
-                if "ffmpeg" in (proc.info['name'] or "").lower(): 
-                    proc.kill()
-            except:
-                pass
-        self.root.destroy()
+        # 只停止本程序启动并登记过的 ffmpeg（先发 q，超时再 terminate / kill），不再遍历整机进程；
+        # 停止流程可能要好几秒，先隐藏窗口，在 Tk 线程里轮询等进程退出，界面不会卡住
+        if self.engine:
+            self.engine.cancel()
+        runner = get_runner()
+        runner.cancel_all()
+        self.root.withdraw()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+
+        def _wait_exit():
+            if runner.idle() or time.monotonic() > deadline:
+                self.root.destroy()
+            else:
+                self.root.after(100, _wait_exit)
+        _wait_exit()
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,21 +1,14 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, colorchooser, scrolledtext
 import threading
-import subprocess
+import time
 import os
-import psutil
-import json
 import random
-import sys
 import ctypes
 
-# 资源路径定位函数
-def resource_path(relative_path):
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    # 获取当前脚本所在目录
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    return os.path.join(script_dir, relative_path)
+from nelson_engine import XFADE_EFFECTS, NelsonEngine, RenderConfig, find_tool
+from nelson_preview import PREVIEW_DEBOUNCE_MS, PREVIEW_H, PREVIEW_W, StylePreview, preview_source, preview_style
+from nelson_runner import SHUTDOWN_TIMEOUT, format_eta, get_runner
 
 class NelsonBatchStitcher:
     def __init__(self, main_root: tk.Tk):
@@ -48,15 +41,7 @@ class NelsonBatchStitcher:
         self.selected_font_path = "C:/Windows/Fonts/arialbd.ttf"
         self.selected_font_name = "Arial Bold"
 
-        self.xfade_effects = [
-            'fade', 'dissolve', 'pixelize', 
-            'wipeleft', 'wiperight', 'slideleft', 'slideright',
-            'circlecrop', 'circleopen', 'circleclose',
-            'vertopen', 'vertclose', 'horzopen', 'horzclose',
-            'diagtl', 'diagtr', 'diagbl', 'diagbr',
-            'hlslice', 'vrslice', 'hblur', 'fadegrays',
-            'smoothleft', 'smoothright', 'smoothup', 'smoothdown'
-        ]
+        self.xfade_effects = list(XFADE_EFFECTS)
         self.combo_options = ['随机模式'] + self.xfade_effects
 
         self.style = ttk.Style()
@@ -66,8 +51,22 @@ class NelsonBatchStitcher:
         self.style.configure("TCombobox", fieldbackground="#2a2a2a", background="#333333", foreground="white",
                              borderwidth=0)
 
+        # 渲染引擎（无界面），每次跑批新建一个
+        self.engine = None
+        self.watching = False
+        # 样式预览：防抖定时器、请求序号、已加载的图片（按文件路径缓存）
+        self.previewer = None
+        self._preview_after = None
+        self._preview_seq = 0
+        self._preview_images = {}
+
+        # 正在渲染、可以单独取消的任务序号
+        self.running_jobs = set()
+
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.setup_ui()
+        # 启动运行器时按登记文件清理上次崩溃留下的 ffmpeg，不阻塞界面
+        threading.Thread(target=get_runner, daemon=True).start()
 
     def setup_ui(self):
         header = tk.Frame(self.root, bg=self.theme_cyan, height=60)
@@ -138,6 +137,17 @@ class NelsonBatchStitcher:
         self.enable_srt_var = tk.BooleanVar(value=True)
         tk.Checkbutton(switch_f, text="开启字幕渲染", variable=self.enable_srt_var, bg=self.bg_dark, fg="#FFD700",
                        selectcolor=self.bg_dark, activebackground=self.bg_dark).pack(side="left", padx=5)
+        self.smart_render_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(switch_f, text="智能渲染(仅重编码转场)", variable=self.smart_render_var, bg=self.bg_dark,
+                       fg=self.theme_cyan, selectcolor=self.bg_dark, activebackground=self.bg_dark).pack(side="left",
+                                                                                                         padx=5)
+        self.chunked_render_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(switch_f, text="长视频分段并行", variable=self.chunked_render_var, bg=self.bg_dark,
+                       fg=self.theme_cyan, selectcolor=self.bg_dark, activebackground=self.bg_dark).pack(side="left",
+                                                                                                         padx=5)
+        self.watch_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(switch_f, text="监控A目录", variable=self.watch_var, bg=self.bg_dark, fg="#FFD700",
+                       selectcolor=self.bg_dark, activebackground=self.bg_dark).pack(side="left", padx=5)
 
         self._add_section_title(main_container, "03 | 样式控制中心")
         style_f = tk.Frame(main_container, bg=self.card_bg, padx=15, pady=15)
@@ -185,6 +195,15 @@ class NelsonBatchStitcher:
         self.srt_border_scale = self._add_dark_scale(style_f, "字幕描边粗", 2, 0, 10, 8)
         self.srt_margin_scale = self._add_dark_scale(style_f, "字幕位置(↑)", 50, 0, 800, 9)
 
+        # 单帧样式预览（四分之一分辨率再缩小一半显示）
+        self._preview_blank = tk.PhotoImage(width=PREVIEW_W // 2, height=PREVIEW_H // 2)
+        self.preview_lbl = tk.Label(style_f, image=self._preview_blank, bg="#000000", bd=0)
+        self.preview_lbl.grid(row=0, column=4, rowspan=10, padx=(10, 0), sticky="n")
+        for w in (self.sub_entry, self.time_start, self.time_end):
+            w.bind("<KeyRelease>", self.schedule_preview, add="+")
+        self.enable_srt_var.trace_add("write", self.schedule_preview)
+        self.schedule_preview()
+
         self._add_section_title(main_container, "04 | 混音矩阵")
         mix_f = tk.Frame(main_container, bg=self.bg_dark)
         mix_f.pack(fill="x")
@@ -196,9 +215,29 @@ class NelsonBatchStitcher:
         bottom_frame = tk.Frame(self.root, bg=self.bg_dark)
         bottom_frame.pack(fill="x", side="bottom")
         
+        self.status_lbl = tk.Label(bottom_frame, text="", fg="#888888", bg=self.bg_dark, font=("Consolas", 8),
+                                   anchor="w")
+        self.status_lbl.pack(fill="x", padx=5)
+
         self.progress = ttk.Progressbar(bottom_frame, style="TProgressbar", orient="horizontal", mode='determinate')
         self.progress.pack(fill="x")
 
+        # 任务控制：单独取消某个正在渲染的任务，或停止整批
+        ctrl_f = tk.Frame(bottom_frame, bg=self.bg_dark)
+        ctrl_f.pack(fill="x")
+        self.job_combo = ttk.Combobox(ctrl_f, values=[], state="readonly", width=10)
+        self.job_combo.pack(side="left", padx=5, pady=2)
+        tk.Button(ctrl_f, text="取消所选任务", command=self.cancel_selected_job, bg=self.bg_dark, fg="#FF6B6B",
+                  font=("Microsoft YaHei", 9), bd=0).pack(side="left", padx=5)
+        self.stop_btn = tk.Button(ctrl_f, text="■ 停止整批", command=self.cancel_batch, bg=self.bg_dark, fg="#FF6B6B",
+                                  font=("Microsoft YaHei", 9), bd=0, state="disabled")
+        self.stop_btn.pack(side="right", padx=5)
+
+        self.draft_btn = tk.Button(bottom_frame, text="草稿预览（低清快速核对标题/字幕样式）", command=self.start_draft,
+                                   bg=self.bg_dark, fg=self.theme_cyan, font=("Microsoft YaHei", 9), bd=0,
+                                   state="disabled")
+        self.draft_btn.pack(fill="x")
+
         self.run_btn = tk.Button(bottom_frame, text="一键执行全自动化剪辑", command=self.start_thread, bg=self.theme_cyan,
                                  fg="#000000", font=("Microsoft YaHei", 11, "bold"), bd=0, height=2, state="disabled")
         self.run_btn.pack(fill="x")
@@ -226,8 +265,8 @@ class NelsonBatchStitcher:
         entry = tk.Entry(frame, bg="#2a2a2a", fg=self.theme_cyan, insertbackground=self.theme_cyan, bd=0, width=8, justify="center", font=("Segoe UI", 9))
         entry.insert(0, str(val))
         entry.pack(side="left", padx=5)
-        # 同步滑块和输入框
-        scale.config(command=lambda v: entry.delete(0, tk.END) or entry.insert(0, v))
+        # 同步滑块和输入框，并刷新样式预览
+        scale.config(command=lambda v: entry.delete(0, tk.END) or entry.insert(0, v) or self.schedule_preview())
         def update_scale(event):
             try:
                 v = float(entry.get())
@@ -236,6 +275,7 @@ class NelsonBatchStitcher:
             except:
                 pass
         entry.bind("<KeyRelease>", update_scale)
+        entry.bind("<KeyRelease>", self.schedule_preview, add="+")
         return entry
 
     def _add_mini_vol(self, parent, label, val, col):
@@ -270,7 +310,11 @@ class NelsonBatchStitcher:
             self.path_labels[key].config(text="已连接 ✔", fg=self.theme_cyan)
             base_ready = all(self.paths[k] != "" for k in ["a", "b", "v", "m", "t"])
             srt_ready = (not self.enable_srt_var.get()) or (self.paths["srt"] != "")
-            if base_ready and srt_ready: self.run_btn.config(state="normal")
+            if base_ready and srt_ready:
+                self.run_btn.config(state="normal")
+                self.draft_btn.config(state="normal")
+            if key in ("a", "srt"):
+                self.schedule_preview()
 
     def handle_font_selection(self):
         if "单一" in self.font_mode.get():
@@ -302,38 +346,140 @@ class NelsonBatchStitcher:
                     pass
         except Exception:
             pass
+        self.schedule_preview()
+
+    def schedule_preview(self, *_):
+        """样式变化后停顿一小段时间才渲染，拖动滑块时不会连续启动 ffmpeg"""
+        if self._preview_after:
+            self.root.after_cancel(self._preview_after)
+        self._preview_after = self.root.after(PREVIEW_DEBOUNCE_MS, self.refresh_preview)
+
+    def refresh_preview(self):
+        self._preview_after = None
+        try:
+            config = self.build_config()
+        except (ValueError, tk.TclError):
+            return
+        self._preview_seq += 1
+        threading.Thread(target=self._render_preview, args=(config, self._preview_seq), daemon=True).start()
+
+    def _render_preview(self, config, seq):
+        if self.previewer is None:
+            self.previewer = StylePreview(find_tool('ffmpeg'))
+        try:
+            path = self.previewer.render(preview_source(config.paths.get("a", "")), preview_style(config))
+        except Exception as e:
+            print(f"预览异常: {str(e)}")
+            return
+        if path:
+            self.root.after(0, lambda: self._show_preview(path, seq))
+
+    def _show_preview(self, path, seq):
+        # 只显示最新一次请求的结果，旧请求晚到时直接丢弃
+        if seq != self._preview_seq:
+            return
+        img = self._preview_images.get(path)
+        if img is None:
+            img = tk.PhotoImage(file=path).subsample(2)
+            if len(self._preview_images) >= 32:
+                self._preview_images.pop(next(iter(self._preview_images)))
+            self._preview_images[path] = img
+        try:
+            self.preview_lbl.config(image=img)
+        except tk.TclError:
+            pass
 
     def pick_color(self):
         c = colorchooser.askcolor(initialcolor=self.selected_color)[1]
-        if c: self.selected_color = c
+        if c: self.selected_color = c; self.schedule_preview()
 
     def pick_border_color(self):
         c = colorchooser.askcolor(initialcolor=self.selected_border_color)[1]
-        if c: self.selected_border_color = c
+        if c: self.selected_border_color = c; self.schedule_preview()
 
     def pick_srt_color(self):
         c = colorchooser.askcolor(initialcolor=self.srt_color)[1]
-        if c: self.srt_color = c
+        if c: self.srt_color = c; self.schedule_preview()
 
     def pick_srt_border_color(self):
         c = colorchooser.askcolor(initialcolor=self.srt_border_color)[1]
-        if c: self.srt_border_color = c
+        if c: self.srt_border_color = c; self.schedule_preview()
+
+    def build_config(self):
+        """把界面控件的当前值整理成引擎配置（在 Tk 主线程中调用）"""
+        return RenderConfig(
+            paths=dict(self.paths),
+            gpu="NVIDIA" in self.hw_mode.get(),
+            effect="random" if "随机" in self.effect_combo.get() else self.effect_combo.get(),
+            xfade_effects=list(self.xfade_effects),
+            random_color=self.random_color_var.get(),
+            enable_srt=self.enable_srt_var.get(),
+            smart_render=self.smart_render_var.get(),
+            chunked_render=self.chunked_render_var.get(),
+            random_font="随机" in self.font_mode.get(),
+            font_name=self.selected_font_name,
+            font_file=self.selected_font_path,
+            title_text=self.sub_entry.get(),
+            time_start=float(self.time_start.get()),
+            time_end=float(self.time_end.get()),
+            title_size=int(float(self.size_scale.get())),
+            title_border=int(float(self.border_scale.get())),
+            title_color=self.selected_color,
+            title_border_color=self.selected_border_color,
+            srt_color=self.srt_color,
+            srt_border_color=self.srt_border_color,
+            srt_size=int(float(self.srt_size_scale.get())),
+            srt_border=int(float(self.srt_border_scale.get())),
+            srt_margin=int(float(self.srt_margin_scale.get())),
+            vol_a=float(self.vol_a.get()),
+            vol_v=float(self.vol_v.get()),
+            vol_m=float(self.vol_m.get()),
+            language="中文",
+        )
 
-    def get_duration(self, file_path):
+    def start_thread(self):
+        # 监控模式下按钮变为“停止监控”，已进入队列的任务会继续完成
+        if self.watching:
+            self.engine.stop_watch()
+            self.run_btn.config(state="disabled", text="正在停止监控...")
+            return
         try:
-            ffprobe_path = resource_path('ffprobe.exe')
-            if not os.path.exists(ffprobe_path):
-                print(f"错误: ffprobe.exe 不存在 - {ffprobe_path}")
-                return 10.0
-            cmd = [ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', file_path]
-            res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            return float(json.loads(res.stdout)['format']['duration'])
-        except Exception as e:
-            print(f"获取时长异常: {str(e)}")
-            return 10.0
+            config = self.build_config()
+        except ValueError:
+            messagebox.showerror("参数错误", "请检查显示时间、大小和音量等数值输入")
+            return
+        threading.Thread(target=self.batch_process, args=(config,), daemon=True).start()
 
-    def start_thread(self):
-        threading.Thread(target=self.batch_process, daemon=True).start()
+    def start_draft(self):
+        try:
+            config = self.build_config()
+        except ValueError:
+            messagebox.showerror("参数错误", "请检查显示时间、大小和音量等数值输入")
+            return
+        threading.Thread(target=self.draft_process, args=(config,), daemon=True).start()
+
+    def draft_process(self, config):
+        """只渲染标题前后的低清片段，确认样式后再执行正式跑批（沿用同样的随机样式）"""
+        try:
+            self.draft_btn.config(state="disabled", text="正在渲染草稿...")
+            self.engine = NelsonEngine(config)
+            out_p, logs = self.engine.draft(
+                on_progress=lambda snap: self.root.after(0, lambda: self.progress.config(
+                    value=snap.get("fraction", 0) * 100)))
+            if out_p:
+                self.root.after(0, lambda: self.open_preview(out_p))
+            else:
+                self.show_final_report(logs)
+        finally:
+            self.draft_btn.config(state="normal", text="草稿预览（低清快速核对标题/字幕样式）")
+            self.progress['value'] = 0
+
+    def open_preview(self, path):
+        self.status_lbl.config(text=f"草稿: {path}")
+        try:
+            os.startfile(path)
+        except (AttributeError, OSError):
+            messagebox.showinfo("草稿预览", f"草稿已生成：\n{path}")
 
     def show_final_report(self, logs):
         report_win = tk.Toplevel(self.root)
@@ -348,164 +494,94 @@ class NelsonBatchStitcher:
         for line in logs: area.insert(tk.END, line + "\n" + "=" * 50 + "\n")
         area.configure(state='disabled')
 
-    def batch_process(self):
-        report_logs = []
+    def batch_process(self, config):
         try:
-            if "NVIDIA" in self.hw_mode.get():
-                v_codec = "h264_nvenc";
-                v_preset = "p1";
-                hw_info = "⚡ NVIDIA GPU 加速"
-            else:
-                v_codec = "libx264";
-                v_preset = "fast";
-                hw_info = "🐢 兼容模式 (CPU)"
-
-            def scan(d):
-                return sorted(
-                    [f for f in os.listdir(d) if f.lower().endswith(('.mp4', '.mov', '.mp3', '.wav', '.m4a'))])
-
-            def scan_fonts(d):
-                return [os.path.join(d, f) for f in os.listdir(d) if f.lower().endswith(('.ttf', '.otf', '.ttc'))]
-
-            files_a, files_b = scan(self.paths["a"]), scan(self.paths["b"])
-            v_files, m_files = scan(self.paths["v"]), scan(self.paths["m"])
-
-            random_fonts = []
-            if "随机" in self.font_mode.get() and self.paths["font_dir"]:
-                random_fonts = scan_fonts(self.paths["font_dir"])
-
             self.run_btn.config(state="disabled", text="奈尔森引擎正在计算...")
-            self.progress['maximum'] = len(files_a)
-
-            srt_file_path = self.paths["srt"].replace("\\", "/").replace(":",
-                                                                         "\\:") if self.enable_srt_var.get() else ""
-
-            for index, name_a in enumerate(files_a):
-                # 获取随机字体名称（使用系统字体名，不用路径）
-                if random_fonts:
-                    font_path = random.choice(random_fonts)
-                    # 从路径提取字体名称（如 "C:\...\Impact.ttf" -> "Impact"）
-                    font_basename = os.path.splitext(os.path.basename(font_path))[0]
-                    font_name = font_basename
-                else:
-                    font_name = self.selected_font_name
-                
-                # 关键修复：使用系统字体名称而不是 fontfile 路径
-                # FFmpeg drawtext 过滤器在 filter_complex 中对 fontfile 参数有限制
-                # 改用 font 参数，传入系统字体名称（更稳定）
-
-                title_c = "#{:06x}".format(
-                    random.randint(0, 0xFFFFFF)) if self.random_color_var.get() else self.selected_color
-                title_b_c = self.selected_border_color
-
-                srt_final_filter = ""
-                final_srt_color = "未开启";
-                final_srt_border = "未开启"
-
-                if self.enable_srt_var.get():
-                    if self.random_color_var.get():
-                        r, g, b = random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)
-                        srt_hex = f"#{r:02x}{g:02x}{b:02x}";
-                        srt_b_hex = "#000000"
-                    else:
-                        srt_hex, srt_b_hex = self.srt_color, self.srt_border_color
-
-                    final_srt_color = srt_hex;
-                    final_srt_border = srt_b_hex
-                    s_h, s_b_h = srt_hex.lstrip('#'), srt_b_hex.lstrip('#')
-                    srt_color_ff = f"&H{s_h[4:6]}{s_h[2:4]}{s_h[0:2]}&"
-                    srt_border_ff = f"&H{s_b_h[4:6]}{s_b_h[2:4]}{s_b_h[0:2]}&"
-
-                    srt_final_filter = (
-                        f",subtitles='{srt_file_path}':force_style='Fontsize={int(self.srt_size_scale.get())},"
-                        f"PrimaryColour={srt_color_ff},OutlineColour={srt_border_ff},"
-                        f"BorderStyle=1,Outline={int(self.srt_border_scale.get())},Shadow=0,Alignment=2,"
-                        f"MarginV={int(self.srt_margin_scale.get())}'")
-
-                # 获取用户设定的标题出现时间
-                t_s, t_e = self.time_start.get(), self.time_end.get()
-
-                # 报告信息：补齐标题出现时间
-                report_logs.append(
-                    f"视频序号: #{index + 1}\n文件名: {name_a}\n动力模式: {hw_info}\n"
-                    f"【标题属性】\n  - 字体: {font_name}\n  - 颜色: {title_c}\n  - 描边: {title_b_c}\n"
-                    f"  - 出现时间: {t_s}s - {t_e}s\n"
-                    f"【字幕属性】\n  - 颜色: {final_srt_color}\n  - 描边: {final_srt_border}\n"
-                    f"  - 垂直边距: {int(self.srt_margin_scale.get())}px"
-                )
-
-                eff = random.choice(
-                    self.xfade_effects) if "随机" in self.effect_combo.get() else self.effect_combo.get()
-
-                try:
-                    in_a, in_b = os.path.join(self.paths["a"], name_a), os.path.join(self.paths["b"],
-                                                                                     files_b[index % len(files_b)])
-                    in_v, in_m = os.path.join(self.paths["v"], random.choice(v_files)), os.path.join(self.paths["m"],
-                                                                                                     random.choice(
-                                                                                                         m_files))
-                    out_p = os.path.join(self.paths["t"], f"Nelson_Output_{index + 1}.mp4")
-
-                    # 检查输入文件是否存在
-                    for fp, fname in [(in_a, "视频A"), (in_b, "视频B"), (in_v, "解说"), (in_m, "BGM")]:
-                        if not os.path.exists(fp):
-                            report_logs.append(f"❌ 文件不存在: {fname} - {fp}")
-                            raise FileNotFoundError(f"文件不存在: {fp}")
-
-                    d_a = self.get_duration(in_a) / 1.2;
-                    off = max(0.1, (d_a - 1.5))
-
-                    # 动态时间 alpha 表达式
-                    alpha_exp = f"if(lt(t,{t_s}),0,if(lt(t,{t_s}+1),t-{t_s},if(lt(t,{t_e}-1),1,if(lt(t,{t_e}),{t_e}-t,0))))"
-
-                    # 关键修复：用 font 参数（系统字体名称）而不是 fontfile（路径）
-                    # 这样避免了 filter_complex 中路径特殊字符的解析问题
-                    drawtext_str = (f'drawtext=font={font_name}:text=\'{self.sub_entry.get()}\':'
-                                    f'fontcolor={title_c}:fontsize={int(self.size_scale.get())}:'
-                                    f'borderw={int(self.border_scale.get())}:bordercolor={title_b_c}:'
-                                    f'x=(w-text_w)/2:y=250:alpha=\'{alpha_exp}\'')
-
-                    f_str = (
-                        f"[0:v]setpts=PTS/1.2,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,setsar=1,fps=30,trim=start=1,setpts=PTS-STARTPTS[v0];"
-                        f"[1:v]scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,setsar=1,fps=30[v1];"
-                        f"[v0][v1]xfade=transition={eff}:duration=0.5:offset={off:.2f},format=yuv420p[vm];"
-                        f"[vm]{drawtext_str}{srt_final_filter}[v_out];"
-                        f"[0:a]atrim=start=1,asetpts=PTS-STARTPTS,volume={float(self.vol_a.get()) / 100:.2f}[a0];"
-                        f"[2:a]volume={float(self.vol_v.get()) / 100:.2f}[av];"
-                        f"[3:a]volume={float(self.vol_m.get()) / 100:.2f}[am];"
-                        f"[a0][av][am]amix=inputs=3:dropout_transition=0[a_out]")
-
-                    ffmpeg_path = resource_path('ffmpeg.exe')
-                    if not os.path.exists(ffmpeg_path):
-                        report_logs.append(f"❌ ffmpeg.exe 不存在: {ffmpeg_path}")
-                        raise FileNotFoundError(f"ffmpeg.exe 不存在: {ffmpeg_path}")
-
-                    cmd = [ffmpeg_path, '-y', '-hwaccel', 'auto', '-i', in_a, '-i', in_b, '-i', in_v,
-                           '-stream_loop', '-1', '-i', in_m,
-                           '-filter_complex', f_str, '-map', '[v_out]', '-map', '[a_out]', '-c:v', v_codec,
-                           '-preset', v_preset, '-t', f"{(d_a + self.get_duration(in_b) - 2.5):.2f}", out_p]
-                    # 打印命令和错误输出，便于排查
-                    print("FFmpeg 命令：", " ".join(cmd))
-                    result = subprocess.run(cmd, capture_output=True, text=True, errors='ignore')
-                    if result.returncode != 0:
-                        print("FFmpeg 错误输出：", result.stderr)
-                        report_logs.append(f"❌ FFmpeg 执行失败: {result.stderr}")
-                except Exception as e:
-                    print("批处理异常：", str(e))
-                    report_logs.append(f"❌ 批处理异常: {str(e)}")
-                self.progress['value'] = index + 1;
-                self.root.update_idletasks()
+            self.progress['maximum'] = 100
+
+            # 探测进度在工作线程回调，同样投递到 Tk 主线程
+            def on_probe(done, total):
+                text = f"正在探测素材 {done}/{total}..." if done < total else "奈尔森引擎正在计算..."
+                self.root.after(0, lambda: (self.progress.config(value=100 * done / total),
+                                            self.run_btn.config(text=text)))
+
+            # 实时进度：按预计成片时长加权汇总，节流后投递到 Tk 主线程
+            def on_update(index, snap, percent, eta):
+                text = f"任务 #{index + 1} {snap.get('fraction', 0) * 100:.0f}%"
+                if snap.get("fps"):
+                    text += f" | {snap['fps']:.0f} fps | {snap['speed']:.2f}x | {snap['bitrate']}"
+                text += f" | 整体 {percent:.1f}% | 剩余 {format_eta(eta)}"
+                self.root.after(0, lambda: (self.progress.config(value=percent), self.status_lbl.config(text=text),
+                                            self._track_job(index, snap)))
+
+            self.engine = NelsonEngine(config)
+            self.stop_btn.config(state="normal")
+            if self.watch_var.get():
+                report_logs = []
+
+                def on_result(index, job, logs):
+                    report_logs.extend(logs)
+                    name = os.path.basename(job.get("in_a", ""))
+                    self.root.after(0, lambda: self.status_lbl.config(text=f"已输出 #{index + 1}: {name}"))
+
+                self.watching = True
+                self.run_btn.config(state="normal", text="■ 停止监控 A 目录")
+                self.status_lbl.config(text="正在监控 A 目录，等待新素材...")
+                self.engine.watch(on_update=on_update, on_result=on_result)
+            else:
+                report_logs = self.engine.run(on_probe=on_probe, on_update=on_update)
             self.show_final_report(report_logs)
         finally:
+            self.watching = False
             self.run_btn.config(state="normal", text="一键执行全自动化剪辑")
+            self.stop_btn.config(state="disabled")
+            self.running_jobs.clear()
+            self.job_combo.set("")
+            self.job_combo.config(values=[])
             self.progress['value'] = 0
+            self.status_lbl.config(text="")
+
+    def _track_job(self, index, snap):
+        """进度回调里出现的任务加入可取消列表，完成后移出（在 Tk 主线程中调用）"""
+        if snap.get("done") or snap.get("fraction", 0) >= 1:
+            self.running_jobs.discard(index)
+        else:
+            self.running_jobs.add(index)
+        self.job_combo.config(values=[f"#{i + 1}" for i in sorted(self.running_jobs)])
+
+    def cancel_selected_job(self):
+        """只停止所选任务自己的 ffmpeg 进程，其他任务继续渲染"""
+        sel = self.job_combo.get()
+        if not self.engine or not sel.startswith("#"):
+            return
+        index = int(sel[1:]) - 1
+        self.engine.cancel_job(index)
+        self.running_jobs.discard(index)
+        self.job_combo.set("")
+        self.job_combo.config(values=[f"#{i + 1}" for i in sorted(self.running_jobs)])
+
+    def cancel_batch(self):
+        """停止派发新任务并停止本程序启动的全部 ffmpeg，监控模式同时退出监控"""
+        if self.engine:
+            self.engine.cancel()
+        self.stop_btn.config(state="disabled")
 
     def on_closing(self):
-        for proc in psutil.process_iter(['name']):
-            try:
-                if "ffmpeg" in (proc.info['name'] or "").lower(): proc.kill()
-            except:
-                pass
-        self.root.destroy()
+        # 只停止本程序启动并登记过的 ffmpeg（先发 q，超时再 terminate / kill），不再遍历整机进程；
+        # 停止流程可能要好几秒，先隐藏窗口，在 Tk 线程里轮询等进程退出，界面不会卡住
+        if self.engine:
+            self.engine.cancel()
+        runner = get_runner()
+        runner.cancel_all()
+        self.root.withdraw()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+
+        def _wait_exit():
+            if runner.idle() or time.monotonic() > deadline:
+                self.root.destroy()
+            else:
+                self.root.after(100, _wait_exit)
+        _wait_exit()
 
 if __name__ == "__main__":
     root = tk.Tk();